@@ -5,24 +5,34 @@
 @Author  : alexanderwu
 @File    : action.py
 """
-import re
+import json
 from abc import ABC
-from typing import Optional
+from typing import AsyncIterator, Optional
 
+from pydantic import BaseModel
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 from metagpt.actions.action_output import ActionOutput
-from metagpt.llm import LLM
+from metagpt.llm import LLM, get_llm
 from metagpt.logs import logger
-from metagpt.utils.common import OutputParser
-from metagpt.utils.custom_decoder import CustomDecoder
+from metagpt.provider.hedging import hedging
+from metagpt.provider.resilience import retry_if_not_llm_error
+from metagpt.utils.metrics import metric_tags
+from metagpt.utils.output_repair import (
+    OutputParseError,
+    build_repair_prompt,
+    parse_sections,
+    repair_and_parse,
+)
 
 
 class Action(ABC):
+    hedge = False  # hedge the LLM requests when LLM_HEDGE is on, for actions on the critical path
+
     def __init__(self, name: str = "", context=None, llm: LLM = None):
         self.name: str = name
         if llm is None:
-            llm = LLM()
+            llm = get_llm()
         self.llm = llm
         self.context = context
         self.prefix = ""
@@ -47,9 +57,29 @@ class Action(ABC):
         if not system_msgs:
             system_msgs = []
         system_msgs.append(self.prefix)
-        return await self.llm.aask(prompt, system_msgs)
+        with hedging(self.hedge), metric_tags(action=type(self).__name__):
+            return await self.llm.aask(prompt, system_msgs)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
+    async def _aask_stream(self, prompt: str, system_msgs: Optional[list[str]] = None) -> AsyncIterator[str]:
+        """Streaming version of `_aask`, yield the answer in deltas as they arrive"""
+        if not system_msgs:
+            system_msgs = []
+        system_msgs.append(self.prefix)
+        stream = self.llm.aask_stream(prompt, system_msgs)
+        try:
+            while True:
+                # set around each step only, never across a yield: a consumer abandoning the stream would
+                # otherwise leave them set, or reset them from another context
+                with hedging(self.hedge), metric_tags(action=type(self).__name__):
+                    try:
+                        delta = await stream.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield delta
+        finally:
+            await stream.aclose()
+
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), retry=retry_if_not_llm_error)
     async def _aask_v1(
         self,
         prompt: str,
@@ -58,31 +88,46 @@ class Action(ABC):
         system_msgs: Optional[list[str]] = None,
         format="markdown",  # compatible to original format
     ) -> ActionOutput:
-        """Append default prefix"""
+        """Append default prefix. With format "function", the output schema derived from the mapping is sent
+        through the provider's function calling, and the answer is parsed as json"""
         if not system_msgs:
             system_msgs = []
         system_msgs.append(self.prefix)
-        content = await self.llm.aask(prompt, system_msgs)
+        with hedging(self.hedge), metric_tags(action=type(self).__name__):
+            if format == "function":
+                function = ActionOutput.create_function(output_class_name, output_data_mapping)
+                content = await self.llm.aask_function(prompt, function, system_msgs)
+                format = "json"
+            else:
+                content = await self.llm.aask(prompt, system_msgs)
         logger.debug(content)
         output_class = ActionOutput.create_model_class(output_class_name, output_data_mapping)
 
-        if format == "json":
-            pattern = r"\[CONTENT\](\s*\{.*?\}\s*)\[/CONTENT\]"
-            matches = re.findall(pattern, content, re.DOTALL)
-
-            for match in matches:
-                if match:
-                    content = match
-                    break
-
-            parsed_data = CustomDecoder(strict=False).decode(content)
-
-        else:  # using markdown parser
-            parsed_data = OutputParser.parse_data_with_mapping(content, output_data_mapping)
+        try:
+            content, instruct_content = repair_and_parse(content, output_class, output_data_mapping, format)
+        except OutputParseError as e:
+            logger.warning(f"{output_class_name} answer could not be parsed, asking to rewrite {e.bad_fields}")
+            content, instruct_content = await self._repair_with_llm(e, output_class, output_data_mapping, format)
+        logger.debug(instruct_content)
+        return ActionOutput(content, instruct_content)
 
+    async def _repair_with_llm(
+        self, error: OutputParseError, output_class, output_data_mapping: dict, format="markdown"
+    ) -> tuple[str, BaseModel]:
+        """Have only the bad sections rewritten, then merge them into the rest of the answer"""
+        prompt = build_repair_prompt(error, output_data_mapping, format)
+        with metric_tags(action=type(self).__name__):
+            fix = await self.llm.aask(prompt, [self.prefix])
+        bad_mapping = {i: output_data_mapping[i] for i in error.bad_fields}
+        parsed_data = {**error.parsed_data, **parse_sections(fix, bad_mapping, format)}
         logger.debug(parsed_data)
         instruct_content = output_class(**parsed_data)
-        return ActionOutput(content, instruct_content)
+        if format == "json":
+            content = json.dumps(parsed_data, ensure_ascii=False, indent=4)
+        else:
+            # later sections override earlier ones of the same name when parsed again
+            content = f"{error.content.rstrip()}\n\n{fix.strip()}\n"
+        return content, instruct_content
 
     async def run(self, *args, **kwargs):
         """Run action"""
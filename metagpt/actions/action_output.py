@@ -6,21 +6,53 @@
 @File    : action_output
 """
 
-from typing import Dict, Type
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Type
 
 from pydantic import BaseModel, create_model, root_validator, validator
 
 
+def _canonical(value) -> Hashable:
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
 class ActionOutput:
     content: str
     instruct_content: BaseModel
 
+    # model classes by class name and mapping, the least recently used dropped beyond MODEL_CLASS_CACHE_SIZE
+    MODEL_CLASS_CACHE_SIZE = 256
+    _model_classes: OrderedDict = OrderedDict()
+    _model_classes_lock = threading.Lock()
+
     def __init__(self, content: str, instruct_content: BaseModel):
         self.content = content
         self.instruct_content = instruct_content
 
     @classmethod
     def create_model_class(cls, class_name: str, mapping: Dict[str, Type]):
+        """The model class of the mapping, created once for a given class name and mapping"""
+        key = (class_name, tuple((k, _canonical(v)) for k, v in mapping.items()))
+        with cls._model_classes_lock:
+            new_class = cls._model_classes.get(key)
+            if new_class is not None:
+                cls._model_classes.move_to_end(key)
+                return new_class
+        new_class = cls._create_model_class(class_name, dict(mapping))
+        with cls._model_classes_lock:
+            new_class = cls._model_classes.setdefault(key, new_class)
+            while len(cls._model_classes) > cls.MODEL_CLASS_CACHE_SIZE:
+                cls._model_classes.popitem(last=False)
+        return new_class
+
+    @classmethod
+    def _create_model_class(cls, class_name: str, mapping: Dict[str, Type]):
         new_class = create_model(class_name, **mapping)
 
         @validator('*', allow_reuse=True)
@@ -40,4 +72,15 @@ class ActionOutput:
         new_class.__validator_check_name = classmethod(check_name)
         new_class.__root_validator_check_missing_fields = classmethod(check_missing_fields)
         return new_class
-    
\ No newline at end of file
+    
+    @classmethod
+    def create_function(cls, class_name: str, mapping: Dict[str, Type]) -> dict:
+        """An OpenAI function definition whose parameters are the JSON schema of the mapping"""
+        schema = copy.deepcopy(cls.create_model_class(class_name, mapping).schema())  # the class caches its schema
+        for field in schema["properties"].values():
+            field.pop("title", None)  # the same as the property name
+        return {
+            "name": class_name,
+            "description": f"Output the {class_name}, each section as an argument",
+            "parameters": {"type": "object", "properties": schema["properties"], "required": schema["required"]},
+        }
@@ -150,6 +150,8 @@ OUTPUT_MAPPING = {
 
 
 class WriteDesign(Action):
+    hedge = True
+
     def __init__(self, name, context=None, llm=None):
         super().__init__(name, context, llm)
         self.desc = (
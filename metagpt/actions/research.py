@@ -10,6 +10,7 @@ from pydantic import parse_obj_as
 
 from metagpt.actions import Action
 from metagpt.config import CONFIG
+from metagpt.llm import LLM, get_llm
 from metagpt.logs import logger
 from metagpt.tools.search_engine import SearchEngine
 from metagpt.tools.web_browser_engine import WebBrowserEngine, WebBrowserEngineType
@@ -174,13 +175,16 @@ class WebBrowseAndSummarize(Action):
     """Action class to explore the web and provide summaries of articles and webpages."""
     def __init__(
         self,
-        *args,
+        name: str = "",
+        context=None,
+        llm: LLM = None,
+        *,
         browse_func: Callable[[list[str]], None] | None = None,
-        **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        if CONFIG.model_for_researcher_summary:
-            self.llm.model = CONFIG.model_for_researcher_summary
+        if llm is None:
+            # deterministic, so that summaries of the same pages requested concurrently are coalesced
+            llm = get_llm(CONFIG.model_for_researcher_summary, temperature=0)
+        super().__init__(name, context, llm)
         self.web_browser_engine = WebBrowserEngine(
             engine=WebBrowserEngineType.CUSTOM if browse_func else None,
             run_func=browse_func,
@@ -238,10 +242,10 @@ class WebBrowseAndSummarize(Action):
 
 class ConductResearch(Action):
     """Action class to conduct research and generate a research report."""
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if CONFIG.model_for_researcher_report:
-            self.llm.model = CONFIG.model_for_researcher_report
+    def __init__(self, name: str = "", context=None, llm: LLM = None):
+        if llm is None:
+            llm = get_llm(CONFIG.model_for_researcher_report, auto_max_tokens=True)
+        super().__init__(name, context, llm)
 
     async def run(
         self,
@@ -261,7 +265,6 @@ class ConductResearch(Action):
         """
         prompt = CONDUCT_RESEARCH_PROMPT.format(topic=topic, content=content)
         logger.debug(prompt)
-        self.llm.auto_max_tokens = True
         return await self._aask(prompt, [system_text])
 
 
@@ -9,6 +9,7 @@ from metagpt.actions import WriteDesign
 from metagpt.actions.action import Action
 from metagpt.const import WORKSPACE_ROOT
 from metagpt.logs import logger
+from metagpt.provider.resilience import retry_if_not_llm_error
 from metagpt.schema import Message
 from metagpt.utils.common import CodeParser
 from tenacity import retry, stop_after_attempt, wait_fixed
@@ -43,6 +44,8 @@ ATTENTION: Use '##' to SPLIT SECTIONS, not '#'. Output format carefully referenc
 
 
 class WriteCode(Action):
+    hedge = True
+
     def __init__(self, name="WriteCode", context: list[Message] = None, llm=None):
         super().__init__(name, context, llm)
 
@@ -66,7 +69,7 @@ class WriteCode(Action):
         code_path.write_text(code)
         logger.info(f"Saving Code to {code_path}")
 
-    @retry(stop=stop_after_attempt(2), wait=wait_fixed(1))
+    @retry(stop=stop_after_attempt(2), wait=wait_fixed(1), retry=retry_if_not_llm_error)
     async def write_code(self, prompt):
         code_rsp = await self._aask(prompt)
         code = CodeParser.parse_code(block="", text=code_rsp)
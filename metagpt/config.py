@@ -57,12 +57,14 @@ class Config(metaclass=Singleton):
         self.openai_api_type = self._get("OPENAI_API_TYPE")
         self.openai_api_version = self._get("OPENAI_API_VERSION")
         self.openai_api_rpm = self._get("RPM", 3)
+        self.openai_api_tpm = self._get("TPM", 0)
         self.openai_api_model = self._get("OPENAI_API_MODEL", "gpt-4")
         self.max_tokens_rsp = self._get("MAX_TOKENS", 2048)
         self.deployment_name = self._get("DEPLOYMENT_NAME")
         self.deployment_id = self._get("DEPLOYMENT_ID")
 
         self.claude_api_key = self._get("Anthropic_API_KEY")
+        self.claude_api_model = self._get("Anthropic_API_MODEL", "claude-2")
         self.serpapi_api_key = self._get("SERPAPI_API_KEY")
         self.serper_api_key = self._get("SERPER_API_KEY")
         self.google_api_key = self._get("GOOGLE_API_KEY")
@@ -75,6 +77,13 @@ class Config(metaclass=Singleton):
         self.long_term_memory = self._get("LONG_TERM_MEMORY", False)
         if self.long_term_memory:
             logger.warning("LONG_TERM_MEMORY is True")
+        self.mem_wal_batch = int(self._get("MEM_WAL_BATCH", 16))
+        self.mem_wal_interval = float(self._get("MEM_WAL_INTERVAL", 1))
+        self.mem_compact_every = int(self._get("MEM_COMPACT_EVERY", 256))
+        self.embedding_cache_path = self._get("EMBEDDING_CACHE_PATH", "")
+        self.embedding_cache_max_entries = int(self._get("EMBEDDING_CACHE_MAX_ENTRIES", 10000))
+        self.embedding_batch_window = float(self._get("EMBEDDING_BATCH_WINDOW", 0))
+        self.embedding_batch_size = int(self._get("EMBEDDING_BATCH_SIZE", 256))
         self.max_budget = self._get("MAX_BUDGET", 10.0)
         self.total_cost = 0.0
 
@@ -88,6 +97,19 @@ class Config(metaclass=Singleton):
 
         self.prompt_format = self._get("PROMPT_FORMAT", "markdown")
 
+        self.llm_cache = self._get("LLM_CACHE", False)
+        self.llm_cache_path = self._get("LLM_CACHE_PATH", "")
+        self.llm_cache_max_entries = self._get("LLM_CACHE_MAX_ENTRIES", 10000)
+        self.llm_cache_ttl = self._get("LLM_CACHE_TTL", 0)
+        self.llm_cache_replay_only = self._get("LLM_CACHE_REPLAY_ONLY", False)
+        self.llm_coalesce = self._get("LLM_COALESCE", False)
+        self.llm_max_attempts = int(self._get("LLM_MAX_ATTEMPTS", 6))
+        self.llm_timeout = self._get("LLM_TIMEOUT", 0)
+        self.llm_hedge = self._get("LLM_HEDGE", False)
+        self.llm_hedge_percentile = float(self._get("LLM_HEDGE_PERCENTILE", 95))
+        self.llm_hedge_delay = float(self._get("LLM_HEDGE_DELAY", 30))
+        self.metrics_path = self._get("METRICS_PATH", "")
+
     def _init_with_config_files_and_env(self, configs: dict, yaml_file):
         """Load from config/key.yaml, config/config.yaml, and env in decreasing order of priority"""
         configs.update(os.environ)
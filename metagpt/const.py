@@ -36,6 +36,8 @@ YAPI_URL = "http://yapi.deepwisdomai.com/"
 TMP = PROJECT_ROOT / "tmp"
 RESEARCH_PATH = DATA_PATH / "research"
 TUTORIAL_PATH = DATA_PATH / "tutorial_docx"
+LLM_CACHE_PATH = DATA_PATH / "llm_cache/llm_cache.db"
+EMBEDDING_CACHE_PATH = DATA_PATH / "embedding_cache/embedding_cache.db"
 
 SKILL_DIRECTORY = PROJECT_ROOT / "metagpt/skills"
 
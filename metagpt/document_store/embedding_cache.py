@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/21 14:30
+@File    : embedding_cache.py
+@Desc    : Content-addressed cache of embeddings, the misses of concurrent callers embedded in one API call
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from metagpt.config import CONFIG
+from metagpt.const import EMBEDDING_CACHE_PATH
+from metagpt.logs import logger
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _model_name(embeddings: Embeddings) -> str:
+    return getattr(embeddings, "model", type(embeddings).__name__)
+
+
+class EmbeddingBatcher:
+    """Gather the texts to embed within `window` seconds into one `embed_documents` call of at most `max_batch` texts.
+
+    The first caller of a window waits for the others to join, then embeds for all of them. Only callers on other
+    threads can join, so a caller running an event loop does not wait, not to block it.
+    """
+
+    def __init__(self, embed_documents: Callable[[List[str]], List[List[float]]], window: float, max_batch: int):
+        self.embed_documents = embed_documents
+        self.window = window
+        self.max_batch = max_batch
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, Future]] = []
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        futures = [Future() for _ in texts]
+        with self._lock:
+            leader = not self._pending
+            self._pending.extend(zip(texts, futures))
+            full = len(self._pending) >= self.max_batch
+        if leader or full:
+            if leader and not full and self.window and not _in_event_loop():
+                time.sleep(self.window)  # let concurrent callers join the batch
+            self._drain()
+        return [i.result() for i in futures]
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch :]
+            if not batch:
+                return
+            self.calls += 1
+            try:
+                vectors = self.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings answered from an in-memory LRU, then from disk, and only then by the wrapped model, in batches.
+
+    Configured with EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_BATCH_WINDOW and EMBEDDING_BATCH_SIZE.
+    Use `shared` to get the one instance, and sqlite connection, of a cache file and model.
+    """
+
+    _shared: dict[tuple[Path, str], "CachedEmbeddings"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: Optional[Path] = None,
+        max_entries: Optional[int] = None,
+        window: Optional[float] = None,
+        max_batch: Optional[int] = None,
+    ):
+        self.embeddings = embeddings
+        self.path = Path(path or CONFIG.embedding_cache_path or EMBEDDING_CACHE_PATH)
+        self.max_entries = int(CONFIG.embedding_cache_max_entries if max_entries is None else max_entries)
+        self.batcher = EmbeddingBatcher(
+            embeddings.embed_documents,
+            float(CONFIG.embedding_batch_window if window is None else window),
+            int(max_batch or CONFIG.embedding_batch_size),
+        )
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def shared(cls, embeddings: Embeddings, path: Optional[Path] = None) -> "CachedEmbeddings":
+        """The instance caching the embeddings of the model of `embeddings` in `path`, created on first use"""
+        key = (Path(path or CONFIG.embedding_cache_path or EMBEDDING_CACHE_PATH).resolve(), _model_name(embeddings))
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(embeddings, path=key[0])
+            return cls._shared[key]
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def make_key(self, text: str) -> str:
+        """Content address of a text: sha256 over the embedding model and the text"""
+        return hashlib.sha256(f"{_model_name(self.embeddings)}\n{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while self.max_entries > 0 and len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _get(self, keys: List[str]) -> dict[str, List[float]]:
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = [i for i in keys if i not in found]
+            for idx in range(0, len(missing), 500):  # under the sqlite limit of host parameters
+                chunk = missing[idx : idx + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM embedding_cache WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = np.frombuffer(value, dtype=np.float32).tolist()
+                    self._remember(key, found[key])
+            return found
+
+    def _set(self, items: dict[str, List[float]]):
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, value) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()],
+            )
+            self.conn.commit()
+            for key, vector in items.items():
+                self._remember(key, vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.make_key(i) for i in texts]
+        found = self._get(keys)
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}  # deduplicated
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            vectors = np.asarray(self.batcher.embed(list(missing.values())), dtype=np.float32)  # as stored and indexed
+            embedded = dict(zip(missing, vectors.tolist()))
+            self._set(embedded)
+            found.update(embedded)
+            logger.debug(f"embedded {len(missing)} texts, {len(texts) - len(missing)} from the cache")
+        return [found[i] for i in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.conn.execute("DELETE FROM embedding_cache")
+            self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "calls": self.batcher.calls}
@@ -36,8 +36,11 @@ class FaissStore(LocalStore):
         store.index = index
         return store
 
+    def _embedding(self) -> OpenAIEmbeddings:
+        return OpenAIEmbeddings(openai_api_version="2020-11-07")
+
     def _write(self, docs, metadatas):
-        store = FAISS.from_texts(docs, OpenAIEmbeddings(openai_api_version="2020-11-07"), metadatas=metadatas)
+        store = FAISS.from_texts(docs, self._embedding(), metadatas=metadatas)
         return store
 
     def persist(self):
@@ -6,12 +6,14 @@
 @File    : environment.py
 """
 import asyncio
-from typing import Iterable
+from collections import defaultdict
+from typing import Callable, Iterable, Iterator, Optional, TextIO
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
-from metagpt.memory import Memory
+from metagpt.memory import Memory, MessageLog, ReadOnlyMemoryView
 from metagpt.roles import Role
+from metagpt.scheduler import RoleScheduler
 from metagpt.schema import Message
 
 
@@ -22,8 +24,10 @@ class Environment(BaseModel):
     """
 
     roles: dict[str, Role] = Field(default_factory=dict)
-    memory: Memory = Field(default_factory=Memory)
-    history: str = Field(default='')
+    message_log: MessageLog = Field(default_factory=MessageLog)  # shared by the memories of the roles
+    _history_cache: tuple[int, str] = PrivateAttr(default=(0, ""))  # number of messages rendered, text
+    _subscriptions: dict = PrivateAttr(default_factory=lambda: defaultdict(list))  # cause_by -> roles watching it
+    _scheduler: Optional[RoleScheduler] = PrivateAttr(default=None)
 
     class Config:
         arbitrary_types_allowed = True
@@ -34,6 +38,15 @@ class Environment(BaseModel):
         """
         role.set_env(self)
         self.roles[role.profile] = role
+        self.subscribe(role)
+
+    def subscribe(self, role: Role):
+        """订阅角色关注的动作，角色增加关注时再次调用
+           Route the messages of the actions the role watches to it, called again when it watches more
+        """
+        for action in role._rc.watch:
+            if role not in self._subscriptions[action]:
+                self._subscriptions[action].append(role)
 
     def add_roles(self, roles: Iterable[Role]):
         """增加一批在当前环境的角色
@@ -47,8 +60,50 @@ class Environment(BaseModel):
           Post information to the current environment
         """
         # self.message_queue.put(message)
-        self.memory.add(message)
-        self.history += f"\n{message}"
+        if message in self.message_log:
+            return
+        self.message_log.append(message)
+        if self._scheduler:
+            self._scheduler.notify(message)
+
+    @property
+    def memory(self) -> Memory:
+        """All the published messages, as a read-only memory: messages are added by publishing them"""
+        return ReadOnlyMemoryView(self.message_log, end=len(self.message_log))
+
+    def iter_history(self) -> Iterator[str]:
+        """逐条生成历史记录
+           Yield the history a message at a time, without materialising it
+        """
+        for message in self.message_log:
+            yield f"\n{message}"
+
+    def write_history(self, file: TextIO):
+        """Stream the history to a text file"""
+        for chunk in self.iter_history():
+            file.write(chunk)
+
+    @property
+    def history(self) -> str:
+        """All the published messages as text, rendered on demand. Messages rendered by an earlier call are
+        not rendered again"""
+        count, text = self._history_cache
+        if count < len(self.message_log):
+            text = "\n".join([text, *map(str, self.message_log[count:])])  # the first message after a newline too
+            self._history_cache = (len(self.message_log), text)
+        return text
+
+    def get_messages_since(self, seq: int) -> list[Message]:
+        """获得序号seq及之后发布的信息
+           Get the messages published since the sequence number `seq`, the next one to observe is seq + len(result)
+        """
+        return self.message_log[seq:]
+
+    def get_subscribers(self, message: Message) -> list[Role]:
+        """获得关注该信息的角色
+           Get the roles the message is news to
+        """
+        return [role for role in self._subscriptions.get(message.cause_by, []) if role.is_relevant(message)]
 
     async def run(self, k=1):
         """处理一次所有信息的运行
@@ -66,6 +121,17 @@ class Environment(BaseModel):
 
             await asyncio.gather(*futures)
 
+    async def run_until_idle(self, max_runs: int = 3, before_run: Optional[Callable[[], None]] = None) -> int:
+        """事件驱动地运行角色，直到没有角色有新信息
+        Run each role as soon as a message it watches is published, at most `max_runs` times per role,
+        until no role has news left. Return the number of role runs
+        """
+        self._scheduler = RoleScheduler(self, max_runs=max_runs, before_run=before_run)
+        try:
+            return await self._scheduler.run()
+        finally:
+            self._scheduler = None
+
     def get_roles(self) -> dict[str, Role]:
         """获得环境内的所有角色
            Process all Role runs at once
@@ -5,15 +5,34 @@
 @Author  : alexanderwu
 @File    : llm.py
 """
+from typing import Optional
 
 from metagpt.provider.anthropic_api import Claude2 as Claude
+from metagpt.provider.llm_registry import LLMRegistry
 from metagpt.provider.openai_api import OpenAIGPTAPI as LLM
 
-DEFAULT_LLM = LLM()
-CLAUDE_LLM = Claude()
+
+def get_llm(model: Optional[str] = None, auto_max_tokens: bool = False, temperature: Optional[float] = None) -> LLM:
+    """获取共享的LLM实例
+       Get the shared LLM instance of the given configuration. At temperature 0 identical concurrent requests are
+       coalesced into one
+    """
+    return LLMRegistry().get(model=model, auto_max_tokens=auto_max_tokens, temperature=temperature)
+
+
+def __getattr__(name):
+    # DEFAULT_LLM and CLAUDE_LLM are created on first use instead of at import
+    if name == "DEFAULT_LLM":
+        return get_llm()
+    if name == "CLAUDE_LLM":
+        global CLAUDE_LLM
+        CLAUDE_LLM = Claude()
+        return CLAUDE_LLM
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 async def ai_func(prompt):
     """使用LLM进行QA
        QA with LLMs
      """
-    return await DEFAULT_LLM.aask(prompt)
+    return await get_llm().aask(prompt)
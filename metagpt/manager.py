@@ -5,14 +5,14 @@
 @Author  : alexanderwu
 @File    : manager.py
 """
-from metagpt.llm import LLM
+from metagpt.llm import LLM, get_llm
 from metagpt.logs import logger
 from metagpt.schema import Message
 
 
 class Manager:
-    def __init__(self, llm: LLM = LLM()):
-        self.llm = llm  # Large Language Model
+    def __init__(self, llm: LLM = None):
+        self.llm = llm or get_llm()  # Large Language Model
         self.role_directions = {
             "BOSS": "Product Manager",
             "Product Manager": "Architect",
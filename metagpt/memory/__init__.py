@@ -8,9 +8,13 @@
 
 from metagpt.memory.memory import Memory
 from metagpt.memory.longterm_memory import LongTermMemory
+from metagpt.memory.shared_memory import MemoryView, MessageLog, ReadOnlyMemoryView
 
 
 __all__ = [
     "Memory",
     "LongTermMemory",
+    "MemoryView",
+    "MessageLog",
+    "ReadOnlyMemoryView",
 ]
@@ -53,12 +53,10 @@ class LongTermMemory(Memory):
             # memory_storage hasn't initialized, use default `remember` to get stm_news
             return stm_news
 
-        ltm_news: list[Message] = []
-        for mem in stm_news:
-            # integrate stm & ltm
-            mem_searched = self.memory_storage.search(mem)
-            if len(mem_searched) > 0:
-                ltm_news.append(mem)
+        # integrate stm & ltm, all the news searched at once
+        ltm_news: list[Message] = [
+            mem for mem, mem_searched in zip(stm_news, self.memory_storage.search_many(stm_news)) if mem_searched
+        ]
         return ltm_news[-k:]
 
     def delete(self, message: Message):
@@ -6,7 +6,8 @@
 @File    : memory.py
 """
 from collections import defaultdict
-from typing import Iterable, Type
+from itertools import islice
+from typing import Iterable, Iterator, Type
 
 from metagpt.actions import Action
 from metagpt.schema import Message
@@ -16,17 +17,26 @@ class Memory:
     """The most basic memory: super-memory"""
 
     def __init__(self):
-        """Initialize an empty storage list and an empty index dictionary"""
-        self.storage: list[Message] = []
-        self.index: dict[Type[Action], list[Message]] = defaultdict(list)
+        """Initialize an empty storage and an empty index dictionary, both keyed by message id in insertion order"""
+        self.storage: dict[str, Message] = {}
+        self.index: dict[Type[Action], dict[str, Message]] = defaultdict(dict)
+        self._views: dict[frozenset, dict[str, Message]] = {}  # actions -> their messages by id, see get_by_actions
+        self._view_tuples: dict[frozenset, tuple[Message, ...]] = {}  # actions -> their messages, until changed
+
+    def __contains__(self, message: Message) -> bool:
+        return message.id in self.storage
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.storage.values())
 
     def add(self, message: Message):
         """Add a new message to storage, while updating the index"""
-        if message in self.storage:
+        if message.id in self.storage:
             return
-        self.storage.append(message)
+        self.storage[message.id] = message
         if message.cause_by:
-            self.index[message.cause_by].append(message)
+            self.index[message.cause_by][message.id] = message
+        self._view_add(message)
 
     def add_batch(self, messages: Iterable[Message]):
         for message in messages:
@@ -34,22 +44,40 @@ class Memory:
 
     def get_by_role(self, role: str) -> list[Message]:
         """Return all messages of a specified role"""
-        return [message for message in self.storage if message.role == role]
+        return [message for message in self if message.role == role]
 
     def get_by_content(self, content: str) -> list[Message]:
         """Return all messages containing a specified content"""
-        return [message for message in self.storage if content in message.content]
+        return [message for message in self if content in message.content]
 
     def delete(self, message: Message):
         """Delete the specified message from storage, while updating the index"""
-        self.storage.remove(message)
-        if message.cause_by and message in self.index[message.cause_by]:
-            self.index[message.cause_by].remove(message)
+        self._remove(message)
+        self._view_delete(message)
+
+    def _remove(self, message: Message):
+        del self.storage[message.id]
+        if message.cause_by:
+            self.index[message.cause_by].pop(message.id, None)
+
+    def _view_add(self, message: Message):
+        for actions, view in self._views.items():
+            if message.cause_by in actions:
+                view[message.id] = message
+                self._view_tuples.pop(actions, None)
+
+    def _view_delete(self, message: Message):
+        for actions, view in self._views.items():
+            if message.cause_by in actions:
+                view.pop(message.id, None)
+                self._view_tuples.pop(actions, None)
 
     def clear(self):
         """Clear storage and index"""
-        self.storage = []
-        self.index = defaultdict(list)
+        self.storage = {}
+        self.index = defaultdict(dict)
+        self._views = {}
+        self._view_tuples = {}
 
     def count(self) -> int:
         """Return the number of messages in storage"""
@@ -57,32 +85,36 @@ class Memory:
 
     def try_remember(self, keyword: str) -> list[Message]:
         """Try to recall all messages containing a specified keyword"""
-        return [message for message in self.storage if keyword in message.content]
+        return [message for message in self if keyword in message.content]
 
     def get(self, k=0) -> list[Message]:
         """Return the most recent k memories, return all when k=0"""
-        return self.storage[-k:]
+        if not k:
+            return list(self.storage.values())
+        return list(islice(reversed(self.storage.values()), k))[::-1]
 
     def remember(self, observed: list[Message], k=0) -> list[Message]:
         """remember the most recent k memories from observed Messages, return all when k=0"""
-        already_observed = self.get(k)
-        news: list[Message] = []
-        for i in observed:
-            if i in already_observed:
-                continue
-            news.append(i)
-        return news
+        if not k:
+            return [i for i in observed if i not in self]
+        already_observed = {i.id for i in self.get(k)}
+        return [i for i in observed if i.id not in already_observed]
 
     def get_by_action(self, action: Type[Action]) -> list[Message]:
         """Return all messages triggered by a specified Action"""
-        return self.index[action]
-
-    def get_by_actions(self, actions: Iterable[Type[Action]]) -> list[Message]:
-        """Return all messages triggered by specified Actions"""
-        rsp = []
-        for action in actions:
-            if action not in self.index:
-                continue
-            rsp += self.index[action]
-        return rsp
-    
\ No newline at end of file
+        return list(self.index[action].values())
+
+    def get_by_actions(self, actions: Iterable[Type[Action]]) -> tuple[Message, ...]:
+        """Return all messages triggered by specified Actions, in the order they were added.
+        The selection is made on the first call and kept up to date by add and delete. The same tuple is returned
+        until one of them changes it"""
+        actions = frozenset(actions)
+        messages = self._view_tuples.get(actions)
+        if messages is not None:
+            return messages
+        view = self._views.get(actions)
+        if view is None:
+            view = {message.id: message for message in self if message.cause_by in actions}
+            self._views[actions] = view
+        messages = self._view_tuples[actions] = tuple(view.values())
+        return messages
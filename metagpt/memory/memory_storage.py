@@ -2,24 +2,59 @@
 # -*- coding: utf-8 -*-
 # @Desc   : the implement of memory storage
 
-from typing import List
+import atexit
+import base64
+import json
+import os
+import pickle
+import threading
+import time
+import weakref
+from typing import List, Optional
 from pathlib import Path
 
+import faiss
+import numpy as np
+from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.faiss import FAISS
 
+from metagpt.config import CONFIG
 from metagpt.const import DATA_PATH, MEM_TTL
 from metagpt.logs import logger
 from metagpt.schema import Message
-from metagpt.utils.serialize import serialize_message, deserialize_message
+from metagpt.utils.serialize import MESSAGE_CODEC, serialize_message, deserialize_message
+from metagpt.document_store.embedding_cache import CachedEmbeddings
 from metagpt.document_store.faiss_store import FaissStore
 
+_storages: "weakref.WeakSet[MemoryStorage]" = weakref.WeakSet()  # flushed at exit, without keeping them alive
+
+
+@atexit.register
+def _flush_storages():
+    for storage in list(_storages):
+        storage.flush()
+
 
 class MemoryStorage(FaissStore):
     """
     The memory storage with Faiss as ANN search engine
+
+    New memories are indexed in memory and appended to a write-ahead log (`<role_id>.wal`, one JSON line with the
+    embedding per memory) in groups of `wal_batch` or every `wal_interval` seconds. Every `compact_every` logged
+    memories, a snapshot of the whole index is written in the background and the log is truncated to the memories
+    after it. `recover_memory` loads the snapshot and replays the log.
+
+    Embeddings go through a `CachedEmbeddings`, and `search_many` looks up many messages with one embedding call and
+    one index search.
     """
 
-    def __init__(self, mem_ttl: int = MEM_TTL):
+    def __init__(
+        self,
+        mem_ttl: int = MEM_TTL,
+        wal_batch: Optional[int] = None,
+        wal_interval: Optional[float] = None,
+        compact_every: Optional[int] = None,
+    ):
         self.role_id: str = None
         self.role_mem_path: str = None
         self.mem_ttl: int = mem_ttl  # later use
@@ -27,6 +62,17 @@ class MemoryStorage(FaissStore):
         self._initialized: bool = False
 
         self.store: FAISS = None  # Faiss engine
+        self._embeddings: Optional[CachedEmbeddings] = None
+
+        self.wal_batch = wal_batch or CONFIG.mem_wal_batch
+        self.wal_interval = CONFIG.mem_wal_interval if wal_interval is None else wal_interval
+        self.compact_every = compact_every or CONFIG.mem_compact_every
+        self._lock = threading.RLock()
+        self._wal_buffer: list[str] = []  # entries not written yet
+        self._wal_entries = 0  # entries written since the last snapshot
+        self._flush_timer: Optional[threading.Timer] = None
+        self._compaction: Optional[threading.Thread] = None
+        _storages.add(self)
 
     @property
     def is_initialized(self) -> bool:
@@ -38,6 +84,7 @@ class MemoryStorage(FaissStore):
         self.role_mem_path.mkdir(parents=True, exist_ok=True)
 
         self.store = self._load()
+        self._replay_wal()
         messages = []
         if not self.store:
             # TODO init `self.store` under here with raw faiss api instead under `add`
@@ -57,51 +104,210 @@ class MemoryStorage(FaissStore):
         storage_fpath = Path(self.role_mem_path / f'{self.role_id}.pkl')
         return index_fpath, storage_fpath
 
+    def _embedding(self) -> Embeddings:
+        if self._embeddings is None:
+            self._embeddings = CachedEmbeddings.shared(super(MemoryStorage, self)._embedding())
+        return self._embeddings
+
+    def _get_wal_fname(self) -> Path:
+        return Path(self.role_mem_path / f'{self.role_id}.wal')
+
+    def _load(self) -> Optional[FAISS]:
+        """Load the snapshot, one pickle holding the serialized index, or the index and pickle files of older
+        versions"""
+        _, storage_fpath = self._get_index_and_store_fname()
+        if not storage_fpath.exists():
+            return None
+        with open(storage_fpath, "rb") as f:
+            snapshot = pickle.load(f)
+        if isinstance(snapshot, dict):
+            MESSAGE_CODEC.register(snapshot.get("schemas", {}))  # referred to by the messages in the store
+            store = pickle.loads(snapshot["store"])
+            store.index = faiss.deserialize_index(snapshot["index"])
+        else:
+            store = super(MemoryStorage, self)._load()
+        if store:
+            store.embedding_function = self._embedding().embed_query
+        return store
+
+    def _replay_wal(self):
+        """Add the logged memories missing from the snapshot, a torn last line from a crash is skipped"""
+        wal_fpath = self._get_wal_fname()
+        if not wal_fpath.exists():
+            return
+        entries = []
+        for line in wal_fpath.read_text(encoding="utf-8").splitlines():
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Agent {self.role_id}'s memory log has a torn entry, skipped")
+        ntotal = self.store.index.ntotal if self.store else 0
+        entries = [i for i in entries if i["seq"] >= ntotal]
+        self._wal_entries = len(entries)
+        if not entries:
+            return
+        for entry in entries:
+            MESSAGE_CODEC.register(entry.get("schemas") or {})
+        text_embeddings = [(i["text"], i["embedding"]) for i in entries]
+        metadatas = [{"message_ser": base64.b64decode(i["message_ser"])} for i in entries]
+        ids = [i["id"] for i in entries]
+        if self.store:
+            self.store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        else:
+            self.store = FAISS.from_embeddings(text_embeddings, self._embedding(), metadatas=metadatas, ids=ids)
+        logger.info(f"Agent {self.role_id} replayed {len(entries)} memories from its log")
+
     def persist(self):
-        super(MemoryStorage, self).persist()
+        """Write the logged memories, then a snapshot of the whole index"""
+        self.flush()
+        self._wait_compaction()
+        self._compact()
         logger.debug(f'Agent {self.role_id} persist memory into local')
 
     def add(self, message: Message) -> bool:
         """ add message into memory storage"""
         docs = [message.content]
-        metadatas = [{"message_ser": serialize_message(message)}]
-        if not self.store:
-            # init Faiss
-            self.store = self._write(docs, metadatas)
-            self._initialized = True
-        else:
-            self.store.add_texts(texts=docs, metadatas=metadatas)
-        self.persist()
+        message_ser = serialize_message(message)
+        metadatas = [{"message_ser": message_ser}]
+        text_embeddings = list(zip(docs, self._embedding().embed_documents(docs)))
+        with self._lock:
+            if not self.store:
+                # init Faiss
+                self.store = FAISS.from_embeddings(text_embeddings, self._embedding(), metadatas=metadatas)
+                self._initialized = True
+            else:
+                self.store.add_embeddings(text_embeddings, metadatas=metadatas)
+            # the embedding is logged too, a replay does not call the embedding API again
+            seq = self.store.index.ntotal - 1
+            entry = {
+                "seq": seq,
+                "id": self.store.index_to_docstore_id[seq],
+                "text": message.content,
+                "embedding": text_embeddings[0][1],
+                "message_ser": base64.b64encode(message_ser).decode(),
+                "schemas": MESSAGE_CODEC.schemas_of(message),
+            }
+            self._wal_buffer.append(json.dumps(entry))
+            if len(self._wal_buffer) >= self.wal_batch:
+                self.flush()
+            elif not self._flush_timer:
+                self._flush_timer = threading.Timer(self.wal_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
         logger.info(f"Agent {self.role_id}'s memory_storage add a message")
 
+    def flush(self):
+        """Write the buffered memories to the log in one group, compact it in the background when long enough"""
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._wal_buffer or not self.role_mem_path:
+                return
+            with open(self._get_wal_fname(), "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in self._wal_buffer))
+                f.flush()
+                os.fsync(f.fileno())
+            self._wal_entries += len(self._wal_buffer)
+            self._wal_buffer = []
+            if self._wal_entries >= self.compact_every and not self._compaction:
+                self._compaction = threading.Thread(target=self._compact, daemon=True)
+                self._compaction.start()
+
+    def _compact(self):
+        """Write a snapshot of the index, then drop the logged memories it holds"""
+        with self._lock:
+            if not self.store:
+                return
+            index = self.store.index
+            ntotal = index.ntotal
+            embedding_function = self.store.embedding_function
+            snapshot = {"index": faiss.serialize_index(index), "schemas": dict(MESSAGE_CODEC.schemas)}
+            self.store.index = None  # pickled apart
+            self.store.embedding_function = None  # set again on load
+            try:
+                snapshot["store"] = pickle.dumps(self.store)
+            finally:
+                self.store.index = index
+                self.store.embedding_function = embedding_function
+        try:
+            start = time.time()
+            index_fpath, storage_fpath = self._get_index_and_store_fname()
+            tmp_fpath = storage_fpath.with_suffix(".pkl.tmp")
+            with open(tmp_fpath, "wb") as f:
+                pickle.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_fpath, storage_fpath)
+            index_fpath.unlink(missing_ok=True)  # held by the snapshot now
+            with self._lock:
+                self._truncate_wal(ntotal)
+            logger.debug(f"Agent {self.role_id} memory snapshot of {ntotal} written in {time.time() - start:.2f}s")
+        finally:
+            self._compaction = None
+
+    def _truncate_wal(self, ntotal: int):
+        wal_fpath = self._get_wal_fname()
+        if not wal_fpath.exists():
+            return
+        lines = [i for i in wal_fpath.read_text(encoding="utf-8").splitlines() if i.strip()]
+        lines = [i for i in lines if json.loads(i)["seq"] >= ntotal]
+        tmp_fpath = wal_fpath.with_suffix(".wal.tmp")
+        tmp_fpath.write_text("".join(f"{i}\n" for i in lines), encoding="utf-8")
+        os.replace(tmp_fpath, wal_fpath)
+        self._wal_entries = len(lines)
+
+    def _wait_compaction(self):
+        compaction = self._compaction
+        if compaction and compaction is not threading.current_thread():
+            compaction.join()
+
     def search(self, message: Message, k=4) -> List[Message]:
         """search for dissimilar messages"""
-        if not self.store:
-            return []
-
-        resp = self.store.similarity_search_with_score(
-            query=message.content,
-            k=k
-        )
-        # filter the result which score is smaller than the threshold
-        filtered_resp = []
-        for item, score in resp:
-            # the smaller score means more similar relation
-            if score < self.threshold:
-                continue
-            # convert search result into Memory
-            metadata = item.metadata
-            new_mem = deserialize_message(metadata.get("message_ser"))
-            filtered_resp.append(new_mem)
-        return filtered_resp
+        return self.search_many([message], k=k)[0]
+
+    def search_many(self, messages: List[Message], k=4) -> List[List[Message]]:
+        """search for the dissimilar messages of each message, with one embedding call and one index search"""
+        if not self.store or not messages:
+            return [[] for _ in messages]
+
+        vectors = np.array(self._embedding().embed_documents([i.content for i in messages]), dtype=np.float32)
+        with self._lock:
+            if self.store._normalize_L2:
+                faiss.normalize_L2(vectors)
+            scores, indices = self.store.index.search(vectors, k)
+            docs = [[self.store.docstore.search(self.store.index_to_docstore_id[i]) if i != -1 else None for i in row]
+                    for row in indices]
+        results = []
+        for row_docs, row_scores in zip(docs, scores):
+            # filter the result which score is smaller than the threshold
+            filtered_resp = []
+            for item, score in zip(row_docs, row_scores):
+                # the smaller score means more similar relation
+                if item is None or score < self.threshold:
+                    continue
+                # convert search result into Memory
+                metadata = item.metadata
+                new_mem = deserialize_message(metadata.get("message_ser"))
+                filtered_resp.append(new_mem)
+            results.append(filtered_resp)
+        return results
 
     def clean(self):
+        self._wait_compaction()
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self._wal_buffer = []
+            self._wal_entries = 0
         index_fpath, storage_fpath = self._get_index_and_store_fname()
         if index_fpath and index_fpath.exists():
             index_fpath.unlink(missing_ok=True)
         if storage_fpath and storage_fpath.exists():
             storage_fpath.unlink(missing_ok=True)
+        if self.role_mem_path:
+            self._get_wal_fname().unlink(missing_ok=True)
 
         self.store = None
         self._initialized = False
-        
\ No newline at end of file
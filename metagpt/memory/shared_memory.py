@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/17 15:10
+@File    : shared_memory.py
+@Desc    : One append-only message log per environment, the memories of its roles being views over it
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Iterable, Iterator, Optional, Type, Union
+
+from metagpt.actions import Action
+from metagpt.memory.memory import Memory
+from metagpt.schema import Message
+
+
+class MessageLog:
+    """Append-only log of the messages published in an environment, indexed once for all its roles"""
+
+    def __init__(self):
+        self.messages: list[Message] = []
+        self.seqs: dict[str, int] = {}  # message id -> sequence number, i.e. position in the log
+        self.index: dict[Type[Action], list[int]] = defaultdict(list)  # cause_by -> ascending sequence numbers
+
+    def append(self, message: Message) -> int:
+        """Append the message unless already logged, return its sequence number"""
+        seq = self.seqs.get(message.id)
+        if seq is not None:
+            return seq
+        seq = len(self.messages)
+        self.messages.append(message)
+        self.seqs[message.id] = seq
+        if message.cause_by:
+            self.index[message.cause_by].append(seq)
+        return seq
+
+    def seq(self, message: Message) -> Optional[int]:
+        return self.seqs.get(message.id)
+
+    def seqs_by_action(self, action: Type[Action], start: int = 0, end: Optional[int] = None) -> list[int]:
+        """Sequence numbers in [start, end) of the messages triggered by `action`"""
+        seqs = self.index.get(action, [])
+        end = len(self.messages) if end is None else end
+        return seqs[bisect_left(seqs, start) : bisect_left(seqs, end)]
+
+    def get_by_action(self, action: Type[Action], start: int = 0, end: Optional[int] = None) -> list[Message]:
+        """Messages triggered by `action` with a sequence number in [start, end)"""
+        return [self.messages[i] for i in self.seqs_by_action(action, start, end)]
+
+    def __contains__(self, message: Message) -> bool:
+        return message.id in self.seqs
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    def __getitem__(self, item: Union[int, slice]):
+        return self.messages[item]
+
+
+class MemoryView(Memory):
+    """A role's memory over the shared log: the logged messages in [start, end) but the deleted ones, and the
+    messages the role holds on its own (not logged, or logged past `end`), kept in the inherited storage. A held
+    message is listed where it was added, before the logged messages observed after it.
+
+    Observing the log in order only moves `end`, so the messages are stored and indexed once per environment,
+    not once per role.
+    """
+
+    def __init__(self, log: MessageLog, start: int = 0, end: int = 0):
+        super().__init__()
+        self.log = log
+        self.start = start
+        self.end = end
+        self.deleted: set[str] = set()  # ids of the logged messages in [start, end) deleted from this view
+        self.positions: dict[str, int] = {}  # id of a held message -> `end` when it was added
+
+    def _in_view(self, seq: Optional[int]) -> bool:
+        return seq is not None and self.start <= seq < self.end
+
+    def __contains__(self, message: Message) -> bool:
+        if self._in_view(self.log.seq(message)):
+            return message.id not in self.deleted
+        return super().__contains__(message)
+
+    def __iter__(self) -> Iterator[Message]:
+        return self._merge(range(self.start, self.end), super().__iter__())
+
+    def _merge(self, seqs: Iterable[int], held: Iterable[Message]) -> Iterator[Message]:
+        """The logged messages of `seqs` but the deleted ones, and the `held` ones, in the order they were added"""
+        held = iter(held)
+        next_held = next(held, None)
+        for seq in seqs:
+            while next_held is not None and self.positions[next_held.id] <= seq:
+                yield next_held
+                next_held = next(held, None)
+            message = self.log[seq]
+            if message.id not in self.deleted:
+                yield message
+        if next_held is not None:
+            yield next_held
+            yield from held
+
+    def add(self, message: Message):
+        """Extend the view when the message is the next logged one, otherwise hold it on its own"""
+        seq = self.log.seq(message)
+        if self._in_view(seq):
+            if message.id in self.deleted:
+                self.deleted.discard(message.id)
+                self._view_add(message)
+            return
+        if seq != self.end:
+            self.positions.setdefault(message.id, self.end)
+            super().add(message)
+            return
+        # the role's own messages, added before being published, move from its storage into the view
+        while self.end < len(self.log) and (self.end == seq or self.log[self.end].id in self.storage):
+            logged = self.log[self.end]
+            if logged.id in self.storage:
+                self._remove(logged)
+                del self.positions[logged.id]
+            else:
+                self._view_add(logged)
+            self.end += 1
+
+    def delete(self, message: Message):
+        if not self._in_view(self.log.seq(message)):
+            super().delete(message)
+            self.positions.pop(message.id, None)
+        elif message.id not in self.deleted:
+            self.deleted.add(message.id)
+            self._view_delete(message)
+
+    def clear(self):
+        super().clear()
+        self.start = self.end
+        self.deleted = set()
+        self.positions = {}
+
+    def count(self) -> int:
+        return self.end - self.start - len(self.deleted) + super().count()
+
+    def get(self, k=0) -> list[Message]:
+        messages = list(self)
+        return messages[-k:] if k else messages
+
+    def get_by_action(self, action: Type[Action]) -> list[Message]:
+        seqs = self.log.seqs_by_action(action, self.start, self.end)
+        return list(self._merge(seqs, super().get_by_action(action)))
+
+
+class ReadOnlyMemoryView(MemoryView):
+    """A view over a whole log to read it as a memory, messages are added to the log by publishing them"""
+
+    def add(self, message: Message):
+        raise TypeError(f"{self.__class__.__name__} is read-only, publish the message to the environment instead")
+
+    def delete(self, message: Message):
+        raise TypeError(f"{self.__class__.__name__} is read-only")
+
+    def clear(self):
+        raise TypeError(f"{self.__class__.__name__} is read-only")
@@ -5,31 +5,203 @@
 @Author  : Leo Xiao
 @File    : anthropic_api.py
 """
+import asyncio
+import time
+import weakref
+from typing import AsyncIterator, Optional
 
 import anthropic
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 
 from metagpt.config import CONFIG
+from metagpt.logs import logger
+from metagpt.provider.base_gpt_api import BaseGPTAPI, StreamSink
+from metagpt.provider.openai_api import CostManager, Costs
+from metagpt.provider.rate_limiter import RateLimiterManager, TokenBucketRateLimiter
+from metagpt.provider.resilience import (
+    CircuitBreaker,
+    CircuitBreakerManager,
+    get_request_timeout,
+    llm_retry,
+)
+from metagpt.utils.metrics import LLMMetrics
+from metagpt.utils.singleton import Singleton
 
 
-class Claude2:
-    def ask(self, prompt):
-        client = Anthropic(api_key=CONFIG.claude_api_key)
+class AnthropicClientPool(metaclass=Singleton):
+    """Keep one client, i.e. one HTTP keep-alive connection pool, per api key (and event loop for async clients),
+    instead of constructing a client per request"""
 
-        res = client.completions.create(
-            model="claude-2",
-            prompt=f"{anthropic.HUMAN_PROMPT} {prompt} {anthropic.AI_PROMPT}",
-            max_tokens_to_sample=1000,
-        )
-        return res.completion
+    def __init__(self):
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._clients: dict[str, Anthropic] = {}
 
-    async def aask(self, prompt):
-        client = Anthropic(api_key=CONFIG.claude_api_key)
+    def get_async(self, api_key: str) -> AsyncAnthropic:
+        clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(api_key)
+        if client is None:
+            client = AsyncAnthropic(api_key=api_key, max_retries=0)
+            clients[api_key] = client
+        return client
 
-        res = client.completions.create(
-            model="claude-2",
-            prompt=f"{anthropic.HUMAN_PROMPT} {prompt} {anthropic.AI_PROMPT}",
-            max_tokens_to_sample=1000,
-        )
-        return res.completion
-    
\ No newline at end of file
+    def get(self, api_key: str) -> Anthropic:
+        client = self._clients.get(api_key)
+        if client is None:
+            client = Anthropic(api_key=api_key)
+            self._clients[api_key] = client
+        return client
+
+    async def close(self):
+        """Close the clients of the running event loop"""
+        clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client._client.aclose()  # the httpx client, this anthropic version has no close of its own
+
+
+class Claude2(BaseGPTAPI):
+    """Anthropic completions, answering in the OpenAI response format so it can stand in for OpenAIGPTAPI.
+    Requests share the process-wide rate limiter, circuit breakers and cost manager, and are retried with the
+    same policy as OpenAIGPTAPI."""
+
+    def __init__(self, model: str = None):
+        super().__init__()
+        self.model = model or CONFIG.claude_api_model
+        self.rpm = int(CONFIG.get("RPM", 10))
+        self._cost_manager = CostManager()
+        self._client_pool = AnthropicClientPool()
+        self._metrics = LLMMetrics()
+
+    @property
+    def aclient(self) -> AsyncAnthropic:
+        return self._client_pool.get_async(CONFIG.claude_api_key)
+
+    @property
+    def client(self) -> Anthropic:
+        return self._client_pool.get(CONFIG.claude_api_key)
+
+    @property
+    def rate_limiter(self) -> TokenBucketRateLimiter:
+        return RateLimiterManager().get(self.model, rpm=self.rpm)
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return CircuitBreakerManager().get(str(self.client.base_url))
+
+    def messages_to_prompt(self, messages: list[dict]) -> str:
+        """[{"role": "user", "content": msg}] to "\\n\\nHuman: <msg>\\n\\nAssistant:" etc."""
+        prompt = []
+        for i in messages:
+            if i["role"] == "system":
+                prompt.append(i["content"])
+            elif i["role"] == "assistant":
+                prompt.append(f"{anthropic.AI_PROMPT} {i['content']}")
+            else:
+                prompt.append(f"{anthropic.HUMAN_PROMPT} {i['content']}")
+        return "".join(prompt) + anthropic.AI_PROMPT
+
+    def _cons_kwargs(self, messages: list[dict]) -> dict:
+        return {
+            "model": self.model,
+            "prompt": self.messages_to_prompt(messages),
+            "max_tokens_to_sample": CONFIG.max_tokens_rsp,
+            "timeout": get_request_timeout(CONFIG.max_tokens_rsp),
+        }
+
+    def _to_rsp(self, text: str, usage: dict, stop_reason: str = None) -> dict:
+        """Wrap a completion in the OpenAI chat completion format"""
+        return {
+            "choices": [{"index": 0, "message": self._assistant_msg(text), "finish_reason": stop_reason}],
+            "usage": usage,
+        }
+
+    def completion(self, messages: list[dict]) -> dict:
+        kwargs = self._cons_kwargs(messages)
+        start = time.monotonic()
+        res = self.client.completions.create(**kwargs)
+        latency = time.monotonic() - start
+        usage = self._calc_usage(kwargs["prompt"], res.completion)
+        self._update_costs(usage, latency=latency)
+        return self._to_rsp(res.completion, usage, res.stop_reason)
+
+    async def acompletion(self, messages: list[dict]) -> dict:
+        await self.rate_limiter.acquire()
+        kwargs = self._cons_kwargs(messages)
+        start = time.monotonic()
+        with self.circuit_breaker.guard():
+            res = await self.aclient.completions.create(**kwargs)
+        latency = time.monotonic() - start
+        usage = await self._acalc_usage(kwargs["prompt"], res.completion)
+        self._update_costs(usage, latency=latency)
+        return self._to_rsp(res.completion, usage, res.stop_reason)
+
+    async def astream(self, messages: list[dict]) -> AsyncIterator[str]:
+        await self.rate_limiter.acquire()
+        kwargs = self._cons_kwargs(messages)
+        start = time.monotonic()
+        with self.circuit_breaker.guard():
+            stream = await self.aclient.completions.create(**kwargs, stream=True)
+
+        # costs are updated even if the consumer stops early
+        collected_messages = []
+        ttft = None
+        try:
+            async for chunk in stream:
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                collected_messages.append(chunk.completion)
+                yield chunk.completion
+        finally:
+            latency = time.monotonic() - start
+            usage = await self._acalc_usage(kwargs["prompt"], "".join(collected_messages))
+            self._update_costs(usage, latency=latency, ttft=ttft)
+
+    @llm_retry()
+    async def acompletion_text(
+        self, messages: list[dict], stream=False, sinks: Optional[list[StreamSink]] = None
+    ) -> str:
+        """when streaming, forward each token to `sinks`, `stream_sinks` by default, in place."""
+        if stream:
+            return await self._astream_to_sinks(messages, sinks)
+        rsp = await self.acompletion(messages)
+        return self.get_choice_text(rsp)
+
+    @llm_retry()
+    async def _acompletion_with_retry(self, idx: int, messages: list[dict]) -> tuple[int, dict]:
+        return idx, await self.acompletion(messages)
+
+    def _calc_usage(self, prompt: str, completion: str) -> dict:
+        if not CONFIG.calc_usage:
+            return {}
+        try:
+            return {
+                "prompt_tokens": self.client.count_tokens(prompt),
+                "completion_tokens": self.client.count_tokens(completion),
+            }
+        except Exception as e:
+            logger.error(f"usage calculation failed: {e}")
+            return {}
+
+    async def _acalc_usage(self, prompt: str, completion: str) -> dict:
+        if not CONFIG.calc_usage:
+            return {}
+        try:
+            return {
+                "prompt_tokens": await self.aclient.count_tokens(prompt),
+                "completion_tokens": await self.aclient.count_tokens(completion),
+            }
+        except Exception as e:
+            logger.error(f"usage calculation failed: {e}")
+            return {}
+
+    def _update_costs(self, usage: dict, latency: Optional[float] = None, ttft: Optional[float] = None):
+        prompt_tokens = completion_tokens = cost = 0
+        if CONFIG.calc_usage and usage:
+            try:
+                prompt_tokens, completion_tokens = usage["prompt_tokens"], usage["completion_tokens"]
+                cost = self._cost_manager.update_cost(prompt_tokens, completion_tokens, self.model)
+            except Exception as e:
+                logger.error(f"updating costs failed: {e}")
+        self._metrics.record(self.model, prompt_tokens, completion_tokens, cost, latency=latency, ttft=ttft)
+
+    def get_costs(self) -> Costs:
+        return self._cost_manager.get_costs()
@@ -5,16 +5,49 @@
 @Author  : alexanderwu
 @File    : base_gpt_api.py
 """
+import asyncio
+import json
 from abc import abstractmethod
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from metagpt.logs import logger
 from metagpt.provider.base_chatbot import BaseChatbot
+from metagpt.provider.resilience import StreamInterruptedError
+
+
+JSON_MODE_PROMPT = """
+-----
+Answer with only a JSON object matching this JSON schema, wrapped inside [CONTENT][/CONTENT], nothing else:
+{schema}"""
+
+
+class StreamSink:
+    """Receive the deltas of a streamed completion, as they arrive"""
+
+    def write(self, delta: str):
+        """Called with each delta"""
+
+    def end(self):
+        """Called once the stream is complete"""
+
+
+class StdoutStreamSink(StreamSink):
+    """Print each token in place"""
+
+    def write(self, delta: str):
+        print(delta, end="")
+
+    def end(self):
+        print()
 
 
 class BaseGPTAPI(BaseChatbot):
     """GPT API abstract class, requiring all inheritors to provide a series of standard capabilities"""
     system_prompt = 'You are a helpful assistant.'
+    rpm = 10  # default number of batch requests kept in flight
+
+    def __init__(self):
+        self.stream_sinks: list[StreamSink] = [StdoutStreamSink()]  # of this instance, callers may pass their own
 
     def _user_msg(self, msg: str) -> dict[str, str]:
         return {"role": "user", "content": msg}
@@ -36,16 +69,55 @@ class BaseGPTAPI(BaseChatbot):
         rsp = self.completion(message)
         return self.get_choice_text(rsp)
 
-    async def aask(self, msg: str, system_msgs: Optional[list[str]] = None) -> str:
+    def _ask_msgs(self, msg: str, system_msgs: Optional[list[str]] = None) -> list[dict[str, str]]:
         if system_msgs:
-            message = self._system_msgs(system_msgs) + [self._user_msg(msg)]
-        else:
-            message = [self._default_system_msg(), self._user_msg(msg)]
+            return self._system_msgs(system_msgs) + [self._user_msg(msg)]
+        return [self._default_system_msg(), self._user_msg(msg)]
+
+    async def aask(self, msg: str, system_msgs: Optional[list[str]] = None) -> str:
+        message = self._ask_msgs(msg, system_msgs)
         rsp = await self.acompletion_text(message, stream=True)
         logger.debug(message)
         # logger.debug(rsp)
         return rsp
 
+    async def aask_function(self, msg: str, function: dict, system_msgs: Optional[list[str]] = None) -> str:
+        """Ask for the arguments of `function`, a JSON object following its `parameters` schema.
+        Providers without native function calling get the schema appended to the prompt instead"""
+        schema = json.dumps(function["parameters"], ensure_ascii=False)
+        return await self.aask(msg + JSON_MODE_PROMPT.format(schema=schema), system_msgs)
+
+    async def aask_stream(self, msg: str, system_msgs: Optional[list[str]] = None) -> AsyncIterator[str]:
+        """Streaming version of aask, yield the answer in deltas as they arrive"""
+        message = self._ask_msgs(msg, system_msgs)
+        logger.debug(message)
+        async for delta in self.astream(message):
+            yield delta
+
+    async def astream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """Yield the completion in deltas as they arrive. Providers without streaming yield the whole text once"""
+        yield await self.acompletion_text(messages)
+
+    async def _astream_to_sinks(self, messages: list[dict], sinks: Optional[list[StreamSink]] = None) -> str:
+        """Consume `astream`, forwarding each delta to `sinks` (`stream_sinks` by default), and return the full text.
+
+        A failure once deltas were delivered raises StreamInterruptedError, which is not retried.
+        """
+        sinks = self.stream_sinks if sinks is None else sinks
+        collected = []
+        try:
+            async for delta in self.astream(messages):
+                collected.append(delta)
+                for sink in sinks:
+                    sink.write(delta)
+        except Exception as e:
+            if collected:
+                raise StreamInterruptedError("".join(collected)) from e
+            raise
+        for sink in sinks:
+            sink.end()
+        return "".join(collected)
+
     def _extract_assistant_rsp(self, context):
         return "\n".join([i["content"] for i in context if i["role"] == "assistant"])
 
@@ -69,6 +141,55 @@ class BaseGPTAPI(BaseChatbot):
             context.append(self._assistant_msg(rsp_text))
         return self._extract_assistant_rsp(context)
 
+    async def _acompletion_with_retry(self, idx: int, messages: list[dict]) -> tuple[int, dict]:
+        """One request of a batch, providers wrap it with their own retry policy"""
+        return idx, await self.acompletion(messages)
+
+    async def acompletion_batch_as_completed(
+        self, batch: list[list[dict]], concurrency: Optional[int] = None
+    ) -> AsyncIterator[tuple[int, dict]]:
+        """Keep `concurrency` (default RPM) requests in flight, yield (index, full JSON) as each one completes.
+        Failed requests are retried individually, the shared rate limiter paces the starts."""
+        concurrency = concurrency or self.rpm
+        prompts = iter(enumerate(batch))
+        pending = set()
+
+        def fill_window():
+            for idx, prompt in prompts:
+                pending.add(asyncio.create_task(self._acompletion_with_retry(idx, prompt)))
+                if len(pending) >= concurrency:
+                    break
+
+        fill_window()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                fill_window()
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acompletion_batch(self, batch: list[list[dict]], concurrency: Optional[int] = None) -> list[dict]:
+        """Return full JSON, in input order"""
+        all_results = [None] * len(batch)
+        async for idx, result in self.acompletion_batch_as_completed(batch, concurrency):
+            all_results[idx] = result
+        logger.info(all_results)
+        return all_results
+
+    async def acompletion_batch_text(self, batch: list[list[dict]]) -> list[str]:
+        """Only return plain text"""
+        raw_results = await self.acompletion_batch(batch)
+        results = []
+        for idx, raw_result in enumerate(raw_results, start=1):
+            result = self.get_choice_text(raw_result)
+            results.append(result)
+            logger.info(f"Result of task {idx}: {result}")
+        return results
+
     def ask_code(self, msgs: list[str]) -> str:
         """FIXME: No code segment filtering has been done here, and all results are actually displayed"""
         rsp_text = self.ask_batch(msgs)
@@ -101,8 +222,10 @@ class BaseGPTAPI(BaseChatbot):
         """
 
     @abstractmethod
-    async def acompletion_text(self, messages: list[dict], stream=False) -> str:
-        """Asynchronous version of completion. Return str. Support stream-print"""
+    async def acompletion_text(
+        self, messages: list[dict], stream=False, sinks: Optional[list[StreamSink]] = None
+    ) -> str:
+        """Asynchronous version of completion. Return str. Support stream-print, to `sinks` if given"""
 
     def get_choice_text(self, rsp: dict) -> str:
         """Required to provide the first text of choice"""
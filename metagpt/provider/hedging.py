@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/13 10:25
+@File    : hedging.py
+@Desc    : Hedged LLM requests, a duplicate is sent when the first one is slower than usual
+"""
+import asyncio
+import math
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from metagpt.config import CONFIG
+from metagpt.logs import logger
+from metagpt.utils.singleton import Singleton
+
+T = TypeVar("T")
+
+MIN_SAMPLES = 20  # below this the percentile is not trusted and LLM_HEDGE_DELAY is used
+
+_hedge_enabled: ContextVar[bool] = ContextVar("hedge_enabled", default=False)
+
+
+@contextmanager
+def hedging(enabled: bool = True):
+    """Hedge the LLM requests issued within this block (and the tasks it starts), if LLM_HEDGE is on"""
+    token = _hedge_enabled.set(enabled)
+    try:
+        yield
+    finally:
+        _hedge_enabled.reset(token)
+
+
+def hedging_enabled() -> bool:
+    return bool(CONFIG.llm_hedge) and _hedge_enabled.get()
+
+
+class LatencyTracker:
+    """Recent latencies of one kind of request, to derive the hedging deadline from"""
+
+    def __init__(self, size: int = 200):
+        self.samples: deque[float] = deque(maxlen=size)
+        self.hedged = 0  # duplicates sent
+        self.hedge_won = 0  # duplicates that answered first
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def deadline(self) -> float:
+        """Seconds to wait for the first request before sending the duplicate"""
+        deadline = self.percentile(CONFIG.llm_hedge_percentile)
+        return float(CONFIG.llm_hedge_delay) if deadline is None else deadline
+
+
+class LatencyTrackerManager(metaclass=Singleton):
+    """One tracker per model and request kind, shared by every provider instance in the process"""
+
+    def __init__(self):
+        self._trackers: dict[str, LatencyTracker] = {}
+
+    def get(self, key: str) -> LatencyTracker:
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            tracker = LatencyTracker()
+            self._trackers[key] = tracker
+        return tracker
+
+    def get_stats(self) -> dict:
+        return {
+            key: {"samples": len(i.samples), "deadline": i.deadline(), "hedged": i.hedged, "hedge_won": i.hedge_won}
+            for key, i in self._trackers.items()
+        }
+
+
+async def _first_success(tasks: list[asyncio.Task]) -> asyncio.Task:
+    """Wait for the first task to succeed, or for all of them to fail"""
+    pending = set(tasks)
+    while True:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            if task in done and not task.exception():
+                return task
+        if not pending:
+            return next(task for task in tasks if task in done)
+
+
+async def hedge(
+    start: Callable[[], Awaitable[T]],
+    tracker: LatencyTracker,
+    on_cancelled: Optional[Callable[[], None]] = None,
+) -> T:
+    """Await `start()`, sending a duplicate `start()` if it hasn't finished within the tracker's deadline.
+    The first to succeed is returned, the other is cancelled and reported to `on_cancelled`, e.g. for its costs."""
+    first = asyncio.ensure_future(start())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=tracker.deadline())
+        if not done:
+            logger.info(f"no response within {tracker.deadline():.1f}s, sending a hedged request")
+            tracker.hedged += 1
+            tasks.append(asyncio.ensure_future(start()))
+        winner = await _first_success(tasks)
+        if winner is not first:
+            tracker.hedge_won += 1
+        return winner.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                if on_cancelled:
+                    on_cancelled()
+
+
+async def hedge_stream(start: Callable[[], AsyncIterator[str]], tracker: LatencyTracker) -> AsyncIterator[str]:
+    """Stream `start()`, sending a duplicate `start()` if no delta arrived within the tracker's deadline.
+    The stream that produces the first delta is followed, the other is closed."""
+    streams = [start()]
+    tasks = [asyncio.ensure_future(streams[0].__anext__())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=tracker.deadline())
+        if not done:
+            logger.info(f"no token within {tracker.deadline():.1f}s, sending a hedged request")
+            tracker.hedged += 1
+            streams.append(start())
+            tasks.append(asyncio.ensure_future(streams[1].__anext__()))
+        winner = await _first_success(tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        for stream in streams:
+            await stream.aclose()
+        raise
+
+    idx = tasks.index(winner)
+    if idx:
+        tracker.hedge_won += 1
+    for task, stream in zip(tasks, streams):
+        if task is not winner:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await stream.aclose()
+
+    stream = streams[idx]
+    try:
+        yield winner.result()  # raises when all streams failed, StopAsyncIteration when empty
+    except StopAsyncIteration:
+        return
+    try:
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
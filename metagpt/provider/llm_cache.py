@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/4 10:21
+@File    : llm_cache.py
+@Desc    : A persistent, content-addressed cache of LLM responses
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from metagpt.config import CONFIG
+from metagpt.const import LLM_CACHE_PATH
+from metagpt.logs import logger
+from metagpt.utils.singleton import Singleton
+
+
+class LLMCacheMissError(Exception):
+    """Raised in replay-only mode when a request is not in the cache"""
+
+    def __init__(self, key: str, message="LLM response not found in cache (replay-only mode)"):
+        self.key = key
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} -> key: {self.key}"
+
+
+class LLMResponseCache(metaclass=Singleton):
+    """Disk-backed LRU cache of chat completion responses, keyed by a hash of the request.
+
+    Configured with LLM_CACHE, LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL and LLM_CACHE_REPLAY_ONLY.
+    In replay-only mode a miss raises `LLMCacheMissError` instead of falling through to the network.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        replay_only: Optional[bool] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.enabled = bool(CONFIG.llm_cache if enabled is None else enabled)
+        self.path = Path(path or CONFIG.llm_cache_path or LLM_CACHE_PATH)
+        self.max_entries = int(CONFIG.llm_cache_max_entries if max_entries is None else max_entries)
+        self.ttl = float(CONFIG.llm_cache_ttl if ttl is None else ttl)  # seconds, 0 means never expire
+        self.replay_only = bool(CONFIG.llm_cache_replay_only if replay_only is None else replay_only)
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            # WAL keeps the per-hit `accessed_at` update cheap
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(
+        model: str, messages: list[dict], temperature: float, max_tokens: int, functions: Optional[list[dict]] = None
+    ) -> str:
+        """Content address of a request: sha256 over its canonical JSON form"""
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        if functions:
+            request["functions"] = functions
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached response, or None on a miss. Raise LLMCacheMissError on a miss in replay-only mode"""
+        row = self.conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row and self.ttl and row[1] + self.ttl < now:
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self.conn.commit()
+            row = None
+        if not row:
+            self.misses += 1
+            if self.replay_only:
+                raise LLMCacheMissError(key)
+            return None
+
+        self.hits += 1
+        self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        logger.debug(f"LLM cache hit: {key}")
+        return json.loads(row[0])
+
+    def set(self, key: str, rsp: dict):
+        """Store a response, evicting the least recently used entries beyond max_entries"""
+        if self.replay_only:
+            return
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(rsp, ensure_ascii=False), now, now),
+        )
+        if self.max_entries > 0:
+            self.conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM llm_cache")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
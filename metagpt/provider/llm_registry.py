@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/6 10:12
+@File    : llm_registry.py
+@Desc    : Hand out shared LLM provider instances instead of constructing one per Action/Role
+"""
+from typing import Optional
+
+from metagpt.config import CONFIG
+from metagpt.provider.anthropic_api import AnthropicClientPool
+from metagpt.provider.openai_api import AioSessionPool, OpenAIGPTAPI
+from metagpt.utils.singleton import Singleton
+
+
+class LLMRegistry(metaclass=Singleton):
+    """Shared OpenAIGPTAPI instances keyed by endpoint and model configuration.
+
+    Instances returned here are shared: do not mutate `model`, `auto_max_tokens` or `temperature` on them,
+    ask the registry for an instance with the configuration you need instead.
+    """
+
+    def __init__(self):
+        self._llms: dict[tuple, OpenAIGPTAPI] = {}
+
+    def get(
+        self, model: Optional[str] = None, auto_max_tokens: bool = False, temperature: Optional[float] = None
+    ) -> OpenAIGPTAPI:
+        model = model or CONFIG.openai_api_model
+        key = (CONFIG.openai_api_base, CONFIG.openai_api_type, model, auto_max_tokens, temperature)
+        llm = self._llms.get(key)
+        if llm is None:
+            llm = OpenAIGPTAPI(model=model)
+            llm.auto_max_tokens = auto_max_tokens
+            if temperature is not None:
+                llm.temperature = temperature
+            self._llms[key] = llm
+        return llm
+
+    def clear(self):
+        self._llms.clear()
+
+    async def aclose(self):
+        """Close the connection pools the providers opened in the running event loop, before it ends"""
+        await AioSessionPool().close()
+        await AnthropicClientPool().close()
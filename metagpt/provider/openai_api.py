@@ -6,21 +6,33 @@
 """
 import asyncio
 import time
-from typing import NamedTuple, Union
+import weakref
+from contextlib import contextmanager
+from typing import AsyncIterator, NamedTuple, Optional, Union
 
+import aiohttp
 import openai
-from openai.error import APIConnectionError
-from tenacity import (
-    after_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_fixed,
-)
 
 from metagpt.config import CONFIG
 from metagpt.logs import logger
-from metagpt.provider.base_gpt_api import BaseGPTAPI
+from metagpt.provider.base_gpt_api import BaseGPTAPI, StreamSink
+from metagpt.provider.hedging import (
+    LatencyTracker,
+    LatencyTrackerManager,
+    hedge,
+    hedge_stream,
+    hedging_enabled,
+)
+from metagpt.provider.llm_cache import LLMResponseCache
+from metagpt.provider.rate_limiter import RateLimiterManager, TokenBucketRateLimiter
+from metagpt.provider.request_coalescer import RequestCoalescer
+from metagpt.provider.resilience import (
+    CircuitBreaker,
+    CircuitBreakerManager,
+    get_request_timeout,
+    llm_retry,
+)
+from metagpt.utils.metrics import LLMMetrics
 from metagpt.utils.singleton import Singleton
 from metagpt.utils.token_counter import (
     TOKEN_COSTS,
@@ -30,29 +42,35 @@ from metagpt.utils.token_counter import (
 )
 
 
-class RateLimiter:
-    """Rate control class, each call goes through wait_if_needed, sleep if rate control is needed"""
-
-    def __init__(self, rpm):
-        self.last_call_time = 0
-        # Here 1.1 is used because even if the calls are made strictly according to time,
-        # they will still be QOS'd; consider switching to simple error retry later
-        self.interval = 1.1 * 60 / rpm
-        self.rpm = rpm
-
-    def split_batches(self, batch):
-        return [batch[i : i + self.rpm] for i in range(0, len(batch), self.rpm)]
-
-    async def wait_if_needed(self, num_requests):
-        current_time = time.time()
-        elapsed_time = current_time - self.last_call_time
+class AioSessionPool(metaclass=Singleton):
+    """Keep one aiohttp session, i.e. one HTTP keep-alive connection pool, per endpoint and event loop.
+    Without it openai creates and closes a session, paying a TLS handshake, on every request."""
 
-        if elapsed_time < self.interval * num_requests:
-            remaining_time = self.interval * num_requests - elapsed_time
-            logger.info(f"sleep {remaining_time}")
-            await asyncio.sleep(remaining_time)
+    def __init__(self):
+        self._sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def get(self, endpoint: str) -> aiohttp.ClientSession:
+        sessions = self._sessions.setdefault(asyncio.get_running_loop(), {})
+        session = sessions.get(endpoint)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60))
+            sessions[endpoint] = session
+        return session
+
+    @contextmanager
+    def use(self, endpoint: str):
+        """Make openai issue the requests within this block through the pooled session"""
+        token = openai.aiosession.set(self.get(endpoint))
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
 
-        self.last_call_time = time.time()
+    async def close(self):
+        """Close the sessions of the running event loop"""
+        sessions = self._sessions.pop(asyncio.get_running_loop(), {})
+        for session in sessions.values():
+            await session.close()
 
 
 class Costs(NamedTuple):
@@ -79,6 +97,9 @@ class CostManager(metaclass=Singleton):
         prompt_tokens (int): The number of tokens used in the prompt.
         completion_tokens (int): The number of tokens used in the completion.
         model (str): The model used for the API call.
+
+        Returns:
+        float: The cost of this API call.
         """
         self.total_prompt_tokens += prompt_tokens
         self.total_completion_tokens += completion_tokens
@@ -91,6 +112,7 @@ class CostManager(metaclass=Singleton):
             f"Current cost: ${cost:.3f}, prompt_tokens: {prompt_tokens}, completion_tokens: {completion_tokens}"
         )
         CONFIG.total_cost = self.total_cost
+        return cost
 
     def get_total_prompt_tokens(self):
         """
@@ -110,45 +132,37 @@ class CostManager(metaclass=Singleton):
         """
         return self.total_completion_tokens
 
+    def get_total_cost(self):
+        """
+        Get the total cost of API calls.
 
-def get_total_cost(self):
-    """
-    Get the total cost of API calls.
-
-    Returns:
-    float: The total cost of API calls.
-    """
-    return self.total_cost
-
-
-def get_costs(self) -> Costs:
-    """Get all costs"""
-    return Costs(self.total_prompt_tokens, self.total_completion_tokens, self.total_cost, self.total_budget)
-
-
-def log_and_reraise(retry_state):
-    logger.error(f"Retry attempts exhausted. Last exception: {retry_state.outcome.exception()}")
-    logger.warning(
+        Returns:
+        float: The total cost of API calls.
         """
-Recommend going to https://deepwisdom.feishu.cn/wiki/MsGnwQBjiif9c3koSJNcYaoSnu4#part-XdatdVlhEojeAfxaaEZcMV3ZniQ
-See FAQ 5.8
-"""
-    )
-    raise retry_state.outcome.exception()
+        return self.total_cost
+
+    def get_costs(self) -> Costs:
+        """Get all costs"""
+        return Costs(self.total_prompt_tokens, self.total_completion_tokens, self.total_cost, self.total_budget)
 
 
-class OpenAIGPTAPI(BaseGPTAPI, RateLimiter):
+class OpenAIGPTAPI(BaseGPTAPI):
     """
     Check https://platform.openai.com/examples for examples
     """
 
-    def __init__(self):
+    def __init__(self, model: str = None):
+        super().__init__()
         self.__init_openai(CONFIG)
         self.llm = openai
-        self.model = CONFIG.openai_api_model
+        self.model = model or CONFIG.openai_api_model
         self.auto_max_tokens = False
+        self.temperature = 0.3
         self._cost_manager = CostManager()
-        RateLimiter.__init__(self, rpm=self.rpm)
+        self._session_pool = AioSessionPool()
+        self._cache = LLMResponseCache()
+        self._coalescer = RequestCoalescer()
+        self._metrics = LLMMetrics()
 
     def __init_openai(self, config):
         openai.api_key = config.openai_api_key
@@ -158,38 +172,102 @@ class OpenAIGPTAPI(BaseGPTAPI, RateLimiter):
             openai.api_type = config.openai_api_type
             openai.api_version = config.openai_api_version
         self.rpm = int(config.get("RPM", 10))
+        self.tpm = int(config.openai_api_tpm or 0)
+
+    @property
+    def rate_limiter(self) -> TokenBucketRateLimiter:
+        """The process-wide limiter of the current model, shared by every OpenAIGPTAPI instance"""
+        return RateLimiterManager().get(self.model, rpm=self.rpm, tpm=self.tpm)
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """The process-wide circuit breaker of the current endpoint"""
+        return CircuitBreakerManager().get(openai.api_base)
+
+    async def _acquire_rate_limit(self, messages: list[dict]) -> int:
+        """Wait for the rate limiter, return the prompt token estimate to settle with `record_usage` later"""
+        limiter = self.rate_limiter
+        estimated_tokens = 0
+        if limiter.tpm:
+            try:
+                estimated_tokens = count_message_tokens(messages, self.model)
+            except Exception as e:
+                logger.warning(f"prompt token estimation failed: {e}")
+        await limiter.acquire(estimated_tokens)
+        return estimated_tokens
+
+    def _latency_tracker(self, kind: str) -> LatencyTracker:
+        return LatencyTrackerManager().get(f"{self.model}:{kind}")
+
+    def _achat_completion_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """Stream the deltas, hedged when enabled for the calling action"""
+        if not hedging_enabled():
+            return self._achat_completion_stream_once(messages)
+        return hedge_stream(lambda: self._achat_completion_stream_once(messages), self._latency_tracker("stream"))
+
+    async def _achat_completion_stream_once(self, messages: list[dict]) -> AsyncIterator[str]:
+        estimated_tokens = await self._acquire_rate_limit(messages)
+        start = time.monotonic()
+        try:
+            with self._session_pool.use(openai.api_base), self.circuit_breaker.guard():
+                response = await openai.ChatCompletion.acreate(**self._cons_kwargs(messages), stream=True)
+        except asyncio.CancelledError:
+            # sent but abandoned before answering, e.g. the losing request of a hedge: its prompt is billed
+            self._settle_stream(messages, "", estimated_tokens, start, None)
+            raise
+
+        # collect the stream of deltas, costs are updated even if the consumer stops early
+        collected_messages = []
+        ttft = None
+        try:
+            async for chunk in response:
+                choices = chunk["choices"]
+                if len(choices) > 0:
+                    chunk_message = choices[0].get("delta", {})  # extract the message
+                    if "content" in chunk_message:
+                        if ttft is None:
+                            ttft = time.monotonic() - start
+                            self._latency_tracker("stream").record(ttft)
+                        collected_messages.append(chunk_message["content"])
+                        yield chunk_message["content"]
+        finally:
+            self._settle_stream(messages, "".join(collected_messages), estimated_tokens, start, ttft)
+
+    def _settle_stream(
+        self, messages: list[dict], content: str, estimated_tokens: int, start: float, ttft: Optional[float]
+    ):
+        usage = self._calc_usage(messages, content)
+        self.rate_limiter.record_usage(estimated_tokens, usage)
+        self._update_costs(usage, latency=time.monotonic() - start, ttft=ttft)
+
+    async def astream(self, messages: list[dict]) -> AsyncIterator[str]:
+        key = self._request_key(messages)
+        rsp = self._get_cached(key)
+        if rsp:
+            yield self.get_choice_text(rsp)
+            return
 
-    async def _achat_completion_stream(self, messages: list[dict]) -> str:
-        response = await openai.ChatCompletion.acreate(**self._cons_kwargs(messages), stream=True)
-
-        # create variables to collect the stream of chunks
-        collected_chunks = []
         collected_messages = []
-        # iterate through the stream of events
-        async for chunk in response:
-            collected_chunks.append(chunk)  # save the event response
-            choices = chunk["choices"]
-            if len(choices) > 0:
-                chunk_message = chunk["choices"][0].get("delta", {})  # extract the message
-                collected_messages.append(chunk_message)  # save the message
-                if "content" in chunk_message:
-                    print(chunk_message["content"], end="")
-        print()
-
-        full_reply_content = "".join([m.get("content", "") for m in collected_messages])
-        usage = self._calc_usage(messages, full_reply_content)
-        self._update_costs(usage)
-        return full_reply_content
-
-    def _cons_kwargs(self, messages: list[dict]) -> dict:
+        async for delta in self._achat_completion_stream(messages):
+            collected_messages.append(delta)
+            yield delta
+        self._set_cached(key, {"choices": [{"message": self._assistant_msg("".join(collected_messages))}]})
+
+    def _cons_kwargs(self, messages: list[dict], functions: Optional[list[dict]] = None) -> dict:
+        max_tokens = self.get_max_tokens(messages)
+        timeout = get_request_timeout(max_tokens)
         kwargs = {
             "messages": messages,
-            "max_tokens": self.get_max_tokens(messages),
+            "max_tokens": max_tokens,
             "n": 1,
             "stop": None,
-            "temperature": 0.3,
-            "timeout": 3,
+            "temperature": self.temperature,
+            "request_timeout": timeout,  # of the HTTP request
+            "timeout": timeout,  # of waiting for the model to warm up
         }
+        if functions:
+            kwargs["functions"] = functions
+            kwargs["function_call"] = {"name": functions[0]["name"]}  # force the structured answer
         if CONFIG.openai_api_type == "azure":
             if CONFIG.deployment_name and CONFIG.deployment_id:
                 raise ValueError("You can only use one of the `deployment_id` or `deployment_name` model")
@@ -205,40 +283,115 @@ class OpenAIGPTAPI(BaseGPTAPI, RateLimiter):
         kwargs.update(kwargs_mode)
         return kwargs
 
-    async def _achat_completion(self, messages: list[dict]) -> dict:
-        rsp = await self.llm.ChatCompletion.acreate(**self._cons_kwargs(messages))
-        self._update_costs(rsp.get("usage"))
+    async def _achat_completion(self, messages: list[dict], functions: Optional[list[dict]] = None) -> dict:
+        """Hedged when enabled for the calling action, the cancelled duplicate is billed for its prompt"""
+        if not hedging_enabled():
+            return await self._achat_completion_once(messages, functions)
+        return await hedge(
+            lambda: self._achat_completion_once(messages, functions),
+            self._latency_tracker("completion"),
+            on_cancelled=lambda: self._update_costs(self._calc_usage(messages, "")),
+        )
+
+    async def _achat_completion_once(self, messages: list[dict], functions: Optional[list[dict]] = None) -> dict:
+        estimated_tokens = await self._acquire_rate_limit(messages)
+        start = time.monotonic()
+        with self._session_pool.use(openai.api_base), self.circuit_breaker.guard():
+            rsp = await self.llm.ChatCompletion.acreate(**self._cons_kwargs(messages, functions))
+        latency = time.monotonic() - start
+        self._latency_tracker("completion").record(latency)
+        self.rate_limiter.record_usage(estimated_tokens, rsp.get("usage"))
+        self._update_costs(rsp.get("usage"), latency=latency)
         return rsp
 
     def _chat_completion(self, messages: list[dict]) -> dict:
+        start = time.monotonic()
         rsp = self.llm.ChatCompletion.create(**self._cons_kwargs(messages))
-        self._update_costs(rsp)
+        self._update_costs(rsp.get("usage"), latency=time.monotonic() - start)
         return rsp
 
+    def _request_key(self, messages: list[dict], functions: Optional[list[dict]] = None) -> str:
+        """Content address of a request, shared by the response cache and request coalescing"""
+        kwargs = self._cons_kwargs(messages)
+        model = kwargs.get("model") or kwargs.get("engine") or kwargs.get("deployment_id")
+        return self._cache.make_key(model, messages, kwargs["temperature"], kwargs["max_tokens"], functions)
+
+    def _get_cached(self, key: str) -> Optional[dict]:
+        """Look the request up in the response cache. A hit skips the network and the cost update"""
+        if not self._cache.enabled:
+            return None
+        return self._cache.get(key)
+
+    def _set_cached(self, key: str, rsp: dict):
+        if self._cache.enabled:
+            self._cache.set(key, rsp)
+
+    async def _coalesce(self, key: str, func):
+        """Await an identical request already in flight instead of issuing a duplicate one.
+
+        Only deterministic (temperature 0) requests are coalesced, unless LLM_COALESCE opts sampled ones in too:
+        independent sampled calls would otherwise silently get the same completion.
+        """
+        if self.temperature and not CONFIG.llm_coalesce:
+            return await func()
+        return await self._coalescer.run(key, func)
+
     def completion(self, messages: list[dict]) -> dict:
         # if isinstance(messages[0], Message):
         #     messages = self.messages_to_dict(messages)
-        return self._chat_completion(messages)
+        key = self._request_key(messages)
+        rsp = self._get_cached(key)
+        if rsp:
+            return rsp
+        rsp = self._chat_completion(messages)
+        self._set_cached(key, rsp)
+        return rsp
 
-    async def acompletion(self, messages: list[dict]) -> dict:
+    async def _acompletion_and_cache(
+        self, key: str, messages: list[dict], functions: Optional[list[dict]] = None
+    ) -> dict:
+        rsp = await self._achat_completion(messages, functions)
+        self._set_cached(key, rsp)
+        return rsp
+
+    async def acompletion(self, messages: list[dict], functions: Optional[list[dict]] = None) -> dict:
+        """With `functions`, the model is made to call the first one, see `aask_function`"""
         # if isinstance(messages[0], Message):
         #     messages = self.messages_to_dict(messages)
-        return await self._achat_completion(messages)
-
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(1),
-        after=after_log(logger, logger.level("WARNING").name),
-        retry=retry_if_exception_type(APIConnectionError),
-        retry_error_callback=log_and_reraise,
-    )
-    async def acompletion_text(self, messages: list[dict], stream=False) -> str:
-        """when streaming, print each token in place."""
+        key = self._request_key(messages, functions)
+        rsp = self._get_cached(key)
+        if rsp:
+            return rsp
+        return await self._coalesce(f"completion:{key}", lambda: self._acompletion_and_cache(key, messages, functions))
+
+    @llm_retry()
+    async def acompletion_text(
+        self, messages: list[dict], stream=False, sinks: Optional[list[StreamSink]] = None
+    ) -> str:
+        """when streaming, forward each token to `sinks`, `stream_sinks` by default, in place."""
         if stream:
-            return await self._achat_completion_stream(messages)
-        rsp = await self._achat_completion(messages)
+            # coalesced callers get the full text, only the first caller's sinks see the deltas
+            key = self._request_key(messages)
+            return await self._coalesce(f"stream:{key}", lambda: self._astream_to_sinks(messages, sinks))
+        rsp = await self.acompletion(messages)
         return self.get_choice_text(rsp)
 
+    @llm_retry()
+    async def aask_function(self, msg: str, function: dict, system_msgs: Optional[list[str]] = None) -> str:
+        """Answer through native function calling, the structured output is the arguments of the call"""
+        messages = self._ask_msgs(msg, system_msgs)
+        logger.debug(messages)
+        rsp = await self.acompletion(messages, functions=[function])
+        return self.get_function_arguments(rsp)
+
+    def get_function_arguments(self, rsp: dict) -> str:
+        """The JSON arguments of the function called, or the text answer if the model did not call it"""
+        message = rsp.get("choices")[0]["message"]
+        function_call = message.get("function_call")
+        if function_call:
+            return function_call["arguments"]
+        return message.get("content") or ""
+
     def _calc_usage(self, messages: list[dict], rsp: str) -> dict:
         usage = {}
         if CONFIG.calc_usage:
@@ -253,44 +406,32 @@ class OpenAIGPTAPI(BaseGPTAPI, RateLimiter):
         else:
             return usage
 
-    async def acompletion_batch(self, batch: list[list[dict]]) -> list[dict]:
-        """Return full JSON"""
-        split_batches = self.split_batches(batch)
-        all_results = []
-
-        for small_batch in split_batches:
-            logger.info(small_batch)
-            await self.wait_if_needed(len(small_batch))
-
-            future = [self.acompletion(prompt) for prompt in small_batch]
-            results = await asyncio.gather(*future)
-            logger.info(results)
-            all_results.extend(results)
-
-        return all_results
-
-    async def acompletion_batch_text(self, batch: list[list[dict]]) -> list[str]:
-        """Only return plain text"""
-        raw_results = await self.acompletion_batch(batch)
-        results = []
-        for idx, raw_result in enumerate(raw_results, start=1):
-            result = self.get_choice_text(raw_result)
-            results.append(result)
-            logger.info(f"Result of task {idx}: {result}")
-        return results
-
-    def _update_costs(self, usage: dict):
+    @llm_retry()
+    async def _acompletion_with_retry(self, idx: int, messages: list[dict]) -> tuple[int, dict]:
+        return idx, await self.acompletion(messages)
+
+    def _update_costs(self, usage: dict, latency: Optional[float] = None, ttft: Optional[float] = None):
+        prompt_tokens = completion_tokens = cost = 0
         if CONFIG.calc_usage:
             try:
                 prompt_tokens = int(usage["prompt_tokens"])
                 completion_tokens = int(usage["completion_tokens"])
-                self._cost_manager.update_cost(prompt_tokens, completion_tokens, self.model)
+                cost = self._cost_manager.update_cost(prompt_tokens, completion_tokens, self.model)
             except Exception as e:
                 logger.error("updating costs failed!", e)
+        self._metrics.record(self.model, prompt_tokens, completion_tokens, cost, latency=latency, ttft=ttft)
 
     def get_costs(self) -> Costs:
         return self._cost_manager.get_costs()
 
+    def get_hedge_stats(self) -> dict:
+        """Per model and request kind: latency samples, current hedging deadline, duplicates sent and won"""
+        return LatencyTrackerManager().get_stats()
+
+    def get_coalesce_stats(self) -> dict:
+        """Number of requests issued, coalesced into one in flight, and currently in flight"""
+        return self._coalescer.get_stats()
+
     def get_max_tokens(self, messages: list[dict]):
         if not self.auto_max_tokens:
             return CONFIG.max_tokens_rsp
@@ -321,5 +462,6 @@ class OpenAIGPTAPI(BaseGPTAPI, RateLimiter):
             logger.error(f"moderating failed:{e}")
 
     async def _amoderation(self, content: Union[str, list[str]]):
-        rsp = await self.llm.Moderation.acreate(input=content)
+        with self._session_pool.use(openai.api_base):
+            rsp = await self.llm.Moderation.acreate(input=content)
         return rsp
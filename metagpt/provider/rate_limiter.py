@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/5 14:37
+@File    : rate_limiter.py
+@Desc    : Process-wide token bucket rate limiting of requests-per-minute and tokens-per-minute
+"""
+import asyncio
+import time
+
+from metagpt.logs import logger
+from metagpt.utils.singleton import Singleton
+
+
+class TokenBucket:
+    """A bucket refilled continuously at `capacity` per minute. Its level may go negative to record debt."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60
+        self.level = capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be consumed, amounts above capacity only need a full bucket"""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= amount
+
+
+class TokenBucketRateLimiter:
+    """Limit both requests-per-minute and tokens-per-minute, 0 means unlimited.
+
+    Callers `acquire` with the estimated prompt tokens before a request and `record_usage` with the actual
+    usage afterwards, so under- and over-estimates are settled against the token bucket.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens: int = 0):
+        while True:
+            wait = 0
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket:
+                    bucket.refill()
+                    wait = max(wait, bucket.wait_time(amount))
+            if not wait:
+                break
+            logger.debug(f"rate limited, sleep {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+        # No await between the check above and here, so concurrent acquirers can't overdraw
+        if self.requests:
+            self.requests.consume(1)
+        if self.tokens:
+            self.tokens.consume(tokens)
+
+    def record_usage(self, estimated_tokens: int, usage: dict):
+        """Settle the difference between the estimated and the actual total tokens of a finished request"""
+        if not self.tokens or not usage:
+            return
+        actual = int(usage.get("prompt_tokens", 0)) + int(usage.get("completion_tokens", 0))
+        self.tokens.consume(actual - estimated_tokens)
+
+
+class RateLimiterManager(metaclass=Singleton):
+    """Hand out one rate limiter per model and limits, shared by every provider instance in the process"""
+
+    def __init__(self):
+        self._limiters: dict[tuple[str, int, int], TokenBucketRateLimiter] = {}
+
+    def get(self, model: str, rpm: int = 0, tpm: int = 0) -> TokenBucketRateLimiter:
+        key = (model, rpm, tpm)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = TokenBucketRateLimiter(rpm=rpm, tpm=tpm)
+            self._limiters[key] = limiter
+        return limiter
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/8 15:20
+@File    : request_coalescer.py
+@Desc    : Single-flight coalescing of identical in-flight LLM requests
+"""
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable
+
+from metagpt.logs import logger
+from metagpt.utils.singleton import Singleton
+
+
+class RequestCoalescer(metaclass=Singleton):
+    """When a request with the same key is already in flight, await its result instead of issuing a duplicate.
+
+    The request runs as its own task, so cancelling the caller that started it doesn't cancel the others.
+    Each caller gets its own copy of the result.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self.calls = 0  # requests actually issued
+        self.coalesced = 0  # requests answered by awaiting one already in flight
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+            logger.debug(f"coalesced with an identical request in flight: {key}")
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here, so an unawaited failure is not reported as never retrieved
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def get_stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": self.in_flight}
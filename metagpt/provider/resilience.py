@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/12 15:10
+@File    : resilience.py
+@Desc    : Error classification, jittered retries honouring Retry-After, circuit breaking and timeout sizing
+           shared by the LLM providers
+"""
+import email.utils
+import random
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import anthropic
+import openai.error
+from tenacity import (
+    RetryCallState,
+    after_log,
+    retry,
+    retry_base,
+    retry_if_exception,
+    stop_after_attempt,
+)
+from tenacity.wait import wait_base
+
+from metagpt.config import CONFIG
+from metagpt.logs import logger
+from metagpt.provider.llm_cache import LLMCacheMissError
+from metagpt.utils.singleton import Singleton
+
+# error classes
+FATAL = "fatal"  # the request itself is wrong, retrying won't help
+RATE_LIMIT = "rate_limit"  # the endpoint is fine but asks us to slow down
+TRANSIENT = "transient"  # connection errors, timeouts and 5xx, the endpoint is struggling
+CIRCUIT_OPEN = "circuit_open"  # not sent, the endpoint is considered down
+
+# timeouts are sized as a fixed allowance plus the time to generate the expected completion
+TIMEOUT_BASE = 15
+TIMEOUT_TOKENS_PER_SECOND = 20
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to an endpoint whose circuit breaker is open"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"circuit breaker of {endpoint} is open, retry after {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class StreamInterruptedError(Exception):
+    """A streamed completion failed after some of its deltas were delivered, it is not retried, which would deliver
+    them again"""
+
+    def __init__(self, delivered: str):
+        super().__init__(f"stream interrupted after {len(delivered)} characters were delivered")
+        self.delivered = delivered
+
+
+def classify_error(e: BaseException) -> str:
+    if isinstance(e, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(e, (openai.error.RateLimitError, anthropic.RateLimitError)):
+        return RATE_LIMIT
+    if isinstance(
+        e,
+        (
+            openai.error.APIConnectionError,
+            openai.error.Timeout,
+            openai.error.ServiceUnavailableError,
+            openai.error.TryAgain,
+            anthropic.APIConnectionError,
+            anthropic.InternalServerError,
+        ),
+    ):
+        return TRANSIENT
+    if isinstance(e, openai.error.APIError) and (e.http_status is None or e.http_status >= 500):
+        return TRANSIENT
+    return FATAL
+
+
+def is_llm_error(e: BaseException) -> bool:
+    """Whether the exception comes from the provider, such errors are already retried by the provider.
+    A cache miss in replay-only mode is one too, no retry can answer it"""
+    return isinstance(
+        e, (openai.error.OpenAIError, anthropic.APIError, CircuitOpenError, StreamInterruptedError, LLMCacheMissError)
+    )
+
+
+def get_retry_after(e: BaseException) -> Optional[float]:
+    """Seconds the endpoint asked us to wait, from the Retry-After header (seconds or HTTP date) if any"""
+    if isinstance(e, CircuitOpenError):
+        return e.retry_after
+    headers = getattr(e, "headers", None)
+    if headers is None and isinstance(e, anthropic.APIStatusError):
+        headers = e.response.headers
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_request_timeout(max_tokens: int) -> float:
+    """Timeout of a request that may generate `max_tokens`, unless fixed with LLM_TIMEOUT"""
+    if CONFIG.llm_timeout:
+        return float(CONFIG.llm_timeout)
+    return TIMEOUT_BASE + max_tokens / TIMEOUT_TOKENS_PER_SECOND
+
+
+class wait_decorrelated_jitter(wait_base):
+    """Decorrelated jitter backoff, sleep = min(cap, uniform(base, 3 * previous sleep)), so that clients failing
+    together don't retry together. A Retry-After given by the endpoint is honoured, up to `cap`."""
+
+    def __init__(self, base: float = 1, cap: float = 60):
+        self.base = base
+        self.cap = cap
+        self._last_sleeps: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        last_sleep = self._last_sleeps.get(retry_state, self.base)
+        sleep = min(self.cap, random.uniform(self.base, last_sleep * 3))
+        self._last_sleeps[retry_state] = sleep
+
+        retry_after = get_retry_after(retry_state.outcome.exception())
+        if retry_after is not None:
+            sleep = min(self.cap, retry_after + random.uniform(0, self.base))
+        return sleep
+
+
+# for callers retrying their own failures (e.g. unparsable answers) around an LLM call, which is retried already
+retry_if_not_llm_error = retry_if_exception(lambda e: not is_llm_error(e))
+
+
+class retry_if_retryable(retry_base):
+    """Retry rate limits, transient errors and open circuits, never fatal errors"""
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        if not retry_state.outcome.failed:
+            return False
+        return classify_error(retry_state.outcome.exception()) != FATAL
+
+
+def log_and_reraise(retry_state):
+    logger.error(f"Retry attempts exhausted. Last exception: {retry_state.outcome.exception()}")
+    logger.warning(
+        """
+Recommend going to https://deepwisdom.feishu.cn/wiki/MsGnwQBjiif9c3koSJNcYaoSnu4#part-XdatdVlhEojeAfxaaEZcMV3ZniQ
+See FAQ 5.8
+"""
+    )
+    raise retry_state.outcome.exception()
+
+
+def llm_retry(**kwargs):
+    """The retry policy of LLM requests: classified errors, decorrelated jitter, Retry-After and LLM_MAX_ATTEMPTS"""
+    policy = dict(
+        stop=stop_after_attempt(CONFIG.llm_max_attempts),
+        wait=wait_decorrelated_jitter(),
+        after=after_log(logger, logger.level("WARNING").name),
+        retry=retry_if_retryable(),
+        retry_error_callback=log_and_reraise,
+    )
+    policy.update(kwargs)
+    return retry(**policy)
+
+
+class CircuitBreaker:
+    """Trip when the share of transient failures among the recent requests of an endpoint spikes.
+
+    While open, requests fail fast with CircuitOpenError. After `cooldown` seconds one probe request is let
+    through (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(
+        self, endpoint: str, window: float = 60, min_requests: int = 10, threshold: float = 0.5, cooldown: float = 30
+    ):
+        self.endpoint = endpoint
+        self.window = window
+        self.min_requests = min_requests
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.outcomes: deque[tuple[float, bool]] = deque()  # (time, failed)
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return
+        retry_after = max(self.cooldown - (time.monotonic() - self.opened_at), 1)
+        raise CircuitOpenError(self.endpoint, retry_after)
+
+    def record(self, failed: bool):
+        now = time.monotonic()
+        if self.probing:
+            self.probing = False
+            if failed:
+                self._open(now)
+            else:
+                self.opened_at = None
+                self.outcomes.clear()
+                logger.info(f"circuit breaker of {self.endpoint} closed")
+            return
+
+        self.outcomes.append((now, failed))
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            self.outcomes.popleft()
+        failures = sum(i[1] for i in self.outcomes)
+        if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.threshold:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.opened_at = now
+        self.outcomes.clear()
+        logger.warning(f"circuit breaker of {self.endpoint} opened for {self.cooldown}s")
+
+    @contextmanager
+    def guard(self):
+        """Check the circuit before a request and record its outcome, rate limits and fatal errors count as the
+        endpoint being up"""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            cls = classify_error(e)
+            if cls == TRANSIENT:
+                self.record(failed=True)
+            elif cls != CIRCUIT_OPEN:
+                self.record(failed=False)
+            raise
+        except BaseException:
+            # cancelled, the probe slot must be released without judging the endpoint
+            self.probing = False
+            raise
+        self.record(failed=False)
+
+
+class CircuitBreakerManager(metaclass=Singleton):
+    """Hand out one circuit breaker per endpoint, shared by every provider instance in the process"""
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint)
+            self._breakers[endpoint] = breaker
+        return breaker
+
+    def clear(self):
+        self._breakers.clear()
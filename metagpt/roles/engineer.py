@@ -121,7 +121,7 @@ class Engineer(Role):
 
     def recv(self, message: Message) -> None:
         self._rc.memory.add(message)
-        if message in self._rc.important_memory:
+        if message.cause_by in self._rc.watch:  # i.e. in important_memory
             self.todos = self.parse_tasks(message)
 
     async def _act_mp(self) -> Message:
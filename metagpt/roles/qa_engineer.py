@@ -145,6 +145,9 @@ class QaEngineer(Role):
             )
             self._publish_message(msg)
 
+    def is_relevant(self, message: Message) -> bool:
+        return super().is_relevant(message) and message.send_to == self.profile
+
     async def _observe(self) -> int:
         await super()._observe()
         self._rc.news = [
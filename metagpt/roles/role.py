@@ -14,10 +14,11 @@ from pydantic import BaseModel, Field
 # from metagpt.environment import Environment
 from metagpt.config import CONFIG
 from metagpt.actions import Action, ActionOutput
-from metagpt.llm import LLM
+from metagpt.llm import get_llm
 from metagpt.logs import logger
-from metagpt.memory import Memory, LongTermMemory
+from metagpt.memory import Memory, LongTermMemory, MemoryView
 from metagpt.schema import Message
+from metagpt.utils.metrics import metric_tags
 
 PREFIX_TEMPLATE = """You are a {profile}, named {name}, your goal is {goal}, and the constraint is {constraints}. """
 
@@ -65,6 +66,7 @@ class RoleSetting(BaseModel):
 class RoleContext(BaseModel):
     """Role Runtime Context"""
     env: 'Environment' = Field(default=None)
+    env_cursor: int = Field(default=0)  # sequence number of the next environment message to observe
     memory: Memory = Field(default_factory=Memory)
     long_term_memory: LongTermMemory = Field(default_factory=LongTermMemory)
     state: int = Field(default=0)
@@ -81,8 +83,8 @@ class RoleContext(BaseModel):
             self.memory = self.long_term_memory  # use memory to act as long_term_memory for unify operation
 
     @property
-    def important_memory(self) -> list[Message]:
-        """Get the information corresponding to the watched actions"""
+    def important_memory(self) -> tuple[Message, ...]:
+        """Get the information corresponding to the watched actions, cached by the memory until they change"""
         return self.memory.get_by_actions(self.watch)
 
     @property
@@ -94,7 +96,7 @@ class Role:
     """Role/Agent"""
 
     def __init__(self, name="", profile="", goal="", constraints="", desc=""):
-        self._llm = LLM()
+        self._llm = get_llm(temperature=0)  # picks a state, repeated across roles over the same history
         self._setting = RoleSetting(name=name, profile=profile, goal=goal, constraints=constraints, desc=desc)
         self._states = []
         self._actions = []
@@ -121,6 +123,8 @@ class Role:
         self._rc.watch.update(actions)
         # check RoleContext after adding watch actions
         self._rc.check(self._role_id)
+        if self._rc.env:
+            self._rc.env.subscribe(self)
 
     def _set_state(self, state):
         """Update the current state."""
@@ -131,6 +135,11 @@ class Role:
     def set_env(self, env: 'Environment'):
         """Set the environment in which the role works. The role can talk to the environment and can also receive messages by observing."""
         self._rc.env = env
+        self._rc.env_cursor = 0
+        if type(self._rc.memory) is Memory:  # a long-term memory keeps its own, persisted copies
+            memory = MemoryView(env.message_log)
+            memory.add_batch(self._rc.memory.get())
+            self._rc.memory = memory
 
     @property
     def profile(self):
@@ -152,7 +161,8 @@ class Role:
         prompt = self._get_prefix()
         prompt += STATE_TEMPLATE.format(history=self._rc.history, states="\n".join(self._states),
                                         n_states=len(self._states) - 1)
-        next_state = await self._llm.aask(prompt)
+        with metric_tags(action="_think"):
+            next_state = await self._llm.aask(prompt)
         logger.debug(f"{prompt=}")
         if not next_state.isdigit() or int(next_state) not in range(len(self._states)):
             logger.warning(f'Invalid answer of state, {next_state=}')
@@ -181,10 +191,12 @@ class Role:
         """Observe from the environment, obtain important information, and add it to memory"""
         if not self._rc.env:
             return 0
-        env_msgs = self._rc.env.memory.get()
+        # only the messages published since the last observation
+        env_msgs = self._rc.env.get_messages_since(self._rc.env_cursor)
+        self._rc.env_cursor += len(env_msgs)
+
+        observed = [i for i in env_msgs if i.cause_by in self._rc.watch]
 
-        observed = self._rc.env.memory.get_by_actions(self._rc.watch)
-        
         self._rc.news = self._rc.memory.remember(observed)  # remember recent exact or similar memories
 
         for i in env_msgs:
@@ -195,6 +207,10 @@ class Role:
             logger.debug(f'{self._setting} observed: {news_text}')
         return len(self._rc.news)
 
+    def is_relevant(self, message: Message) -> bool:
+        """Whether an environment message is news to the role, i.e. worth waking it up for"""
+        return message.cause_by in self._rc.watch and message not in self._rc.memory
+
     def _publish_message(self, msg):
         """If the role belongs to env, then the role's messages will be broadcast to env"""
         if not self._rc.env:
@@ -212,8 +228,9 @@ class Role:
         """add message to history."""
         # self._history += f"\n{message}"
         # self._context = self._history
-        if message in self._rc.memory.get():
+        if message in self._rc.memory and not isinstance(self._rc.memory, MemoryView):
             return
+        # a view adds idempotently, and moves the role's own messages into it once they are published
         self._rc.memory.add(message)
 
     async def handle(self, message: Message) -> Message:
@@ -237,7 +254,8 @@ class Role:
             logger.debug(f"{self._setting}: no news. waiting.")
             return
 
-        rsp = await self._react()
+        with metric_tags(role=self.profile):
+            rsp = await self._react()
         # Publish the reply to the environment, waiting for the next subscriber to process
         self._publish_message(rsp)
         return rsp
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/16 10:20
+@File    : scheduler.py
+@Desc    : Event-driven scheduling of the roles of an environment, a role runs as soon as a message it watches is
+           published, instead of every role every round
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Optional
+
+from metagpt.logs import logger
+from metagpt.roles import Role
+from metagpt.schema import Message
+from metagpt.utils.metrics import metric_tags
+
+if TYPE_CHECKING:
+    from metagpt.environment import Environment
+
+
+class RoleScheduler:
+    """Run the roles of `env` as their inputs arrive, until none has anything left to do (quiescence).
+
+    A role never runs concurrently with itself: messages published while it runs are picked up by its next run,
+    which starts as soon as the current one ends. Each role runs at most `max_runs` times.
+    """
+
+    def __init__(self, env: Environment, max_runs: int = 3, before_run: Optional[Callable[[], None]] = None):
+        self.env = env
+        self.max_runs = max_runs
+        self.before_run = before_run  # e.g. a budget check, raising stops the whole run
+        self.runs: Counter[str] = Counter()
+        self.running: dict[str, asyncio.Task] = {}
+
+    def _has_news(self, role: Role) -> bool:
+        return any(role.is_relevant(i) for i in self.env.get_messages_since(role._rc.env_cursor))
+
+    def schedule(self, role: Role):
+        """Start a run of the role, unless it is running already or out of runs"""
+        if role.profile in self.running:
+            return
+        if self.runs[role.profile] >= self.max_runs:
+            logger.debug(f"{role} has run {self.max_runs} times, not scheduled again")
+            return
+        self.runs[role.profile] += 1
+        self.running[role.profile] = asyncio.create_task(self._run(role, self.runs[role.profile]))
+
+    def notify(self, message: Message):
+        """Called by the environment when a message is published"""
+        for role in self.env.get_subscribers(message):
+            self.schedule(role)
+
+    async def _run(self, role: Role, round_: int):
+        try:
+            if self.before_run:
+                self.before_run()
+            with metric_tags(round=round_):
+                await role.run()
+        finally:
+            del self.running[role.profile]
+        if self._has_news(role):  # published while it was running
+            self.schedule(role)
+
+    async def run(self) -> int:
+        """Run until quiescence, return the number of role runs"""
+        for role in self.env.roles.values():
+            if self._has_news(role):
+                self.schedule(role)
+        try:
+            while self.running:
+                done, _ = await asyncio.wait(list(self.running.values()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # raise the first failure
+        finally:
+            pending = list(self.running.values())
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        total = sum(self.runs.values())
+        logger.debug(f"no role has news left after {total} runs: {dict(self.runs)}")
+        return total
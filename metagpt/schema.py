@@ -7,7 +7,12 @@
 """
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import hashlib
+import itertools
+import json
+import sys
+import time
+from dataclasses import dataclass, field, fields
 from typing import Type, TypedDict
 
 from pydantic import BaseModel
@@ -20,15 +25,84 @@ class RawMessage(TypedDict):
     role: str
 
 
+_message_seq = itertools.count(1)
+_HASHED_FIELDS = frozenset(["content", "instruct_content", "role", "cause_by", "sent_from", "send_to"])
+_INTERNED_FIELDS = frozenset(["role", "sent_from", "send_to"])
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _slotted(cls):
+    """`dataclass(slots=True, weakref_slot=True)`, for python 3.9: the class rebuilt with its fields as `__slots__`"""
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(i.name for i in fields(cls))
+    for name in field_names + ("__dict__", "__weakref__"):
+        cls_dict.pop(name, None)
+    cls_dict["__slots__"] = field_names + ("__weakref__",)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@_slotted
 @dataclass
 class Message:
-    """list[<role>: <content>]"""
+    """list[<role>: <content>]
+
+    Slotted, with the role and routing strings interned, as a run holds many messages sharing a few of them.
+    """
     content: str
     instruct_content: BaseModel = field(default=None)
     role: str = field(default='user')  # system / user / assistant
     cause_by: Type["Action"] = field(default="")
     sent_from: str = field(default="")
     send_to: str = field(default="")
+    id: str = field(default="", compare=False)  # content hash, assigned at creation
+    seq: int = field(default=0, compare=False)  # creation order in this process, not persisted: a loaded one is new
+    created_at: float = field(default=0.0, compare=False)  # creation time, kept when persisted
+
+    def __post_init__(self):
+        if not self.id:
+            self.id = self.content_hash()
+        if not self.seq:
+            self.seq = next(_message_seq)
+        if not self.created_at:
+            self.created_at = time.time()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, _intern(value) if name in _INTERNED_FIELDS else value)
+        if name in _HASHED_FIELDS and getattr(self, "id", ""):  # changed after creation, the id follows
+            object.__setattr__(self, "id", self.content_hash())
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (None, slots)
+            state = state[1]
+        for name, value in state.items():
+            object.__setattr__(self, name, _intern(value) if name in _INTERNED_FIELDS else value)
+        # pickled before messages had slots, their state being their __dict__ without the newer fields
+        if not getattr(self, "seq", 0):
+            self.seq = next(_message_seq)
+        if not getattr(self, "created_at", 0.0):
+            self.created_at = time.time()
+
+    def content_hash(self) -> str:
+        """Stable across processes, equal messages get equal ids"""
+        cause_by = self.cause_by
+        if isinstance(cause_by, type):
+            cause_by = f"{cause_by.__module__}.{cause_by.__qualname__}"
+        instruct_content = self.instruct_content
+        if isinstance(instruct_content, BaseModel):
+            instruct_content = instruct_content.dict()
+        payload = json.dumps(
+            [self.role, self.content, cause_by, self.sent_from, self.send_to, instruct_content],
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
     def __str__(self):
         # prefix = '-'.join([self.role, str(self.cause_by)])
@@ -49,6 +123,8 @@ class UserMessage(Message):
     """便于支持OpenAI的消息
        Facilitate support for OpenAI messages
     """
+    __slots__ = ()
+
     def __init__(self, content: str):
         super().__init__(content, 'user')
 
@@ -58,6 +134,8 @@ class SystemMessage(Message):
     """便于支持OpenAI的消息
        Facilitate support for OpenAI messages
     """
+    __slots__ = ()
+
     def __init__(self, content: str):
         super().__init__(content, 'system')
 
@@ -67,6 +145,8 @@ class AIMessage(Message):
     """便于支持OpenAI的消息
        Facilitate support for OpenAI messages
     """
+    __slots__ = ()
+
     def __init__(self, content: str):
         super().__init__(content, 'assistant')
 
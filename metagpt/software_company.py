@@ -11,9 +11,11 @@ from metagpt.actions import BossRequirement
 from metagpt.config import CONFIG
 from metagpt.environment import Environment
 from metagpt.logs import logger
+from metagpt.provider.llm_registry import LLMRegistry
 from metagpt.roles import Role
 from metagpt.schema import Message
 from metagpt.utils.common import NoMoneyException
+from metagpt.utils.metrics import LLMMetrics
 
 
 class SoftwareCompany(BaseModel):
@@ -51,12 +53,19 @@ class SoftwareCompany(BaseModel):
         logger.info(self.json())
 
     async def run(self, n_round=3):
-        """Run company until target round or no money"""
-        while n_round > 0:
+        """Run company until no role has news left, each role at most n_round times, or no money"""
+        try:
             # self._save()
-            n_round -= 1
-            logger.debug(f"{n_round=}")
-            self._check_balance()
-            await self.environment.run()
+            runs = await self.environment.run_until_idle(max_runs=n_round, before_run=self._check_balance)
+            logger.info(f"Project idle after {runs} role runs")
+        finally:
+            self._report_metrics()
+            await LLMRegistry().aclose()
         return self.environment.history
+
+    def _report_metrics(self):
+        metrics = LLMMetrics()
+        metrics.log_summary()
+        if CONFIG.metrics_path:
+            metrics.export(CONFIG.metrics_path)
     
\ No newline at end of file
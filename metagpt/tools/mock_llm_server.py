@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/11 14:03
+@File    : mock_llm_server.py
+@Desc    : A local OpenAI chat-completions compatible stand-in server, for offline load and latency testing.
+
+Start it and point OPENAI_API_BASE at it:
+
+    python -m metagpt.tools.mock_llm_server --port 8000 --latency lognormal --latency_mean 2 --error_rate_429 0.05
+    OPENAI_API_BASE: "http://127.0.0.1:8000/v1"
+"""
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import yaml
+from aiohttp import web
+
+from metagpt.logs import logger
+
+STATE_PROMPT_PATTERN = re.compile(r"Just answer a number between 0-\d+")
+CONTENT_PATTERN = re.compile(r"\[CONTENT\].*?\[/CONTENT\]", re.DOTALL)
+DASH_LINE_PATTERN = re.compile(r"^\s*-{3,}\s*$")
+
+
+class ScriptedResponder:
+    """Pick a response for a chat request.
+
+    User rules, loaded from a YAML/JSON list of {pattern, response}, are matched first against the whole prompt.
+    Otherwise role prompts get a role-appropriate answer: the state choice of `Role._think` is answered with "0",
+    and structured action prompts (WritePRD, WriteDesign, WriteTasks, WriteCode...) echo their own format example,
+    which parses like a real answer.
+    """
+
+    def __init__(self, script: str = "", default_response: str = "This is a mock response."):
+        self.rules: list[tuple[re.Pattern, str]] = []
+        self.default_response = default_response
+        if script:
+            for rule in yaml.safe_load(Path(script).read_text(encoding="utf-8")) or []:
+                self.rules.append((re.compile(rule["pattern"], re.DOTALL), rule["response"]))
+
+    def respond(self, messages: list[dict]) -> str:
+        prompt = "\n".join(str(i.get("content", "")) for i in messages)
+        for pattern, response in self.rules:
+            if pattern.search(prompt):
+                return response
+        if STATE_PROMPT_PATTERN.search(prompt):
+            return "0"
+        format_example = self._format_example(prompt)
+        if format_example:
+            return format_example
+        return self.default_response
+
+    @staticmethod
+    def _format_example(prompt: str) -> str:
+        _, sep, rest = prompt.partition("## Format example")
+        if not sep:
+            return ""
+        content = CONTENT_PATTERN.search(rest)
+        if content:
+            return content.group(0)
+
+        lines = []
+        for line in rest.splitlines()[1:]:
+            if DASH_LINE_PATTERN.match(line):
+                if any(i.strip() for i in lines):
+                    break
+                continue
+            lines.append(line)
+        return "\n".join(lines).strip()
+
+
+class MockLLMServer:
+    """OpenAI chat-completions compatible server with configurable latency, throughput and error injection.
+
+    Args:
+        latency: Distribution of the time to first token, one of fixed/uniform/normal/lognormal/exponential.
+        latency_mean: Mean time to first token in seconds.
+        latency_sigma: Spread of the distribution in seconds (normal), or of its log (lognormal).
+        tokens_per_second: Generation throughput after the first token, 0 means unlimited.
+        error_rate_429/error_rate_500/error_rate_503: Probability of answering with that status.
+        timeout_rate: Probability of stalling for `timeout_seconds` before answering.
+        retry_after: Retry-After header value of 429 responses, in seconds.
+        script: Path to a YAML/JSON list of {pattern, response} rules.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        latency: str = "lognormal",
+        latency_mean: float = 1.0,
+        latency_sigma: float = 0.5,
+        tokens_per_second: float = 50,
+        error_rate_429: float = 0,
+        error_rate_500: float = 0,
+        error_rate_503: float = 0,
+        timeout_rate: float = 0,
+        timeout_seconds: float = 600,
+        retry_after: float = 1,
+        script: str = "",
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rates = {429: error_rate_429, 500: error_rate_500, 503: error_rate_503}
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.retry_after = retry_after
+        self.responder = ScriptedResponder(script)
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "in_flight": 0, "max_in_flight": 0}
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        for prefix in ("", "/v1"):
+            app.router.add_post(f"{prefix}/chat/completions", self.chat_completions)
+            app.router.add_get(f"{prefix}/models", self.models)
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    def sample_latency(self) -> float:
+        mean, sigma = self.latency_mean, self.latency_sigma
+        if self.latency == "fixed":
+            value = mean
+        elif self.latency == "uniform":
+            value = self.random.uniform(max(0, mean - sigma), mean + sigma)
+        elif self.latency == "normal":
+            value = self.random.gauss(mean, sigma)
+        elif self.latency == "lognormal":
+            # parameterized so that the distribution mean is `mean`
+            value = self.random.lognormvariate(_log_mean(mean, sigma), sigma) if mean > 0 else 0
+        elif self.latency == "exponential":
+            value = self.random.expovariate(1 / mean) if mean > 0 else 0
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.latency}")
+        return max(0.0, value)
+
+    def _pick_error(self) -> Optional[int]:
+        for status, rate in self.error_rates.items():
+            if rate and self.random.random() < rate:
+                return status
+        return None
+
+    @staticmethod
+    def _error_response(status: int, headers: Optional[dict] = None) -> web.Response:
+        error_types = {429: "requests", 500: "server_error", 503: "server_error"}
+        body = {"error": {"message": f"Mock error {status}", "type": error_types.get(status), "param": None, "code": None}}
+        return web.json_response(body, status=status, headers=headers)
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            return await self._chat_completions(request)
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        status = self._pick_error()
+        if status:
+            self.stats["errors"] += 1
+            headers = {"Retry-After": str(self.retry_after)} if status == 429 else None
+            return self._error_response(status, headers)
+        if self.timeout_rate and self.random.random() < self.timeout_rate:
+            self.stats["timeouts"] += 1
+            await asyncio.sleep(self.timeout_seconds)
+
+        messages = body.get("messages", [])
+        model = body.get("model") or request.match_info.get("deployment", "mock")
+        content = self.responder.respond(messages)
+        pieces = re.findall(r"\S+\s*|\s+", content)
+        usage = {
+            "prompt_tokens": sum(_approx_tokens(str(i.get("content", ""))) for i in messages),
+            "completion_tokens": len(pieces),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        await asyncio.sleep(self.sample_latency())
+        if body.get("stream"):
+            return await self._stream(request, model, pieces)
+
+        if self.tokens_per_second:
+            await asyncio.sleep(len(pieces) / self.tokens_per_second)
+        return web.json_response(
+            {
+                **_completion_head(model, "chat.completion"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def _stream(self, request: web.Request, model: str, pieces: list[str]) -> web.StreamResponse:
+        rsp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await rsp.prepare(request)
+        head = _completion_head(model, "chat.completion.chunk")
+
+        async def send(delta: dict, finish_reason=None):
+            chunk = {**head, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await rsp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant"})
+        for piece in pieces:
+            await send({"content": piece})
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+        await send({}, "stop")
+        await rsp.write(b"data: [DONE]\n\n")
+        await rsp.write_eof()
+        return rsp
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "metagpt"}]})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> str:
+        """Start serving in the running event loop, return the base url. Port 0 picks a free port."""
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Mock LLM server listening on {self.url}")
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def _log_mean(mean: float, sigma: float) -> float:
+    return math.log(mean) - sigma**2 / 2
+
+
+def _completion_head(model: str, obj: str) -> dict:
+    return {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": obj, "created": int(time.time()), "model": model}
+
+
+def main(**kwargs):
+    """Run the mock server until interrupted. Accepts the arguments of MockLLMServer."""
+    server = MockLLMServer(**kwargs)
+    web.run_app(server.build_app(), host=server.host, port=server.port)
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
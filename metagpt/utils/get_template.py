@@ -7,8 +7,21 @@
 """
 from metagpt.config import CONFIG
 
+JSON_FORMAT_EXAMPLE = "## Format example\n{format_example}\n"
+JSON_OUTPUT_INSTRUCTION = """output a properly formatted JSON, wrapped inside [CONTENT][/CONTENT] like format example,
+and only output the json inside this tag, nothing else"""
+FUNCTION_OUTPUT_INSTRUCTION = "output each section as an argument of the function call, nothing else"
+
 
 def get_template(templates, format=CONFIG.prompt_format):
+    if format == "function":
+        # derived from the json templates: the output schema is sent as the function definition,
+        # so the format example and the output instruction are left out of the prompt
+        prompt_template, _ = get_template(templates, "json")
+        prompt_template = prompt_template.replace(JSON_FORMAT_EXAMPLE, "")
+        prompt_template = prompt_template.replace(JSON_OUTPUT_INSTRUCTION, FUNCTION_OUTPUT_INSTRUCTION)
+        return prompt_template, ""
+
     selected_templates = templates.get(format)
     if selected_templates is None:
         raise ValueError(f"Can't find {format} in passed in templates")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/13 16:40
+@File    : metrics.py
+@Desc    : Per-call LLM metrics (latency, time to first token, tokens, cost) tagged by role, action, model and round,
+           exported in the Prometheus text format
+"""
+import bisect
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterable, Optional
+
+from metagpt.logs import logger
+from metagpt.utils.singleton import Singleton
+
+TAGS = ("role", "action", "model", "round")
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+_tags: ContextVar[dict] = ContextVar("metric_tags", default={})
+
+
+@contextmanager
+def metric_tags(**tags):
+    """Tag the LLM calls made within this block (and the tasks it starts), e.g. metric_tags(role="Engineer")"""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def get_metric_tags() -> dict:
+    return _tags.get()
+
+
+class Histogram:
+    """Cumulative-bucket histogram as in Prometheus"""
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class CallStats:
+    """Metrics of the LLM calls sharing one set of tags"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latency = Histogram()
+        self.ttft = Histogram()
+
+    def merge(self, other: "CallStats"):
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        self.latency.merge(other.latency)
+        self.ttft.merge(other.ttft)
+
+
+class LLMMetrics(metaclass=Singleton):
+    """Collect one CallStats per (role, action, model, round), as tagged by `metric_tags` when the call is made"""
+
+    def __init__(self):
+        self._stats: dict[tuple, CallStats] = defaultdict(CallStats)
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost: float = 0,
+        latency: Optional[float] = None,
+        ttft: Optional[float] = None,
+    ):
+        tags = {"role": "", "action": "", "round": "", **get_metric_tags(), "model": model}
+        stats = self._stats[tuple(str(tags[i]) for i in TAGS)]
+        stats.calls += 1
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        stats.cost += cost
+        if latency is not None:
+            stats.latency.observe(latency)
+        if ttft is not None:
+            stats.ttft.observe(ttft)
+
+    def clear(self):
+        self._stats.clear()
+
+    def summary(self, by: Iterable[str] = ("role", "action")) -> dict[tuple, CallStats]:
+        """CallStats merged over the tags not in `by`"""
+        idx = [TAGS.index(i) for i in by]
+        merged: dict[tuple, CallStats] = defaultdict(CallStats)
+        for key, stats in self._stats.items():
+            merged[tuple(key[i] for i in idx)].merge(stats)
+        return dict(merged)
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        lines = ["LLM usage by role and action:"]
+        for (role, action), i in sorted(summary.items(), key=lambda x: -x[1].cost):
+            mean = i.latency.sum / i.latency.count if i.latency.count else 0
+            lines.append(
+                f"  {role or '-'}/{action or '-'}: {i.calls} calls, {i.prompt_tokens} prompt + "
+                f"{i.completion_tokens} completion tokens, ${i.cost:.3f}, latency mean {mean:.1f}s "
+                f"p95 <= {i.latency.quantile(0.95)}s"
+            )
+        logger.info("\n".join(lines))
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        counters = [
+            ("metagpt_llm_requests_total", "LLM requests", "calls"),
+            ("metagpt_llm_prompt_tokens_total", "Prompt tokens", "prompt_tokens"),
+            ("metagpt_llm_completion_tokens_total", "Completion tokens", "completion_tokens"),
+            ("metagpt_llm_cost_dollars_total", "Cost in US dollars", "cost"),
+        ]
+        histograms = [
+            ("metagpt_llm_latency_seconds", "Latency of LLM requests", "latency"),
+            ("metagpt_llm_time_to_first_token_seconds", "Time to the first token of streamed LLM requests", "ttft"),
+        ]
+        lines = []
+        for name, help_, attr in counters:
+            lines += [f"# HELP {name} {help_}", f"# TYPE {name} counter"]
+            for key, stats in self._stats.items():
+                lines.append(f"{name}{{{_labels(key)}}} {getattr(stats, attr)}")
+        for name, help_, attr in histograms:
+            lines += [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+            for key, stats in self._stats.items():
+                hist: Histogram = getattr(stats, attr)
+                if not hist.count:
+                    continue
+                cumulative = 0
+                for bound, count in zip(hist.buckets + ("+Inf",), hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{_labels(key)},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{_labels(key)}}} {hist.sum}")
+                lines.append(f"{name}_count{{{_labels(key)}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path):
+        """Write the metrics to a file in the Prometheus text format, e.g. for the node exporter textfile collector"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.to_prometheus(), encoding="utf-8")
+        logger.info(f"LLM metrics exported to {path}")
+
+
+def _labels(key: tuple) -> str:
+    return ",".join(f'{tag}="{_escape(value)}"' for tag, value in zip(TAGS, key))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/14 10:30
+@File    : output_repair.py
+@Desc    : Parse structured LLM answers, repairing common format slips locally before anything is re-asked
+"""
+import json
+import re
+from typing import Callable, Iterator, Type
+
+from pydantic import BaseModel, ValidationError
+
+from metagpt.logs import logger
+from metagpt.utils.common import OutputParser
+from metagpt.utils.custom_decoder import CustomDecoder
+
+REPAIR_PROMPT = """Some sections of your previous answer are missing or could not be parsed:
+{errors}
+
+Their content was:
+{sections}
+
+Rewrite ONLY these sections, each with the required type:
+{types}
+
+{instruction}"""
+
+MARKDOWN_INSTRUCTION = """Start each section with its '## <SECTION_NAME>' header, followed by its content in triple quotes \
+as in the original answer. Do not output any other section."""
+
+JSON_INSTRUCTION = """Output a JSON object with only these keys, wrapped inside [CONTENT][/CONTENT]."""
+
+
+class OutputParseError(ValueError):
+    """A structured answer could not be parsed into its model, even after local repairs.
+
+    `content` is the (repaired) answer that came closest, `parsed_data` what could be parsed from it and
+    `bad_fields` the sections to have rewritten.
+    """
+
+    def __init__(self, message: str, parsed_data: dict, bad_fields: list[str], content: str = ""):
+        super().__init__(message)
+        self.parsed_data = parsed_data
+        self.bad_fields = bad_fields
+        self.content = content
+
+
+def _extract_json(content: str) -> str:
+    pattern = r"\[CONTENT\](\s*\{.*?\}\s*)\[/CONTENT\]"
+    matches = re.findall(pattern, content, re.DOTALL)
+
+    for match in matches:
+        if match:
+            return match
+    return content
+
+
+def parse_output(content: str, mapping: dict, format: str = "markdown") -> dict:
+    if format == "json":
+        return CustomDecoder(strict=False).decode(_extract_json(content))
+    # using markdown parser
+    return OutputParser.parse_data_with_mapping(content, mapping)
+
+
+def _normalize_headers(content: str, mapping: dict) -> str:
+    """Turn section names written as '# Name', '### Name:', '**Name**' or a bare 'Name' line into '## Name'"""
+    names = "|".join(re.escape(i) for i in sorted(mapping, key=len, reverse=True))
+    header = re.compile(rf"^[ \t]*(?:#+[ \t]*)?(?:\*\*)?[ \t]*({names})[ \t]*:?[ \t]*(?:\*\*)?[ \t]*:?[ \t]*$", re.M)
+    content = header.sub(r"## \1", content)
+    return content if content.endswith("\n") else content + "\n"  # a trailing header needs its line break
+
+
+def _close_fences(content: str, mapping: dict) -> str:
+    """Close the code fence left open at the end of a section"""
+    blocks = re.split(r"(?m)^(?=##[^#])", content)
+    return "".join(i.rstrip() + "\n```\n\n" if i.count("```") % 2 else i for i in blocks)
+
+
+def _close_content_tag(content: str, mapping: dict) -> str:
+    if "[CONTENT]" in content and "[/CONTENT]" not in content:
+        return content.rstrip() + "\n[/CONTENT]"
+    return content
+
+
+def _extract_object(content: str, mapping: dict) -> str:
+    """Keep only the outermost {...}, dropping tags, code fences and chatter around it"""
+    content = content.split("[/CONTENT]")[0]
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1:
+        return content
+    return content[start:] if end < start else content[start : end + 1]
+
+
+def _remove_trailing_commas(content: str, mapping: dict) -> str:
+    return re.sub(r",(\s*[}\]])", r"\1", content)
+
+
+def _balance_brackets(content: str, mapping: dict) -> str:
+    """Close the brackets and the string left open by a truncated answer"""
+    stack, quote, escaped = [], None, False
+    for char in content:
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    return content.rstrip() + (quote or "") + "".join(reversed(stack))
+
+
+# applied cumulatively, from the most conservative fix to the most lenient
+MARKDOWN_FIXES: list[Callable[[str, dict], str]] = [_normalize_headers, _close_fences]
+JSON_FIXES: list[Callable[[str, dict], str]] = [
+    _close_content_tag,
+    _extract_object,
+    _remove_trailing_commas,
+    _balance_brackets,
+]
+
+
+def _candidates(content: str, mapping: dict, format: str) -> Iterator[str]:
+    yield content
+    for fix in JSON_FIXES if format == "json" else MARKDOWN_FIXES:
+        fixed = fix(content, mapping)
+        if fixed != content:
+            content = fixed
+            yield content
+
+
+def _validate(output_class: Type[BaseModel], data: dict, mapping: dict) -> BaseModel:
+    try:
+        return output_class(**data)
+    except ValidationError as e:
+        bad_fields = [i for i in mapping if i not in data]
+        bad_fields += [i["loc"][0] for i in e.errors() if i["loc"][0] in mapping and i["loc"][0] not in bad_fields]
+        raise OutputParseError(str(e), data, bad_fields) from e
+
+
+def repair_and_parse(
+    content: str, output_class: Type[BaseModel], mapping: dict, format: str = "markdown"
+) -> tuple[str, BaseModel]:
+    """Parse `content` into `output_class`, retrying with progressively lenient local repairs.
+
+    Returns the content that parsed and the model. Raises OutputParseError carrying the best partial parse.
+    """
+    best = None
+    for idx, candidate in enumerate(_candidates(content, mapping, format)):
+        try:
+            data = parse_output(candidate, mapping, format)
+            instruct_content = _validate(output_class, data, mapping)
+        except OutputParseError as e:
+            error = e
+        except Exception as e:
+            error = OutputParseError(f"{type(e).__name__}: {e}", {}, list(mapping))
+        else:
+            if idx:
+                logger.info(f"{output_class.__name__} answer repaired locally")
+            return (_extract_json(candidate) if format == "json" else candidate), instruct_content
+        error.content = candidate
+        if best is None or len(error.bad_fields) < len(best.bad_fields):
+            best = error
+    raise best
+
+
+def parse_sections(content: str, mapping: dict, format: str = "markdown") -> dict:
+    """Parse the sections in `content`, with local repairs, without requiring all of them"""
+    data = {}
+    for candidate in _candidates(content, mapping, format):
+        try:
+            data = parse_output(candidate, mapping, format)
+        except Exception:
+            continue
+        if all(i in data for i in mapping):
+            break
+    return {k: v for k, v in data.items() if k in mapping}
+
+
+def build_repair_prompt(error: OutputParseError, mapping: dict, format: str = "markdown") -> str:
+    """A small prompt asking to rewrite the bad sections only, instead of re-sending the whole task"""
+    if format == "json":
+        if error.parsed_data:
+            bad_data = {i: error.parsed_data.get(i) for i in error.bad_fields}
+            sections_text = json.dumps(bad_data, ensure_ascii=False, indent=4, default=str)
+        else:
+            # nothing could be decoded, the whole answer, still short compared to the prompt, must be fixed
+            sections_text = error.content
+    else:
+        try:
+            sections = OutputParser.parse_blocks(error.content)
+        except Exception:
+            sections = {}
+        sections_text = "\n".join(f"## {i}\n{sections.get(i, '(missing)')}" for i in error.bad_fields)
+    types = "\n".join(f"- {i}: {_type_name(mapping[i])}" for i in error.bad_fields)
+    return REPAIR_PROMPT.format(
+        errors=error,
+        sections=sections_text,
+        types=types,
+        instruction=JSON_INSTRUCTION if format == "json" else MARKDOWN_INSTRUCTION,
+    )
+
+
+def _type_name(typing_define) -> str:
+    typing = typing_define[0] if isinstance(typing_define, tuple) else typing_define
+    return getattr(typing, "__name__", None) or str(typing).replace("typing.", "")
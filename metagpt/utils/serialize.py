@@ -2,13 +2,31 @@
 # -*- coding: utf-8 -*-
 # @Desc   : the implement of serialization and deserialization
 
-import copy
+import hashlib
+import importlib
+import json
 import pickle
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel
 
 from metagpt.actions.action_output import ActionOutput
 from metagpt.schema import Message
 
+MESSAGE_FORMAT_VERSION = 3
+MESSAGE_MAGIC = b"MGM%d" % MESSAGE_FORMAT_VERSION
+MESSAGE_MAGIC_V2 = b"MGM2"  # without the creation time
+
+# the field types of instruct contents, by the name stored in schemas
+FIELD_TYPES = {
+    "str": (str, ...),
+    "List[str]": (List[str], ...),
+    "List[Tuple[str, str]]": (List[Tuple[str, str]], ...),
+}
+FIELD_TYPE_NAMES = {v: k for k, v in FIELD_TYPES.items()}
+
 
 def actionoutout_schema_to_mapping(schema: Dict) -> Dict:
     """
@@ -42,26 +60,125 @@ def actionoutout_schema_to_mapping(schema: Dict) -> Dict:
     return mapping
 
 
-def serialize_message(message: Message):
-    message_cp = copy.deepcopy(message)  # avoid `instruct_content` value update by reference
-    ic = message_cp.instruct_content
-    if ic:
-        # model create by pydantic create_model like `pydantic.main.prd`, can't pickle.dump directly
-        schema = ic.schema()
-        mapping = actionoutout_schema_to_mapping(schema)
+@lru_cache(maxsize=None)
+def _import_action(path: str):
+    module, _, qualname = path.partition(":")
+    obj = importlib.import_module(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _action_path(cause_by) -> str:
+    if isinstance(cause_by, type):
+        if "<locals>" in cause_by.__qualname__:
+            raise ValueError(f"cause_by {cause_by.__qualname__} is defined in a function and cannot be imported back")
+        return f"{cause_by.__module__}:{cause_by.__qualname__}"
+    return cause_by or ""
+
+
+class MessageCodec:
+    """Encode messages as `MESSAGE_MAGIC` followed by a JSON array of their fields.
+
+    The instruct content is stored as its values and a reference to its schema (class name and field types), the
+    schemas being kept once in `schemas`, to be saved along the encoded messages and `register`ed before decoding
+    them. The `seq` of a message orders the messages of one process only and is not stored, `created_at` is.
+    """
+
+    def __init__(self):
+        self.schemas: dict[str, dict] = {}  # schema ref -> {"class": ..., "fields": {name: type name}}
+        self._refs: WeakKeyDictionary = WeakKeyDictionary()  # model class -> schema ref
+
+    def _add_schema(self, class_name: str, mapping: dict) -> str:
+        for field, type_ in mapping.items():
+            if type_ not in FIELD_TYPE_NAMES:
+                raise ValueError(f"Field {field!r} of {class_name} is a {type_[0]}, not one of {list(FIELD_TYPES)}")
+        schema = {"class": class_name, "fields": {k: FIELD_TYPE_NAMES[v] for k, v in mapping.items()}}
+        ref = hashlib.sha1(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.schemas.setdefault(ref, schema)
+        return ref
 
-        message_cp.instruct_content = {"class": schema["title"], "mapping": mapping, "value": ic.dict()}
-    msg_ser = pickle.dumps(message_cp)
+    def schema_ref(self, model_class: Type[BaseModel]) -> str:
+        ref = self._refs.get(model_class)
+        if ref is None:
+            schema = model_class.schema()
+            mapping = actionoutout_schema_to_mapping(schema)
+            unsupported = sorted(schema["properties"].keys() - mapping.keys())
+            if unsupported:
+                raise ValueError(f"Fields {unsupported} of {schema['title']} have types the codec cannot encode")
+            ref = self._add_schema(schema["title"], mapping)
+            self._refs[model_class] = ref
+        return ref
 
-    return msg_ser
+    def register(self, schemas: dict[str, dict]):
+        for ref, schema in schemas.items():
+            self.schemas.setdefault(ref, schema)
 
+    def model_class(self, ref: str) -> Type[BaseModel]:
+        schema = self.schemas[ref]
+        mapping = {k: FIELD_TYPES[v] for k, v in schema["fields"].items()}
+        model_class = ActionOutput.create_model_class(class_name=schema["class"], mapping=mapping)  # memoized
+        self._refs[model_class] = ref
+        return model_class
 
-def deserialize_message(message_ser: str) -> Message:
-    message = pickle.loads(message_ser)
-    if message.instruct_content:
+    def encode(self, message: Message) -> bytes:
         ic = message.instruct_content
-        ic_obj = ActionOutput.create_model_class(class_name=ic["class"], mapping=ic["mapping"])
-        ic_new = ic_obj(**ic["value"])
-        message.instruct_content = ic_new
+        record = [
+            message.content,
+            message.role,
+            _action_path(message.cause_by),
+            message.sent_from,
+            message.send_to,
+            message.id,
+            message.created_at,
+        ]
+        if ic:
+            record += [self.schema_ref(type(ic)), ic.dict()]
+        return MESSAGE_MAGIC + json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> Message:
+        record = json.loads(data[len(MESSAGE_MAGIC):])
+        if data.startswith(MESSAGE_MAGIC_V2):
+            record.insert(6, 0.0)
+        content, role, cause_by, sent_from, send_to, id_, created_at, *ic = record
+        instruct_content = self.model_class(ic[0])(**ic[1]) if ic else None
+        return Message(
+            content=content,
+            instruct_content=instruct_content,
+            role=role,
+            cause_by=_import_action(cause_by) if ":" in cause_by else cause_by,
+            sent_from=sent_from,
+            send_to=send_to,
+            id=id_,
+            created_at=created_at,
+        )
+
+    def decode_legacy(self, data: bytes) -> Message:
+        """Decode a message pickled by the first format, its instruct content as a class name, mapping and values"""
+        message = pickle.loads(data)
+        if message.instruct_content:
+            ic = message.instruct_content
+            message.instruct_content = self.model_class(self._add_schema(ic["class"], ic["mapping"]))(**ic["value"])
+        if not getattr(message, "id", None):  # pickled before messages had ids
+            message.id = message.content_hash()
+        return message
+
+    def schemas_of(self, message: Message) -> Optional[dict[str, dict]]:
+        """The schema an encoded message refers to, to be saved with it"""
+        if not message.instruct_content:
+            return None
+        ref = self.schema_ref(type(message.instruct_content))
+        return {ref: self.schemas[ref]}
+
+
+MESSAGE_CODEC = MessageCodec()
+
+
+def serialize_message(message: Message) -> bytes:
+    return MESSAGE_CODEC.encode(message)
+
 
-    return message
+def deserialize_message(message_ser: bytes) -> Message:
+    if message_ser.startswith((MESSAGE_MAGIC, MESSAGE_MAGIC_V2)):
+        return MESSAGE_CODEC.decode(message_ser)
+    return MESSAGE_CODEC.decode_legacy(message_ser)
@@ -8,8 +8,12 @@ ref1: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_
 ref2: https://github.com/Significant-Gravitas/Auto-GPT/blob/master/autogpt/llm/token_counter.py
 ref3: https://github.com/hwchase17/langchain/blob/master/langchain/chat_models/openai.py
 """
+from functools import lru_cache
+
 import tiktoken
 
+from metagpt.logs import logger
+
 TOKEN_COSTS = {
     "gpt-3.5-turbo": {"prompt": 0.0015, "completion": 0.002},
     "gpt-3.5-turbo-0301": {"prompt": 0.0015, "completion": 0.002},
@@ -22,6 +26,8 @@ TOKEN_COSTS = {
     "gpt-4-32k-0314": {"prompt": 0.06, "completion": 0.12},
     "gpt-4-0613": {"prompt": 0.06, "completion": 0.12},
     "text-embedding-ada-002": {"prompt": 0.0004, "completion": 0.0},
+    "claude-instant-1": {"prompt": 0.00163, "completion": 0.00551},
+    "claude-2": {"prompt": 0.01102, "completion": 0.03268},
 }
 
 
@@ -37,16 +43,24 @@ TOKEN_MAX = {
     "gpt-4-32k-0314": 32768,
     "gpt-4-0613": 8192,
     "text-embedding-ada-002": 8192,
+    "claude-instant-1": 100000,
+    "claude-2": 100000,
 }
 
 
-def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
-    """Return the number of tokens used by a list of messages."""
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Return the (cached) encoding of a model, fall back to cl100k_base for unknown models."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        logger.warning(f"model {model} not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def _get_message_token_params(model: str) -> tuple[str, int, int]:
+    """Resolve a model to (model counted as, tokens_per_message, tokens_per_name), warn once per alias."""
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -55,26 +69,46 @@ def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
         "gpt-4-0613",
         "gpt-4-32k-0613",
     }:
-        tokens_per_message = 3
-        tokens_per_name = 1
+        return model, 3, 1
     elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        # if there's a name, the role is omitted
+        return model, 4, -1
     elif "gpt-3.5-turbo" in model:
-        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return count_message_tokens(messages, model="gpt-3.5-turbo-0613")
+        logger.warning("gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
+        return _get_message_token_params("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
-        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return count_message_tokens(messages, model="gpt-4-0613")
+        logger.warning("gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
+        return _get_message_token_params("gpt-4-0613")
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+
+
+TOKEN_COUNT_CACHE_MAX_CHARS = 2048  # longer strings, e.g. whole prompts and code files, are not kept alive by the cache
+
+
+@lru_cache(maxsize=4096)
+def _count_short_tokens(string: str, model: str) -> int:
+    return len(get_encoding(model).encode(string))
+
+
+def _count_tokens(string: str, model: str) -> int:
+    """Token count, memoized for short strings: repeated ones like system prompts and templates are encoded once."""
+    if len(string) <= TOKEN_COUNT_CACHE_MAX_CHARS:
+        return _count_short_tokens(string, model)
+    return len(get_encoding(model).encode(string))
+
+
+def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
+    """Return the number of tokens used by a list of messages."""
+    model, tokens_per_message, tokens_per_name = _get_message_token_params(model)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += _count_tokens(value, model)
             if key == "name":
                 num_tokens += tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
@@ -92,8 +126,22 @@ def count_string_tokens(string: str, model_name: str) -> int:
     Returns:
         int: The number of tokens in the text string.
     """
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(string))
+    return _count_tokens(string, model_name)
+
+
+def count_many(strings: list[str], model_name: str) -> list[int]:
+    """
+    Returns the number of tokens of each text string, encoding them in one batch.
+
+    Args:
+        strings (list[str]): The text strings.
+        model_name (str): The name of the encoding to use. (e.g., "gpt-3.5-turbo")
+
+    Returns:
+        list[int]: The number of tokens of each text string.
+    """
+    encoded = get_encoding(model_name).encode_batch(strings)
+    return [len(i) for i in encoded]
 
 
 def get_max_completion_tokens(messages: list[dict], model: str, default: int) -> int:
@@ -108,4 +156,9 @@ def get_max_completion_tokens(messages: list[dict], model: str, default: int) ->
     """
     if model not in TOKEN_MAX:
         return default
-    return TOKEN_MAX[model] - count_message_tokens(messages) - 1
+    try:
+        prompt_tokens = count_message_tokens(messages, model)
+    except NotImplementedError:
+        # e.g. claude models: no message format rule, counted as the default model
+        prompt_tokens = count_message_tokens(messages)
+    return TOKEN_MAX[model] - prompt_tokens - 1
@@ -12,6 +12,7 @@ import pytest
 
 from metagpt.logs import logger
 from metagpt.provider.openai_api import OpenAIGPTAPI as GPTAPI
+from metagpt.provider.resilience import CircuitBreakerManager
 import asyncio
 import re
 
@@ -36,6 +37,13 @@ def llm_api():
     logger.info("Tearing down the test")
 
 
+@pytest.fixture(autouse=True)
+def circuit_breakers():
+    # failed requests of one test must not open the circuit for the next ones
+    yield
+    CircuitBreakerManager().clear()
+
+
 @pytest.fixture(scope="function")
 def mock_llm():
     # Create a mock LLM for testing
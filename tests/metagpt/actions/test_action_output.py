@@ -5,8 +5,11 @@
 @Author  : chengmaoyu
 @File    : test_action_output
 """
+from collections import OrderedDict
 from typing import List, Tuple
 
+import pytest
+
 from metagpt.actions import ActionOutput
 
 t_dict = {"Required Python third-party packages": "\"\"\"\nflask==1.1.2\npygame==2.0.1\n\"\"\"\n",
@@ -45,6 +48,29 @@ def test_create_model_class_with_mapping():
     assert value == ["game.py", "app.py", "static/css/styles.css", "static/js/script.js", "templates/index.html"]
 
 
+def test_create_model_class_cached():
+    t = ActionOutput.create_model_class("test_class_2", WRITE_TASKS_OUTPUT_MAPPING)
+    assert ActionOutput.create_model_class("test_class_2", dict(WRITE_TASKS_OUTPUT_MAPPING)) is t
+    assert ActionOutput.create_model_class("test_class_3", WRITE_TASKS_OUTPUT_MAPPING) is not t
+    mapping = {**WRITE_TASKS_OUTPUT_MAPPING, "Task list": (List[Tuple[str, str]], ...)}
+    assert ActionOutput.create_model_class("test_class_2", mapping) is not t
+
+
+@pytest.fixture
+def model_classes(mocker):
+    # an empty cache for the test, the shared one restored after it
+    mocker.patch.object(ActionOutput, "_model_classes", OrderedDict())
+
+
+def test_create_model_class_cache_bounded(mocker, model_classes):
+    mocker.patch.object(ActionOutput, "MODEL_CLASS_CACHE_SIZE", 2)
+    first = ActionOutput.create_model_class("bounded_1", {"a": (str, ...)})
+    ActionOutput.create_model_class("bounded_2", {"a": (str, ...)})
+    ActionOutput.create_model_class("bounded_3", {"a": (str, ...)})
+    assert len(ActionOutput._model_classes) == 2
+    assert ActionOutput.create_model_class("bounded_1", {"a": (str, ...)}) is not first
+
+
 if __name__ == '__main__':
     test_create_model_class()
     test_create_model_class_with_mapping()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/22 10:20
+@File    : test_research.py
+"""
+from metagpt.actions import research
+from metagpt.config import CONFIG
+from metagpt.llm import get_llm
+
+
+async def browse(*urls):
+    return []
+
+
+def test_explicit_llm_kept(mocker):
+    mocker.patch.object(CONFIG, "model_for_researcher_summary", "gpt-3.5-turbo-16k")
+    mocker.patch.object(CONFIG, "model_for_researcher_report", "gpt-4")
+    llm = mocker.Mock()
+    assert research.WebBrowseAndSummarize(llm=llm, browse_func=browse).llm is llm
+    assert research.ConductResearch(llm=llm).llm is llm
+
+    assert research.WebBrowseAndSummarize(browse_func=browse).llm is get_llm("gpt-3.5-turbo-16k", temperature=0)
+    assert research.ConductResearch().llm is get_llm("gpt-4", auto_max_tokens=True)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/21 14:30
+@File    : test_embedding_cache.py
+"""
+import threading
+import time
+from typing import List
+
+import pytest
+from langchain.embeddings import FakeEmbeddings
+
+from metagpt.document_store.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    batches: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(texts)
+        return super().embed_documents(texts)
+
+
+def test_embeddings_cached(tmp_path):
+    inner = CountingEmbeddings(size=8, batches=[])
+    embeddings = CachedEmbeddings(inner, path=tmp_path / "cache.db", window=0)
+    vectors = embeddings.embed_documents(["snake", "2048", "snake"])
+    assert vectors[0] == vectors[2]
+    assert inner.batches == [["snake", "2048"]]
+    assert embeddings.embed_query("2048") == vectors[1]
+    assert len(inner.batches) == 1
+
+    # a new process finds them on disk
+    reloaded = CachedEmbeddings(inner, path=tmp_path / "cache.db", window=0)
+    assert reloaded.embed_documents(["2048", "tetris"])[0] == vectors[1]
+    assert inner.batches[1:] == [["tetris"]]
+    assert reloaded.get_stats() == {"hits": 1, "misses": 1, "calls": 1}
+
+
+def test_concurrent_misses_batched(tmp_path):
+    inner = CountingEmbeddings(size=8, batches=[])
+    embeddings = CachedEmbeddings(inner, path=tmp_path / "cache.db", window=0.2)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda i=i: results.setdefault(i, embeddings.embed_query(f"idea {i}")))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    assert len(inner.batches) == 1
+    assert sorted(inner.batches[0]) == [f"idea {i}" for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_no_window_in_event_loop(tmp_path):
+    inner = CountingEmbeddings(size=8, batches=[])
+    embeddings = CachedEmbeddings(inner, path=tmp_path / "cache.db", window=10)
+    start = time.time()
+    embeddings.embed_query("snake")  # nobody could join while the loop is blocked
+    assert time.time() - start < 1
+    assert inner.batches == [["snake"]]
+
+
+def test_shared_per_path(tmp_path):
+    inner = CountingEmbeddings(size=8, batches=[])
+    embeddings = CachedEmbeddings.shared(inner, path=tmp_path / "cache.db")
+    assert CachedEmbeddings.shared(CountingEmbeddings(size=8, batches=[]), path=tmp_path / "cache.db") is embeddings
+    assert CachedEmbeddings.shared(inner, path=tmp_path / "other.db") is not embeddings
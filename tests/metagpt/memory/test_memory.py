@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Desc   : unittest of `metagpt/memory/memory.py`
+
+from metagpt.actions import BossRequirement, WritePRD
+from metagpt.memory import Memory
+from metagpt.schema import Message
+
+
+def test_memory_dedup_and_delete():
+    memory = Memory()
+    req = Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)
+    prd = Message("PRD", role="Product Manager", cause_by=WritePRD)
+    memory.add_batch([req, prd, Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)])
+    assert memory.count() == 2
+    assert req in memory
+    assert memory.get() == [req, prd]
+    assert memory.get(1) == [prd]
+    assert memory.get(5) == [req, prd]
+    assert memory.get_by_actions([BossRequirement, WritePRD]) == (req, prd)
+
+    memory.delete(req)
+    assert req not in memory
+    assert memory.get_by_action(BossRequirement) == []
+    assert memory.remember([req, prd]) == [req]
+
+
+def test_memory_scales():
+    memory = Memory()
+    messages = [Message(f"message {i}", role="Engineer") for i in range(20000)]
+    memory.add_batch(messages)
+    memory.add_batch(messages)
+    assert memory.count() == 20000
+    assert memory.remember(messages[-3:] + [Message("new")]) == [Message("new")]
+
+
+def test_get_by_actions_is_maintained():
+    memory = Memory()
+    prd = Message("PRD", role="Product Manager", cause_by=WritePRD)
+    req = Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)
+    memory.add(prd)
+    view = memory.get_by_actions([BossRequirement, WritePRD])
+    assert view == (prd,)
+
+    memory.add(req)
+    memory.add(Message("Other", role="QA"))
+    assert view == (prd,)  # immutable, not changed by later adds
+    assert memory.get_by_actions({WritePRD, BossRequirement}) == (prd, req)  # in the order they were added
+    assert memory.get_by_actions([WritePRD, BossRequirement]) is memory.get_by_actions([WritePRD, BossRequirement])
+
+    memory.delete(prd)
+    assert memory.get_by_actions([BossRequirement, WritePRD]) == (req,)
@@ -2,8 +2,15 @@
 # -*- coding: utf-8 -*-
 # @Desc   : the unittests of metagpt/memory/memory_storage.py
 
+import gc
+import weakref
 from typing import List
 
+import pytest
+from langchain.embeddings import FakeEmbeddings
+
+from metagpt.config import CONFIG
+from metagpt.document_store.faiss_store import FaissStore
 from metagpt.memory.memory_storage import MemoryStorage
 from metagpt.schema import Message
 from metagpt.actions import BossRequirement
@@ -80,3 +87,82 @@ def test_actionout_message():
 
     memory_storage.clean()
     assert memory_storage.is_initialized is False
+
+
+@pytest.fixture
+def fake_embeddings(mocker, tmp_path):
+    # random, but made stable by the embedding cache
+    mocker.patch.object(FaissStore, "_embedding", return_value=FakeEmbeddings(size=8))
+    mocker.patch.object(CONFIG, "embedding_cache_path", str(tmp_path / "embedding_cache.db"))
+
+
+def _storage(**kwargs) -> MemoryStorage:
+    return MemoryStorage(wal_interval=60, **kwargs)
+
+
+def test_wal_replayed_after_crash(fake_embeddings):
+    role_id = 'UTUser3(Product Manager)'
+    memory_storage = _storage(wal_batch=2, compact_every=100)
+    memory_storage.recover_memory(role_id)
+    memory_storage.clean()
+    for idx in range(3):
+        memory_storage.add(Message(role='BOSS', content=f'idea {idx}', cause_by=BossRequirement))
+    memory_storage.flush()
+    wal_fpath = memory_storage._get_wal_fname()
+    with open(wal_fpath, "a") as f:
+        f.write('{"seq": 3, "id": "torn')  # crashed while writing
+
+    # no snapshot was written, the memories come back from the log only
+    recovered = _storage()
+    messages = recovered.recover_memory(role_id)
+    assert [i.content for i in messages] == ['idea 0', 'idea 1', 'idea 2']
+    assert recovered.is_initialized is True
+    assert recovered.store.index.ntotal == 3
+
+    memory_storage.clean()
+
+
+def test_compaction_truncates_wal(fake_embeddings):
+    role_id = 'UTUser4(Product Manager)'
+    memory_storage = _storage(wal_batch=1, compact_every=2)
+    memory_storage.recover_memory(role_id)
+    memory_storage.clean()
+    for idx in range(3):
+        memory_storage.add(Message(role='BOSS', content=f'idea {idx}', cause_by=BossRequirement))
+    memory_storage._wait_compaction()
+    memory_storage.flush()
+    assert len(memory_storage._get_wal_fname().read_text().splitlines()) < 3
+
+    memory_storage.persist()
+    assert memory_storage._get_wal_fname().read_text() == ""
+    messages = _storage().recover_memory(role_id)
+    assert [i.content for i in messages] == ['idea 0', 'idea 1', 'idea 2']
+
+    memory_storage.clean()
+
+
+def test_search_many(fake_embeddings):
+    role_id = 'UTUser5(Product Manager)'
+    memory_storage = _storage()
+    memory_storage.recover_memory(role_id)
+    memory_storage.clean()
+    message = Message(role='BOSS', content='Write a cli snake game', cause_by=BossRequirement)
+    memory_storage.add(message)
+
+    queries = [Message(role='BOSS', content=message.content, cause_by=BossRequirement),  # same embedding
+               Message(role='BOSS', content='Write a 2048 web game', cause_by=BossRequirement)]
+    found = memory_storage.search_many(queries)
+    assert found[0] == []
+    assert [i.content for i in found[1]] == [message.content]
+    assert memory_storage.search(queries[1])[0].content == message.content
+    assert memory_storage.search_many([]) == []
+
+    memory_storage.clean()
+
+
+def test_storage_not_kept_alive(fake_embeddings):
+    memory_storage = _storage()
+    ref = weakref.ref(memory_storage)
+    del memory_storage
+    gc.collect()
+    assert ref() is None  # only weakly registered to be flushed at exit
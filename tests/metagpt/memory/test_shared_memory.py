@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Desc   : unittest of `metagpt/memory/shared_memory.py`
+
+from metagpt.actions import BossRequirement, WriteCode, WritePRD
+from metagpt.memory import MemoryView, MessageLog
+from metagpt.schema import Message
+
+
+def test_message_log():
+    log = MessageLog()
+    req = Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)
+    prd = Message("PRD", role="Product Manager", cause_by=WritePRD)
+    assert log.append(req) == 0
+    assert log.append(prd) == 1
+    assert log.append(req) == 0
+    assert len(log) == 2 and req in log
+    assert log.get_by_action(WritePRD) == [prd]
+    assert log.get_by_action(WritePRD, end=1) == []
+
+
+def test_memory_view_follows_the_log():
+    log = MessageLog()
+    req = Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)
+    prd = Message("PRD", role="Product Manager", cause_by=WritePRD)
+    code = Message("code", role="Engineer", cause_by=WriteCode)
+    view = MemoryView(log)
+
+    view.add(prd)  # its own message, before it is published
+    log.append(req)
+    log.append(prd)
+    assert view.storage and view.end == 0
+
+    view.add(req)  # observed in order, its own message is absorbed too
+    assert view.end == 2 and not view.storage
+    assert view.get() == [req, prd]
+    assert view.get_by_actions([BossRequirement, WritePRD]) == (req, prd)
+
+    view.add(code)  # not published, held on its own
+    assert view.count() == 3 and code in view
+    assert view.get(1) == [code]
+    assert view.remember([req, code, Message("new")]) == [Message("new")]
+
+    view.delete(req)
+    assert req not in view and view.count() == 2
+    assert view.get_by_action(BossRequirement) == []
+    view.add(req)
+    assert req in view
+
+    view.clear()
+    assert view.count() == 0 and prd not in view
+
+
+def test_memory_view_get_by_actions_is_maintained():
+    log = MessageLog()
+    req = Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement)
+    prd = Message("PRD", role="Product Manager", cause_by=WritePRD)
+    view = MemoryView(log)
+    assert view.get_by_actions([BossRequirement, WritePRD]) == ()
+
+    view.add(prd)
+    log.append(req)
+    log.append(prd)
+    view.add(req)
+    assert view.get_by_actions([WritePRD, BossRequirement]) == (prd, req)
+
+    view.delete(req)
+    assert view.get_by_actions([BossRequirement, WritePRD]) == (prd,)
+    view.add(req)
+    assert view.get_by_actions([BossRequirement, WritePRD]) == (prd, req)
+
+
+def test_memory_view_keeps_insertion_order():
+    log = MessageLog()
+    m1, m2, m3 = (Message(f"prd {i}", role="Product Manager", cause_by=WritePRD) for i in range(3))
+    own = Message("code", role="Engineer", cause_by=WriteCode)  # never published
+    view = MemoryView(log)
+    log.append(m1)
+    view.add(m1)
+    important = view.get_by_actions([WritePRD, WriteCode])
+    view.add(own)
+    log.append(m2)
+    view.add(m2)
+
+    assert view.get() == [m1, own, m2]
+    assert view.get(1) == [m2]
+    assert view.remember([m2, Message("new")], k=1) == [Message("new")]
+    assert view.get_by_actions([WritePRD, WriteCode]) == (m1, own, m2)
+    assert important == (m1,)
+    view._views, view._view_tuples = {}, {}  # built after the adds, the same order
+    assert view.get_by_actions([WritePRD, WriteCode]) == (m1, own, m2)
+
+    log.append(m3)
+    view.add(m3)
+    assert MemoryView(log, end=0).get() == []
+    assert view.get_by_action(WritePRD) == [m1, m2, m3]
+    assert view.get() == [m1, own, m2, m3]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/12 11:20
+@File    : test_anthropic_api.py
+"""
+import asyncio
+import time
+
+import pytest
+from anthropic.types import Completion
+
+from metagpt.provider.anthropic_api import Claude2
+
+
+@pytest.fixture
+def llm(mocker):
+    async def chunks():
+        for content in [" Hello", ", ", "world"]:
+            yield Completion.construct(completion=content, model="claude-2", stop_reason=None)
+
+    async def create(**kwargs):
+        if kwargs.get("stream"):
+            return chunks()
+        await asyncio.sleep(0.1)
+        return Completion(completion=" Hello, world", model=kwargs["model"], stop_reason="stop_sequence")
+
+    mocker.patch("anthropic.resources.completions.AsyncCompletions.create", side_effect=create)
+    llm = Claude2()
+    llm.rpm = 0
+    llm.stream_sinks = []
+    return llm
+
+
+def test_messages_to_prompt(llm):
+    messages = [llm._system_msg("Be brief."), llm._user_msg("hi"), llm._assistant_msg("hello"), llm._user_msg("bye")]
+    assert llm.messages_to_prompt(messages) == "Be brief.\n\nHuman: hi\n\nAssistant: hello\n\nHuman: bye\n\nAssistant:"
+
+
+@pytest.mark.asyncio
+async def test_acompletion(llm, mocker):
+    update_cost = mocker.patch.object(llm._cost_manager, "update_cost", return_value=0.0)
+    rsp = await llm.acompletion([llm._user_msg("hi")])
+    assert llm.get_choice_text(rsp) == " Hello, world"
+    assert rsp["usage"]["completion_tokens"] > 0
+    update_cost.assert_called_once_with(rsp["usage"]["prompt_tokens"], rsp["usage"]["completion_tokens"], "claude-2")
+
+
+@pytest.mark.asyncio
+async def test_aask_does_not_block_the_loop(llm):
+    start = time.monotonic()
+    rsps = await asyncio.gather(*[llm.acompletion_text([llm._user_msg(str(i))]) for i in range(5)])
+    assert rsps == [" Hello, world"] * 5
+    assert time.monotonic() - start < 0.3
+
+
+@pytest.mark.asyncio
+async def test_aask_stream(llm):
+    assert [delta async for delta in llm.aask_stream("hi")] == [" Hello", ", ", "world"]
+    assert await llm.aask("hi") == " Hello, world"
+
+
+@pytest.mark.asyncio
+async def test_acompletion_batch(llm):
+    rsps = await llm.acompletion_batch_text([[llm._user_msg(str(i))] for i in range(3)])
+    assert rsps == [" Hello, world"] * 3
+
+
+@pytest.mark.asyncio
+async def test_client_is_shared(llm):
+    assert Claude2().aclient is llm.aclient
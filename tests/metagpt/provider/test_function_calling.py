@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/15 11:20
+@File    : test_function_calling.py
+"""
+import json
+from typing import List
+
+import pytest
+
+from metagpt.actions import Action, ActionOutput
+from metagpt.actions.write_prd import templates
+from metagpt.provider.anthropic_api import Claude2
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.utils.get_template import get_template
+
+MAPPING = {"Product Goals": (List[str], ...), "Anything UNCLEAR": (str, ...)}
+ARGUMENTS = {"Product Goals": ["Fun"], "Anything UNCLEAR": "Nothing"}
+
+
+@pytest.fixture
+def llm(mocker):
+    async def acreate(**kwargs):
+        assert kwargs["function_call"] == {"name": kwargs["functions"][0]["name"]}
+        function_call = {"name": kwargs["functions"][0]["name"], "arguments": json.dumps(ARGUMENTS)}
+        return {"choices": [{"message": {"role": "assistant", "content": None, "function_call": function_call}}]}
+
+    acreate = mocker.patch("openai.ChatCompletion.acreate", side_effect=acreate)
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+    llm.acreate = acreate
+    return llm
+
+
+def test_create_function():
+    function = ActionOutput.create_function("prd", MAPPING)
+    assert function["name"] == "prd"
+    assert function["parameters"]["required"] == ["Product Goals", "Anything UNCLEAR"]
+    assert function["parameters"]["properties"]["Product Goals"] == {"type": "array", "items": {"type": "string"}}
+
+
+def test_function_template_has_no_format_example():
+    prompt, format_example = get_template(templates, "function")
+    assert format_example == ""
+    assert "{format_example}" not in prompt and "[CONTENT]" not in prompt
+    assert "## Product Goals" in prompt
+
+
+@pytest.mark.asyncio
+async def test_openai_aask_function(llm):
+    function = ActionOutput.create_function("prd", MAPPING)
+    assert json.loads(await llm.aask_function("hi", function)) == ARGUMENTS
+    assert llm.acreate.call_args.kwargs["functions"] == [function]
+
+
+@pytest.mark.asyncio
+async def test_aask_v1_with_function_format(llm):
+    output = await Action(llm=llm)._aask_v1("hi", "prd", MAPPING, format="function")
+    assert output.instruct_content.dict() == ARGUMENTS
+    assert json.loads(output.content) == ARGUMENTS
+
+
+@pytest.mark.asyncio
+async def test_json_mode_without_function_calling(mocker):
+    aask = mocker.patch.object(Claude2, "aask", return_value=f"[CONTENT]{json.dumps(ARGUMENTS)}[/CONTENT]")
+    output = await Action(llm=Claude2())._aask_v1("hi", "prd", MAPPING, format="function")
+    assert output.instruct_content.dict() == ARGUMENTS
+    assert '"Product Goals"' in aask.call_args.args[0]  # the schema is in the prompt
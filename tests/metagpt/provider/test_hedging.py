@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/13 14:05
+@File    : test_hedging.py
+"""
+import asyncio
+
+import pytest
+
+from metagpt.actions import Action
+from metagpt.config import CONFIG
+from metagpt.provider.hedging import (
+    MIN_SAMPLES,
+    LatencyTracker,
+    LatencyTrackerManager,
+    hedge,
+    hedge_stream,
+    hedging,
+    hedging_enabled,
+)
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.utils.singleton import Singleton
+
+
+@pytest.fixture(autouse=True)
+def hedge_config(mocker):
+    mocker.patch.object(CONFIG, "llm_hedge", True)
+    mocker.patch.object(CONFIG, "llm_hedge_delay", 0.05)
+    yield
+    Singleton._instances.pop(LatencyTrackerManager, None)
+
+
+def make_start(delays):
+    """Each call of the returned function is served with the next delay"""
+    calls = iter(delays)
+
+    async def start():
+        delay = next(calls)
+        await asyncio.sleep(delay)
+        return delay
+
+    return start
+
+
+def test_percentile(mocker):
+    mocker.patch.object(CONFIG, "llm_hedge_percentile", 90)
+    tracker = LatencyTracker()
+    assert tracker.deadline() == 0.05
+    for i in range(1, 101):
+        tracker.record(i / 10)
+    assert tracker.percentile(95) == 9.5
+    assert tracker.deadline() == 9.0
+    assert len(tracker.samples) >= MIN_SAMPLES
+
+
+def test_hedging_is_opt_in(mocker):
+    assert not hedging_enabled()
+    with hedging():
+        assert hedging_enabled()
+        with hedging(False):
+            assert not hedging_enabled()
+    mocker.patch.object(CONFIG, "llm_hedge", False)
+    with hedging():
+        assert not hedging_enabled()
+
+
+@pytest.mark.asyncio
+async def test_hedge_takes_the_faster_request():
+    tracker = LatencyTracker()
+    cancelled = []
+    assert await hedge(make_start([1, 0.01]), tracker, on_cancelled=lambda: cancelled.append(1)) == 0.01
+    assert (tracker.hedged, tracker.hedge_won, len(cancelled)) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_within_deadline():
+    tracker = LatencyTracker()
+    assert await hedge(make_start([0.01]), tracker) == 0.01
+    assert tracker.hedged == 0
+
+
+@pytest.mark.asyncio
+async def test_hedge_survives_a_failed_request():
+    async def start():
+        await asyncio.sleep(0.1)
+        raise ConnectionError()
+
+    tracker = LatencyTracker()
+    calls = iter([start, make_start([0.01])])
+    assert await hedge(lambda: next(calls)(), tracker) == 0.01
+
+    with pytest.raises(ConnectionError):
+        await hedge(start, tracker)
+
+
+@pytest.mark.asyncio
+async def test_hedge_stream():
+    closed = []
+
+    async def stream(delay, name):
+        try:
+            await asyncio.sleep(delay)
+            for delta in [name, "!"]:
+                yield delta
+        finally:
+            closed.append(name)
+
+    tracker = LatencyTracker()
+    streams = iter([stream(1, "slow"), stream(0.01, "fast")])
+    assert [i async for i in hedge_stream(lambda: next(streams), tracker)] == ["fast", "!"]
+    assert sorted(closed) == ["fast", "slow"]
+    assert tracker.hedge_won == 1
+
+
+@pytest.mark.asyncio
+async def test_openai_hedged_completion(mocker):
+    delays = iter([1, 0.01])
+
+    async def acreate(**kwargs):
+        await asyncio.sleep(next(delays))
+        return {"choices": [{"message": {"role": "assistant", "content": "hi"}}], "usage": {}}
+
+    mocker.patch("openai.ChatCompletion.acreate", side_effect=acreate)
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+    mocker.patch.object(llm, "_calc_usage", return_value={"prompt_tokens": 10, "completion_tokens": 0})
+    update_cost = mocker.patch.object(llm._cost_manager, "update_cost", return_value=0.0)
+
+    with hedging():
+        assert await llm.acompletion_text([llm._user_msg("hello")]) == "hi"
+    update_cost.assert_called_once_with(10, 0, llm.model)  # the cancelled request's prompt
+    assert llm.get_hedge_stats()[f"{llm.model}:completion"]["hedge_won"] == 1
+
+
+@pytest.mark.asyncio
+async def test_openai_hedged_stream_bills_both(mocker):
+    delays = iter([1, 0.01])
+
+    async def chunks():
+        yield {"choices": [{"delta": {"content": "hi"}}]}
+
+    async def acreate(**kwargs):
+        await asyncio.sleep(next(delays))  # the first request stalls before answering
+        return chunks()
+
+    mocker.patch("openai.ChatCompletion.acreate", side_effect=acreate)
+    llm = OpenAIGPTAPI()
+    llm.stream_sinks = []
+    mocker.patch.object(llm._cache, "enabled", False)
+    mocker.patch.object(llm, "_calc_usage", return_value={"prompt_tokens": 10, "completion_tokens": 0})
+    update_cost = mocker.patch.object(llm._cost_manager, "update_cost", return_value=0.0)
+
+    with hedging():
+        assert await llm.aask("hello") == "hi"
+    assert update_cost.call_count == 2  # the answer and the cancelled request's prompt
+
+
+@pytest.mark.asyncio
+async def test_action_stream_abandoned():
+    class Llm:
+        async def aask_stream(self, prompt, system_msgs):
+            for delta in ("a", "b"):
+                assert hedging_enabled()
+                yield delta
+
+    class Critical(Action):
+        hedge = True
+
+    stream = Critical(llm=Llm())._aask_stream("hi")
+    assert await stream.__anext__() == "a"
+    assert not hedging_enabled()  # between steps, in the consumer's context
+    await stream.aclose()
+    assert not hedging_enabled()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/4 11:02
+@File    : test_llm_cache.py
+"""
+from unittest.mock import AsyncMock
+
+import pytest
+
+from metagpt.provider.llm_cache import LLMCacheMissError, LLMResponseCache
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.utils.singleton import Singleton
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+RSP = {"choices": [{"message": {"role": "assistant", "content": "hi"}}], "usage": {"prompt_tokens": 8, "completion_tokens": 1}}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    Singleton._instances.pop(LLMResponseCache, None)
+    cache = LLMResponseCache(path=tmp_path / "llm_cache.db", max_entries=2, ttl=0, replay_only=False, enabled=True)
+    yield cache
+    cache.close()
+    Singleton._instances.pop(LLMResponseCache, None)
+
+
+def test_make_key_is_stable():
+    key = LLMResponseCache.make_key("gpt-4", MESSAGES, 0.3, 1500)
+    assert key == LLMResponseCache.make_key("gpt-4", [dict(MESSAGES[0])], 0.3, 1500)
+    assert key != LLMResponseCache.make_key("gpt-4", MESSAGES, 0.7, 1500)
+
+
+def test_get_and_set(cache):
+    assert cache.get("a") is None
+    cache.set("a", RSP)
+    assert cache.get("a") == RSP
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_lru_eviction(cache):
+    cache.set("a", RSP)
+    cache.set("b", RSP)
+    cache.get("a")
+    cache.set("c", RSP)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == RSP
+
+
+def test_ttl(cache):
+    cache.ttl = 1e-9
+    cache.set("a", RSP)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_replay_only(cache):
+    cache.set("a", RSP)
+    cache.replay_only = True
+    assert cache.get("a") == RSP
+    with pytest.raises(LLMCacheMissError):
+        cache.get("b")
+
+
+@pytest.mark.asyncio
+async def test_acompletion_uses_cache(cache, mocker):
+    llm = OpenAIGPTAPI()
+    llm._cache = cache
+    achat = mocker.patch.object(llm, "_achat_completion", AsyncMock(return_value=RSP))
+    assert await llm.acompletion(MESSAGES) == RSP
+    assert await llm.acompletion_text(MESSAGES) == "hi"
+    achat.assert_awaited_once()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/6 11:30
+@File    : test_llm_registry.py
+"""
+import openai
+import pytest
+
+from metagpt.actions import Action
+from metagpt.llm import get_llm
+from metagpt.provider.anthropic_api import AnthropicClientPool
+from metagpt.provider.llm_registry import LLMRegistry
+from metagpt.provider.openai_api import AioSessionPool
+
+
+def test_get_llm_is_shared():
+    assert get_llm() is get_llm()
+    assert get_llm("gpt-3.5-turbo").model == "gpt-3.5-turbo"
+    assert get_llm("gpt-3.5-turbo") is not get_llm("gpt-3.5-turbo", auto_max_tokens=True)
+    assert get_llm("gpt-3.5-turbo", auto_max_tokens=True).auto_max_tokens
+    assert get_llm(temperature=0).temperature == 0 and get_llm().temperature
+
+
+def test_actions_share_llm():
+    assert Action().llm is Action().llm
+
+
+@pytest.mark.asyncio
+async def test_aio_session_pool():
+    pool = AioSessionPool()
+    session = pool.get("https://api.openai.com/v1")
+    assert pool.get("https://api.openai.com/v1") is session
+    with pool.use("https://api.openai.com/v1"):
+        assert openai.aiosession.get() is session
+    assert openai.aiosession.get() is None
+    await pool.close()
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_registry_aclose():
+    session = AioSessionPool().get("https://api.openai.com/v1")
+    client = AnthropicClientPool().get_async("sk-ant")
+    await LLMRegistry().aclose()
+    assert session.closed
+    assert client._client.is_closed
+    assert AioSessionPool().get("https://api.openai.com/v1") is not session
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/8 10:40
+@File    : test_openai_batch.py
+"""
+import asyncio
+
+import pytest
+from openai.error import APIConnectionError
+from tenacity import wait_none
+
+from metagpt.provider.openai_api import OpenAIGPTAPI
+
+
+def make_batch(n):
+    return [[{"role": "user", "content": str(i)}] for i in range(n)]
+
+
+@pytest.fixture
+def llm(mocker):
+    llm = OpenAIGPTAPI()
+    llm.in_flight = llm.max_in_flight = 0
+    failed = set()
+
+    async def acompletion(messages):
+        idx = int(messages[0]["content"])
+        llm.in_flight += 1
+        llm.max_in_flight = max(llm.max_in_flight, llm.in_flight)
+        try:
+            # earlier prompts are slower, so they finish out of order
+            await asyncio.sleep(0.01 * (5 - idx % 5))
+            if idx == 3 and idx not in failed:
+                failed.add(idx)
+                raise APIConnectionError("connection reset")
+            return {"choices": [{"message": {"role": "assistant", "content": f"answer {idx}"}}]}
+        finally:
+            llm.in_flight -= 1
+
+    mocker.patch.object(llm, "acompletion", side_effect=acompletion)
+    mocker.patch.object(OpenAIGPTAPI._acompletion_with_retry.retry, "wait", wait_none())
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_acompletion_batch_keeps_order(llm):
+    results = await llm.acompletion_batch_text(make_batch(10))
+    assert results == [f"answer {i}" for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_acompletion_batch_sliding_window(llm):
+    await llm.acompletion_batch(make_batch(10), concurrency=3)
+    assert llm.max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_acompletion_batch_as_completed(llm):
+    order = [idx async for idx, _ in llm.acompletion_batch_as_completed(make_batch(5), concurrency=5)]
+    assert sorted(order) == list(range(5))
+    assert order != list(range(5))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/7 16:05
+@File    : test_openai_stream.py
+"""
+import pytest
+
+from metagpt.provider.base_gpt_api import StreamSink
+from metagpt.provider.openai_api import OpenAIGPTAPI
+
+
+class ListSink(StreamSink):
+    def __init__(self):
+        self.deltas = []
+        self.ended = False
+
+    def write(self, delta: str):
+        self.deltas.append(delta)
+
+    def end(self):
+        self.ended = True
+
+
+@pytest.fixture
+def llm(mocker):
+    async def chunks():
+        for content in ["Hello", ", ", "world"]:
+            yield {"choices": [{"delta": {"content": content}}]}
+
+    async def acreate(**kwargs):
+        assert kwargs["stream"]
+        return chunks()
+
+    mocker.patch("openai.ChatCompletion.acreate", side_effect=acreate)
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_astream(llm):
+    deltas = [delta async for delta in llm.aask_stream("hi")]
+    assert deltas == ["Hello", ", ", "world"]
+
+
+@pytest.mark.asyncio
+async def test_aask_writes_to_sinks(llm):
+    sink = ListSink()
+    llm.stream_sinks = [sink]
+    assert await llm.aask("hi") == "Hello, world"
+    assert sink.deltas == ["Hello", ", ", "world"]
+    assert sink.ended
+
+
+@pytest.mark.asyncio
+async def test_sinks_per_instance_and_call(llm):
+    assert llm.stream_sinks is not OpenAIGPTAPI().stream_sinks
+    default, sink = ListSink(), ListSink()
+    llm.stream_sinks = [default]
+    assert await llm.acompletion_text([{"role": "user", "content": "hi"}], stream=True, sinks=[sink]) == "Hello, world"
+    assert sink.deltas == ["Hello", ", ", "world"]
+    assert default.deltas == []
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/5 15:10
+@File    : test_rate_limiter.py
+"""
+import time
+
+import pytest
+
+from metagpt.provider.rate_limiter import RateLimiterManager, TokenBucket, TokenBucketRateLimiter
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(60) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    # requests larger than the bucket only wait for a full bucket
+    assert bucket.wait_time(1000) == pytest.approx(60, abs=0.05)
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_requests():
+    limiter = TokenBucketRateLimiter(rpm=600)
+    limiter.requests.level = 0
+    start = time.monotonic()
+    await limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_record_usage_settles_tokens():
+    limiter = TokenBucketRateLimiter(tpm=1000)
+    await limiter.acquire(100)
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+    limiter.record_usage(100, {"prompt_tokens": 100, "completion_tokens": 300})
+    assert limiter.tokens.level == pytest.approx(600, abs=1)
+
+
+def test_manager_shares_limiters():
+    manager = RateLimiterManager()
+    assert manager.get("gpt-4", rpm=10) is manager.get("gpt-4", rpm=10)
+    assert manager.get("gpt-4", rpm=10) is not manager.get("gpt-3.5-turbo", rpm=10)
+    limiter = manager.get("gpt-4", rpm=10)
+    other = manager.get("gpt-4", rpm=20)
+    assert other is not limiter
+    assert manager.get("gpt-4", rpm=10) is limiter  # not replaced, its state kept
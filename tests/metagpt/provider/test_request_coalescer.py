@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/8 16:02
+@File    : test_request_coalescer.py
+"""
+import asyncio
+
+import pytest
+
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.provider.request_coalescer import RequestCoalescer
+
+RSP = {"choices": [{"message": {"role": "assistant", "content": "hi"}}]}
+
+
+@pytest.mark.asyncio
+async def test_coalesce_identical_requests():
+    coalescer = RequestCoalescer()
+    calls, coalesced = coalescer.calls, coalescer.coalesced
+
+    async def request():
+        await asyncio.sleep(0.01)
+        return "rsp"
+
+    results = await asyncio.gather(*[coalescer.run("key", request) for _ in range(3)], coalescer.run("other", request))
+    assert results == ["rsp"] * 4
+    assert coalescer.calls - calls == 2
+    assert coalescer.coalesced - coalesced == 2
+    assert coalescer.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_coalesce_failure_is_shared():
+    async def request():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*[RequestCoalescer().run("key", request) for _ in range(2)], return_exceptions=True)
+    assert all(isinstance(i, ValueError) for i in results)
+
+
+@pytest.mark.asyncio
+async def test_acompletion_coalesced(mocker):
+    llm = OpenAIGPTAPI()
+    llm.temperature = 0
+
+    async def achat_completion(messages, functions=None):
+        await asyncio.sleep(0.01)
+        return RSP
+
+    achat = mocker.patch.object(llm, "_achat_completion", side_effect=achat_completion)
+    messages = [{"role": "user", "content": "hello"}]
+    rsps = await asyncio.gather(llm.acompletion(messages), llm.acompletion(messages))
+    assert rsps == [RSP, RSP]
+    assert rsps[0] is not rsps[1]  # each caller can change its own response
+    assert achat.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_sampled_acompletion_not_coalesced(mocker):
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+
+    async def achat_completion(messages, functions=None):
+        await asyncio.sleep(0.01)
+        return RSP
+
+    achat = mocker.patch.object(llm, "_achat_completion", side_effect=achat_completion)
+    messages = [{"role": "user", "content": "hello"}]
+    assert await asyncio.gather(llm.acompletion(messages), llm.acompletion(messages)) == [RSP, RSP]
+    assert achat.call_count == 2
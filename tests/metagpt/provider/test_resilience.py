@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/12 17:30
+@File    : test_resilience.py
+"""
+import email.utils
+import time
+from contextlib import nullcontext
+
+import pytest
+import pytest_asyncio
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    InvalidRequestError,
+    RateLimitError,
+)
+from tenacity import RetryCallState, wait_none
+
+from metagpt.config import CONFIG
+from metagpt.provider.base_gpt_api import StreamSink
+from metagpt.provider.llm_cache import LLMCacheMissError
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.provider.resilience import (
+    CIRCUIT_OPEN,
+    FATAL,
+    RATE_LIMIT,
+    TRANSIENT,
+    CircuitBreaker,
+    CircuitOpenError,
+    StreamInterruptedError,
+    classify_error,
+    get_request_timeout,
+    get_retry_after,
+    is_llm_error,
+    retry_if_not_llm_error,
+    wait_decorrelated_jitter,
+)
+from metagpt.tools.mock_llm_server import MockLLMServer
+
+
+def failed_state(e: Exception) -> RetryCallState:
+    state = RetryCallState(None, None, (), {})
+    state.set_exception((type(e), e, None))
+    return state
+
+
+@pytest.mark.parametrize(
+    ("error", "expected"),
+    [
+        (RateLimitError("slow down"), RATE_LIMIT),
+        (APIConnectionError("reset"), TRANSIENT),
+        (APIError("bad gateway", http_status=502), TRANSIENT),
+        (APIError("stream broken"), TRANSIENT),
+        (InvalidRequestError("too long", "messages"), FATAL),
+        (CircuitOpenError("api", 5), CIRCUIT_OPEN),
+        (LLMCacheMissError("key"), FATAL),
+        (ValueError(), FATAL),
+    ],
+)
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_cache_miss_not_retried_by_callers():
+    assert is_llm_error(LLMCacheMissError("key"))
+    assert not retry_if_not_llm_error(failed_state(LLMCacheMissError("key")))
+    assert retry_if_not_llm_error(failed_state(ValueError()))
+
+
+def test_get_retry_after():
+    assert get_retry_after(RateLimitError(headers={"retry-after": "7"})) == 7
+    assert get_retry_after(RateLimitError(headers={"retry-after-ms": "1500"})) == 1.5
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 < get_retry_after(RateLimitError(headers={"retry-after": date})) <= 30
+    assert get_retry_after(RateLimitError()) is None
+    assert get_retry_after(CircuitOpenError("api", 5)) == 5
+
+
+def test_get_request_timeout(mocker):
+    mocker.patch.object(CONFIG, "llm_timeout", 0)
+    assert get_request_timeout(2000) > get_request_timeout(100)
+    mocker.patch.object(CONFIG, "llm_timeout", 42)
+    assert get_request_timeout(2000) == 42
+
+
+def test_wait_decorrelated_jitter():
+    wait = wait_decorrelated_jitter(base=1, cap=10)
+    state = failed_state(APIConnectionError("reset"))
+    sleeps = [wait(state) for _ in range(20)]
+    assert all(1 <= i <= 10 for i in sleeps)
+    assert len(set(sleeps)) > 1
+
+    assert 7 <= wait(failed_state(RateLimitError(headers={"retry-after": "7"}))) <= 8
+    assert wait(failed_state(RateLimitError(headers={"retry-after": "600"}))) == 10
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("api", min_requests=4, threshold=0.5, cooldown=0.05)
+    for failed in (False, True, False, True):
+        with pytest.raises(APIConnectionError) if failed else nullcontext():
+            with breaker.guard():
+                if failed:
+                    raise APIConnectionError("reset")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pass
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(failed=False)
+    assert breaker.state == "closed"
+
+
+def test_circuit_breaker_ignores_fatal_and_rate_limit_errors():
+    breaker = CircuitBreaker("api", min_requests=2)
+    for e in (InvalidRequestError("too long", "messages"), RateLimitError("slow down")) * 2:
+        with pytest.raises(type(e)):
+            with breaker.guard():
+                raise e
+    assert breaker.state == "closed"
+
+
+@pytest_asyncio.fixture
+async def server(mocker):
+    server = MockLLMServer(port=0, latency="fixed", latency_mean=0, tokens_per_second=0, retry_after=0)
+    url = await server.start()
+    mocker.patch.object(CONFIG, "openai_api_base", url)
+    mocker.patch("openai.api_base", url)
+    yield server
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_are_retried(server, mocker):
+    mocker.patch.object(OpenAIGPTAPI.acompletion_text.retry, "wait", wait_none())
+    server.error_rates[429] = 1
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+    with pytest.raises(RateLimitError):
+        await llm.acompletion_text([llm._user_msg("hi")])
+    assert server.stats["requests"] == CONFIG.llm_max_attempts
+
+    server.error_rates[429] = 0
+    assert await llm.acompletion_text([llm._user_msg("hi")]) == "This is a mock response."
+
+
+class RecordingSink(StreamSink):
+    def __init__(self):
+        self.deltas = []
+
+    def write(self, delta: str):
+        self.deltas.append(delta)
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stream_not_retried(mocker):
+    mocker.patch.object(OpenAIGPTAPI.acompletion_text.retry, "wait", wait_none())
+    llm = OpenAIGPTAPI()
+    llm.stream_sinks = [RecordingSink()]
+    attempts = []
+
+    async def astream(messages):
+        attempts.append(messages)
+        if len(attempts) > 1:
+            yield "Hello"
+        raise APIConnectionError("reset")
+
+    mocker.patch.object(llm, "astream", astream)
+    with pytest.raises(StreamInterruptedError):
+        await llm.acompletion_text([llm._user_msg("hi")], stream=True)
+    assert len(attempts) == 2  # retried before the first delta only
+    assert llm.stream_sinks[0].deltas == ["Hello"]
@@ -6,9 +6,11 @@
 @File    : test_environment.py
 """
 
+import io
+
 import pytest
 
-from metagpt.actions import BossRequirement
+from metagpt.actions import Action, BossRequirement
 from metagpt.environment import Environment
 from metagpt.logs import logger
 from metagpt.manager import Manager
@@ -54,3 +56,137 @@ async def test_publish_and_process_message(env: Environment):
     await env.run(k=2)
     logger.info(f"{env.history=}")
     assert len(env.history) > 10
+
+
+@pytest.mark.asyncio
+async def test_observe_only_new_messages(env: Environment):
+    role = ProductManager("Alice", "Product Manager", "create a new product", "limited resources")
+    env.add_role(role)
+    env.publish_message(Message("Write a cli snake game", role="BOSS", cause_by=BossRequirement))
+    env.publish_message(Message("Not watched", role="QA"))
+
+    assert await role._observe() == 1
+    assert role._rc.env_cursor == 2
+    assert role._rc.memory.count() == 2
+    assert not role._rc.memory.storage  # a view over the environment's log, no copy
+    assert await role._observe() == 0
+
+    env.publish_message(Message("Write a web snake game", role="BOSS", cause_by=BossRequirement))
+    assert await role._observe() == 1
+    assert [i.content for i in role._rc.news] == ["Write a web snake game"]
+    assert env.get_messages_since(2)[0].content == "Write a web snake game"
+
+
+class Relay(Role):
+    """Answer each watched message with one caused by `action`"""
+
+    def __init__(self, profile, watch, action):
+        super().__init__(profile, profile)
+        self._init_actions([action])
+        self._watch(watch)
+        self.action = action
+        self.acted = 0
+
+    async def _think(self):
+        self._set_state(0)
+
+    async def _act(self) -> Message:
+        self.acted += 1
+        msg = Message(f"{self.profile} {self.acted}", role=self.profile, cause_by=self.action)
+        self._rc.memory.add(msg)
+        return msg
+
+
+class Draft(Action):
+    pass
+
+
+class Review(Action):
+    pass
+
+
+class Publish(Action):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_run_until_idle(env: Environment):
+    writer = Relay("Writer", [BossRequirement], Draft)
+    reviewer = Relay("Reviewer", [Draft], Review)
+    idle = Relay("Idle", [Publish], Publish)  # nothing it watches is published
+    env.add_roles([writer, reviewer, idle])
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+
+    assert await env.run_until_idle(max_runs=5) == 2
+    assert (writer.acted, reviewer.acted, idle.acted) == (1, 1, 0)
+    assert [i.content for i in env.message_log[1:]] == ["Writer 1", "Reviewer 1"]
+
+
+@pytest.mark.asyncio
+async def test_watch_after_add_role(env: Environment):
+    writer = Relay("Writer", [Publish], Draft)
+    env.add_role(writer)
+    writer._watch([BossRequirement])
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+
+    assert env.get_subscribers(env.message_log[0]) == [writer]
+    assert await env.run_until_idle(max_runs=5) == 1
+    assert writer.acted == 1
+
+
+@pytest.mark.asyncio
+async def test_own_message_absorbed_into_view(env: Environment):
+    writer = Relay("Writer", [BossRequirement], Draft)
+    env.add_role(writer)
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+    await env.run_until_idle(max_runs=5)  # the writer adds its draft to its memory, then publishes it
+    env.publish_message(Message("Write another", role="BOSS", cause_by=BossRequirement))
+    await writer._observe()
+
+    memory = writer._rc.memory
+    assert memory.end == len(env.message_log) and not memory.storage
+    assert memory.get() == env.message_log[:]
+
+
+def test_env_memory_read_only(env: Environment):
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+    assert env.memory.get() == env.message_log[:]
+    with pytest.raises(TypeError):
+        env.memory.add(Message("A poem"))
+
+
+@pytest.mark.asyncio
+async def test_run_until_idle_stops_on_failed_check(env: Environment):
+    writer = Relay("Writer", [BossRequirement], Draft)
+    env.add_role(writer)
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+
+    def check():
+        raise RuntimeError("no money")
+
+    with pytest.raises(RuntimeError):
+        await env.run_until_idle(before_run=check)
+    assert writer.acted == 0
+
+
+@pytest.mark.asyncio
+async def test_run_until_idle_caps_runs(env: Environment):
+    ping = Relay("Ping", [BossRequirement, Review], Draft)
+    pong = Relay("Pong", [Draft], Review)
+    env.add_roles([ping, pong])
+    env.publish_message(Message("Start", role="BOSS", cause_by=BossRequirement))
+
+    assert await env.run_until_idle(max_runs=3) == 6
+    assert (ping.acted, pong.acted) == (3, 3)
+
+
+def test_history(env: Environment):
+    env.publish_message(Message("Write a poem", role="BOSS", cause_by=BossRequirement))
+    assert env.history == "\nBOSS: Write a poem"
+    env.publish_message(Message("A poem", role="Writer", cause_by=Draft))
+    assert env.history == "\nBOSS: Write a poem\nWriter: A poem"
+    assert env.history is env.history  # cached until the next message
+
+    file = io.StringIO()
+    env.write_history(file)
+    assert file.getvalue() == env.history
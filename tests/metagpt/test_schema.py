@@ -5,7 +5,11 @@
 @Author  : alexanderwu
 @File    : test_schema.py
 """
+import weakref
+
+from metagpt.actions import BossRequirement
 from metagpt.schema import AIMessage, Message, SystemMessage, UserMessage
+from metagpt.utils.serialize import deserialize_message, serialize_message
 
 
 def test_messages():
@@ -19,3 +23,38 @@ def test_messages():
     text = str(msgs)
     roles = ['user', 'system', 'assistant', 'QA']
     assert all([i in text for i in roles])
+
+
+def test_message_id():
+    msg = Message("hello", role="QA", cause_by=BossRequirement)
+    assert msg.id == Message("hello", role="QA", cause_by=BossRequirement).id
+    assert msg.id != Message("hello", role="QA").id
+    assert msg.id == deserialize_message(serialize_message(msg)).id
+    assert len({msg, Message("hello", role="QA", cause_by=BossRequirement)}) == 1
+
+    msg.send_to = "Engineer"  # the id follows the fields it hashes
+    assert msg.id == Message("hello", role="QA", cause_by=BossRequirement, send_to="Engineer").id
+
+
+def test_message_slots():
+    msg = Message("hello", role="".join(["Q", "A"]), sent_from="Product Manager")
+    assert not hasattr(msg, "__dict__")
+    assert msg.role is Message("bye", role="QA").role  # interned
+    assert msg.seq < Message("bye").seq
+    assert msg.created_at > 0
+    assert weakref.ref(msg)() is msg
+    msg.send_to = "".join(["Q", "A"])
+    assert msg.send_to is msg.role  # interned when assigned too
+
+    new_msg = deserialize_message(serialize_message(msg))
+    assert new_msg.created_at == msg.created_at
+    assert new_msg.sent_from is msg.sent_from
+    assert new_msg.seq > msg.seq  # the creation order of this process
+
+
+def test_message_pickled_with_dict():
+    msg = Message.__new__(Message)
+    msg.__setstate__({"content": "hello", "instruct_content": None, "role": "QA", "cause_by": "", "sent_from": "",
+                      "send_to": ""})  # pickled before messages had slots
+    assert msg.content == "hello"
+    assert msg.seq and msg.created_at
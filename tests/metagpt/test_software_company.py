@@ -8,6 +8,7 @@
 import pytest
 
 from metagpt.logs import logger
+from metagpt.provider.openai_api import AioSessionPool
 from metagpt.software_company import SoftwareCompany
 
 
@@ -17,3 +18,12 @@ async def test_software_company():
     company.start_project("做一个基础搜索引擎，可以支持知识库")
     history = await company.run(n_round=5)
     logger.info(history)
+
+
+@pytest.mark.asyncio
+async def test_software_company_closes_pools():
+    session = AioSessionPool().get("https://api.openai.com/v1")
+    company = SoftwareCompany()
+    company.invest(3.0)
+    await company.run(n_round=1)
+    assert session.closed
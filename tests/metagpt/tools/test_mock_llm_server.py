@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/11 16:40
+@File    : test_mock_llm_server.py
+"""
+import openai
+import pytest
+import pytest_asyncio
+from openai.error import RateLimitError
+
+from metagpt.actions.write_prd import OUTPUT_MAPPING, templates
+from metagpt.config import CONFIG
+from metagpt.provider.openai_api import OpenAIGPTAPI
+from metagpt.tools.mock_llm_server import MockLLMServer, ScriptedResponder
+from metagpt.utils.common import OutputParser
+
+
+@pytest_asyncio.fixture
+async def server(mocker):
+    server = MockLLMServer(port=0, latency="fixed", latency_mean=0, tokens_per_second=0, seed=0)
+    url = await server.start()
+    mocker.patch.object(CONFIG, "openai_api_base", url)
+    mocker.patch("openai.api_base", url)
+    mocker.patch.object(OpenAIGPTAPI, "_calc_usage", return_value={"prompt_tokens": 1, "completion_tokens": 1})
+    yield server
+    await server.stop()
+
+
+def test_responder_echoes_format_example():
+    prompt = templates["markdown"]["PROMPT_TEMPLATE"].format(
+        requirements="snake game", search_information="", format_example=templates["markdown"]["FORMAT_EXAMPLE"]
+    )
+    content = ScriptedResponder().respond([{"role": "user", "content": prompt}])
+    assert set(OutputParser.parse_data_with_mapping(content, OUTPUT_MAPPING)) == set(OUTPUT_MAPPING)
+
+
+def test_responder_answers_state_prompt():
+    prompt = "Just answer a number between 0-2, choose the most suitable stage"
+    assert ScriptedResponder().respond([{"role": "user", "content": prompt}]) == "0"
+
+
+@pytest.mark.asyncio
+async def test_chat_completion(server):
+    llm = OpenAIGPTAPI()
+    assert await llm.aask("hello") == "This is a mock response."
+    rsp = await llm.acompletion([{"role": "user", "content": "hi"}])
+    assert llm.get_choice_text(rsp) == "This is a mock response."
+    assert server.stats["requests"] == 2
+
+
+@pytest.mark.asyncio
+async def test_error_injection(server):
+    server.error_rates[429] = 1
+    with pytest.raises(RateLimitError):
+        await openai.ChatCompletion.acreate(model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+    assert server.stats["errors"] == 1
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/13 18:10
+@File    : test_metrics.py
+"""
+import asyncio
+
+import pytest
+
+from metagpt.provider.openai_api import Costs, OpenAIGPTAPI
+from metagpt.utils.metrics import Histogram, LLMMetrics, get_metric_tags, metric_tags
+from metagpt.utils.singleton import Singleton
+
+
+@pytest.fixture
+def metrics():
+    Singleton._instances.pop(LLMMetrics, None)
+    yield LLMMetrics()
+    Singleton._instances.pop(LLMMetrics, None)
+
+
+def test_metric_tags():
+    with metric_tags(role="Engineer"):
+        with metric_tags(action="WriteCode"):
+            assert get_metric_tags() == {"role": "Engineer", "action": "WriteCode"}
+        assert get_metric_tags() == {"role": "Engineer"}
+    assert get_metric_tags() == {}
+
+
+def test_histogram():
+    hist = Histogram(buckets=(1, 5, 10))
+    for value in (0.5, 2, 3, 7, 100):
+        hist.observe(value)
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.quantile(0.5) == 5
+    assert hist.quantile(1) == float("inf")
+    assert hist.count == 5 and hist.sum == 112.5
+
+
+def test_summary_and_prometheus(metrics, tmp_path):
+    with metric_tags(role="Engineer", round=1):
+        with metric_tags(action="WriteCode"):
+            metrics.record("gpt-4", 100, 50, 0.006, latency=3, ttft=0.8)
+            metrics.record("gpt-4", 200, 80, 0.01, latency=12)
+        with metric_tags(action="WriteCodeReview"):
+            metrics.record("gpt-4", 10, 5, 0.001, latency=1)
+    with metric_tags(role="Engineer", action="WriteCode", round=2):
+        metrics.record("gpt-4", 1, 1, 0.0001, latency=1)
+
+    summary = metrics.summary()
+    write_code = summary[("Engineer", "WriteCode")]
+    assert (write_code.calls, write_code.prompt_tokens, write_code.completion_tokens) == (3, 301, 131)
+    assert write_code.latency.count == 3 and write_code.ttft.count == 1
+    assert set(metrics.summary(by=["round"])) == {("1",), ("2",)}
+
+    text = metrics.to_prometheus()
+    labels = 'role="Engineer",action="WriteCode",model="gpt-4",round="1"'
+    assert f"metagpt_llm_requests_total{{{labels}}} 2" in text
+    assert f'metagpt_llm_latency_seconds_bucket{{{labels},le="5"}} 1' in text
+    assert f'metagpt_llm_latency_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"metagpt_llm_time_to_first_token_seconds_count{{{labels}}} 1" in text
+
+    path = tmp_path / "metrics.prom"
+    metrics.export(path)
+    assert path.read_text() == text
+    metrics.log_summary()
+
+
+@pytest.mark.asyncio
+async def test_openai_calls_are_recorded(metrics, mocker):
+    async def acreate(**kwargs):
+        await asyncio.sleep(0.01)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": "hi"}}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 3},
+        }
+
+    mocker.patch("openai.ChatCompletion.acreate", side_effect=acreate)
+    llm = OpenAIGPTAPI()
+    mocker.patch.object(llm._cache, "enabled", False)
+    with metric_tags(role="Architect", action="WriteDesign"):
+        await llm.acompletion([llm._user_msg("hello")])
+
+    stats = metrics.summary()[("Architect", "WriteDesign")]
+    assert (stats.calls, stats.prompt_tokens, stats.completion_tokens) == (1, 12, 3)
+    assert stats.cost > 0 and stats.latency.sum >= 0.01
+    assert isinstance(llm.get_costs(), Costs)
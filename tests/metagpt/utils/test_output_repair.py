@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2023/9/14 14:20
+@File    : test_output_repair.py
+"""
+from typing import List
+
+import pytest
+
+from metagpt.actions import Action
+from metagpt.actions.action_output import ActionOutput
+from metagpt.utils.output_repair import (
+    OutputParseError,
+    build_repair_prompt,
+    parse_sections,
+    repair_and_parse,
+)
+
+MAPPING = {
+    "Original Requirements": (str, ...),
+    "Product Goals": (List[str], ...),
+    "Anything UNCLEAR": (str, ...),
+}
+OutputClass = ActionOutput.create_model_class("prd", MAPPING)
+
+MARKDOWN = """## Original Requirements
+```python
+Make a snake game
+```
+
+## Product Goals
+```python
+["Fun", "Simple"]
+```
+
+## Anything UNCLEAR
+Nothing
+"""
+
+JSON = '[CONTENT]\n{"Original Requirements": "Make a snake game", "Product Goals": ["Fun", "Simple"], ' \
+       '"Anything UNCLEAR": "Nothing"}\n[/CONTENT]'
+
+
+def test_valid_answer_is_unchanged():
+    content, output = repair_and_parse(MARKDOWN, OutputClass, MAPPING)
+    assert content == MARKDOWN
+    assert output.dict()["Product Goals"] == ["Fun", "Simple"]
+
+    content, output = repair_and_parse(JSON, OutputClass, MAPPING, "json")
+    assert content.strip().startswith("{")
+    assert output.dict()["Product Goals"] == ["Fun", "Simple"]
+
+
+@pytest.mark.parametrize(
+    "broken",
+    [
+        MARKDOWN.replace("## Product Goals", "# Product Goals:"),
+        MARKDOWN.replace("## Product Goals", "**Product Goals**"),
+        MARKDOWN.replace("## Anything UNCLEAR\nNothing\n", "Anything UNCLEAR:\nNothing"),
+        MARKDOWN.replace('"Simple"]\n```', '"Simple"]'),
+    ],
+)
+def test_markdown_repairs(broken):
+    _, output = repair_and_parse(broken, OutputClass, MAPPING)
+    assert output.dict()["Product Goals"] == ["Fun", "Simple"]
+    assert output.dict()["Anything UNCLEAR"] == "Nothing"
+
+
+@pytest.mark.parametrize(
+    "broken",
+    [
+        JSON.replace("[/CONTENT]", ""),
+        JSON.replace('"Nothing"}', '"Nothing",}'),
+        "```json\n" + JSON.replace("[CONTENT]", "").replace("[/CONTENT]", "") + "\n```",
+        JSON.replace('"Nothing"}\n[/CONTENT]', '"Nothing"'),
+    ],
+)
+def test_json_repairs(broken):
+    _, output = repair_and_parse(broken, OutputClass, MAPPING, "json")
+    assert output.dict()["Product Goals"] == ["Fun", "Simple"]
+
+
+def test_unrepairable_answer():
+    broken = MARKDOWN.replace("## Anything UNCLEAR\nNothing\n", "")
+    with pytest.raises(OutputParseError) as e:
+        repair_and_parse(broken, OutputClass, MAPPING)
+    assert e.value.bad_fields == ["Anything UNCLEAR"]
+    assert e.value.parsed_data["Product Goals"] == ["Fun", "Simple"]
+
+    prompt = build_repair_prompt(e.value, MAPPING)
+    assert "Anything UNCLEAR" in prompt
+    assert "Make a snake game" not in prompt
+
+
+def test_parse_sections():
+    fix = "## Product Goals\n```python\n['Fun']\n```\n## Other\nignored"
+    assert parse_sections(fix, {"Product Goals": MAPPING["Product Goals"]}) == {"Product Goals": ["Fun"]}
+
+
+@pytest.mark.asyncio
+async def test_aask_v1_asks_to_rewrite_only_the_bad_section(mocker):
+    bad = MARKDOWN.replace("## Anything UNCLEAR\nNothing\n", "")
+    fix = "## Anything UNCLEAR\nNothing"
+    aask = mocker.patch("metagpt.provider.openai_api.OpenAIGPTAPI.aask", side_effect=[bad, fix])
+
+    output = await Action()._aask_v1("a long prompt", "prd", MAPPING)
+    assert output.instruct_content.dict()["Anything UNCLEAR"] == "Nothing"
+    assert output.instruct_content.dict()["Product Goals"] == ["Fun", "Simple"]
+    assert aask.call_count == 2
+    repair_prompt = aask.call_args_list[1].args[0]
+    assert "Anything UNCLEAR" in repair_prompt and "a long prompt" not in repair_prompt
@@ -2,12 +2,16 @@
 # -*- coding: utf-8 -*-
 # @Desc   : the unittest of serialize
 
+import pickle
 from typing import List, Tuple
 
-from metagpt.actions import WritePRD
+import pytest
+
+from metagpt.actions import Action, WritePRD
 from metagpt.actions.action_output import ActionOutput
 from metagpt.schema import Message
 from metagpt.utils.serialize import (
+    MessageCodec,
     actionoutout_schema_to_mapping,
     deserialize_message,
     serialize_message,
@@ -64,3 +68,43 @@ def test_serialize_and_deserialize_message():
     assert new_message.content == message.content
     assert new_message.cause_by == message.cause_by
     assert new_message.instruct_content.field1 == out_data["field1"]
+    assert new_message.instruct_content.field2 == out_data["field2"]
+    assert new_message.id == message.id
+    assert b"properties" not in message_ser  # a schema reference only
+
+    # the model class is created once per schema
+    assert type(deserialize_message(message_ser).instruct_content) is type(new_message.instruct_content)
+
+
+def test_codec_schemas_registered():
+    ic_obj = ActionOutput.create_model_class("design", {"field1": (str, ...)})
+    message = Message(content="design", instruct_content=ic_obj(field1="value"), cause_by=WritePRD)
+    encoder = MessageCodec()
+    data = encoder.encode(message)
+
+    decoder = MessageCodec()  # e.g. in the process recovering the memory
+    decoder.register(encoder.schemas_of(message))
+    assert decoder.decode(data).instruct_content.field1 == "value"
+
+
+def test_codec_rejects_what_it_cannot_decode():
+    codec = MessageCodec()
+    ic_obj = ActionOutput.create_model_class("tasks", {"count": (int, ...)})
+    with pytest.raises(ValueError, match="count"):
+        codec.encode(Message(content="tasks", instruct_content=ic_obj(count=1)))
+    with pytest.raises(ValueError, match="count"):
+        codec._add_schema("tasks", {"count": (int, ...)})
+
+    class LocalAction(Action):
+        pass
+
+    with pytest.raises(ValueError, match="LocalAction"):
+        codec.encode(Message(content="local", cause_by=LocalAction))
+
+
+def test_deserialize_legacy_message():
+    message = Message(content="prd demand", role="user", cause_by=WritePRD)
+    message.instruct_content = {"class": "prd", "mapping": {"field1": (str, ...)}, "value": {"field1": "value"}}
+    new_message = deserialize_message(pickle.dumps(message))
+    assert new_message.cause_by is WritePRD
+    assert new_message.instruct_content.field1 == "value"
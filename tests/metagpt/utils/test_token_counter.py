@@ -7,7 +7,14 @@
 """
 import pytest
 
-from metagpt.utils.token_counter import count_message_tokens, count_string_tokens
+from metagpt.utils import token_counter
+from metagpt.utils.token_counter import (
+    count_many,
+    count_message_tokens,
+    count_string_tokens,
+    get_encoding,
+    get_max_completion_tokens,
+)
 
 
 def test_count_message_tokens():
@@ -67,3 +74,31 @@ def test_count_string_tokens_gpt_4():
 
     string = "Hello, world!"
     assert count_string_tokens(string, model_name="gpt-4-0314") == 4
+
+
+def test_count_many():
+    strings = ["Hello, world!", "", "Hello, world!"]
+    assert count_many(strings, model_name="gpt-3.5-turbo-0301") == [4, 0, 4]
+
+
+def test_get_encoding_is_cached():
+    assert get_encoding("gpt-4") is get_encoding("gpt-4")
+    assert get_encoding("invalid_model").name == "cl100k_base"
+
+
+def test_get_max_completion_tokens_claude(mocker):
+    mocker.patch("metagpt.utils.token_counter._count_tokens", return_value=1)
+    messages = [{"role": "user", "content": "Hello"}]
+    # 3 per message, 1 per key, 3 to prime the reply
+    assert get_max_completion_tokens(messages, "claude-2", 1024) == 100000 - 8 - 1
+    assert get_max_completion_tokens(messages, "unknown-model", 1024) == 1024
+
+
+def test_only_short_strings_memoized(mocker):
+    mocker.patch.object(token_counter, "get_encoding").return_value.encode = str.split
+    token_counter._count_short_tokens.cache_clear()
+    long_string = "token " * token_counter.TOKEN_COUNT_CACHE_MAX_CHARS
+    assert count_string_tokens(long_string, "gpt-4") == token_counter.TOKEN_COUNT_CACHE_MAX_CHARS
+    assert count_string_tokens("a short one", "gpt-4") == 3
+    assert token_counter._count_short_tokens.cache_info().currsize == 1
+    token_counter._count_short_tokens.cache_clear()  # counted with the fake encoding